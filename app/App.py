@@ -1,7 +1,6 @@
 # to host the app, run the command after starting app: 
 # ngrok http http://localhost:5000
 # ngrok http --url=engaged-sunfish-terribly.ngrok-free.app 5000
-import io
 from io import BytesIO
 import re
 import secrets
@@ -14,31 +13,46 @@ from flask import (
     url_for,
     session,
     send_file,
+    Response,
+    stream_with_context,
+    g,
+    has_app_context,
 )
 from flask_cors import CORS
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-import pytesseract
-from PIL import Image
-import pdfplumber
-from docx import Document
-import pandas as pd
-import openpyxl
 import os
 import openai
 import json
-import csv
 import html
 import uuid
-from datetime import datetime, timedelta
+import time
+import threading
+import queue
+import zlib
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from werkzeug.datastructures import FileStorage
 from dotenv import load_dotenv
+from extractors import extract_text, get_extractor, hash_upload, upload_size, settings_fingerprint, EXTRACTOR_VERSION
+from cache import TextCache, ResponseCache
+from tokens import estimate_tokens, clip_to_tokens, split_into_chunks
+from retrieval import Retriever
+from metrics import Registry
 
 # Load environment details from .env file
 load_dotenv()
 API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_ID = os.getenv("OPENAI_MODEL_ID")
 os.environ["OPENAI_API_KEY"] = API_KEY
+# Optional OpenAI-compatible endpoint, e.g. the fake server in loadtest/ (http://127.0.0.1:8001/v1)
+BASE_URL = os.getenv("OPENAI_BASE_URL")
+if BASE_URL:
+    openai.base_url = BASE_URL
+# Retries of failed OpenAI calls (429s and 5xx), done by the client before an error reaches the app
+openai.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", 2))
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -60,18 +74,184 @@ app.config["ALLOWED_EXTENSIONS"] = {
     "json",
 }
 app.config["MAX_CONTENT_LENGTH"] = 500 * 1024 * 1024
+# SQLite database file, idle connections kept for reuse and lock wait time (milliseconds)
+app.config["DATABASE"] = os.getenv("DATABASE_PATH", "database.db")
+app.config["DB_POOL_SIZE"] = int(os.getenv("DB_POOL_SIZE", 8))
+app.config["DB_BUSY_TIMEOUT_MS"] = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+# Cap on the text extracted from a single upload (characters)
+app.config["MAX_EXTRACTED_CHARS"] = int(os.getenv("MAX_EXTRACTED_CHARS", 500000))
+# Extracted text cache: directory and size limits of the memory and disk tiers (MB)
+app.config["TEXT_CACHE_DIR"] = os.getenv("TEXT_CACHE_DIR", os.path.join("cache", "text"))
+app.config["TEXT_CACHE_MEMORY_MB"] = int(os.getenv("TEXT_CACHE_MEMORY_MB", 64))
+app.config["TEXT_CACHE_DISK_MB"] = int(os.getenv("TEXT_CACHE_DISK_MB", 1024))
+# LLM response cache: database path, entry lifetime (seconds, 0 disables) and size
+app.config["LLM_CACHE_PATH"] = os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm_cache.db"))
+app.config["LLM_CACHE_TTL"] = int(os.getenv("LLM_CACHE_TTL", 24 * 60 * 60))
+app.config["LLM_CACHE_MAX_ENTRIES"] = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+# Conversation history: token budget for history in each prompt, token limit for a
+# single stored message (longer ones, like file dumps, are clipped) and rows scanned
+app.config["HISTORY_TOKEN_BUDGET"] = int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))
+app.config["HISTORY_MAX_TURN_TOKENS"] = int(os.getenv("HISTORY_MAX_TURN_TOKENS", 400))
+app.config["HISTORY_MAX_TURNS"] = int(os.getenv("HISTORY_MAX_TURNS", 50))
+# Older turns are summarized in the background by SUMMARY_WORKERS threads; once more than
+# HISTORY_SUMMARY_BACKLOG turns would be left out of a prompt, the request waits for the summary
+app.config["SUMMARY_WORKERS"] = int(os.getenv("SUMMARY_WORKERS", 1))
+app.config["HISTORY_SUMMARY_BACKLOG"] = int(os.getenv("HISTORY_SUMMARY_BACKLOG", 4))
+# Retrieval of ISO QA references for chat prompts: index exported by llm_training/LLM training.py,
+# number of references (0 disables), lowest cosine similarity used and token budget for them
+app.config["RAG_INDEX_DIR"] = os.getenv("RAG_INDEX_DIR", "rag_index")
+app.config["RAG_TOP_K"] = int(os.getenv("RAG_TOP_K", 3))
+app.config["RAG_MIN_SCORE"] = float(os.getenv("RAG_MIN_SCORE", 0.4))
+app.config["RAG_CONTEXT_TOKENS"] = int(os.getenv("RAG_CONTEXT_TOKENS", 1200))
+# Search a quantized copy of the index first ("binary", "int8", or "none" for exact search only)
+# and rescore the best RAG_RESCORE_FACTOR * k candidates with the float32 vectors
+app.config["RAG_QUANTIZATION"] = os.getenv("RAG_QUANTIZATION", "binary")
+app.config["RAG_RESCORE_FACTOR"] = int(os.getenv("RAG_RESCORE_FACTOR", 10))
+# Chat history API: default and maximum page size, and characters of each message returned
+app.config["HISTORY_PAGE_SIZE"] = int(os.getenv("HISTORY_PAGE_SIZE", 20))
+app.config["HISTORY_MAX_PAGE_SIZE"] = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 100))
+app.config["HISTORY_PREVIEW_CHARS"] = int(os.getenv("HISTORY_PREVIEW_CHARS", 2000))
+# Chat history export: rows fetched from the database and bytes written out at a time
+app.config["EXPORT_FETCH_ROWS"] = int(os.getenv("EXPORT_FETCH_ROWS", 500))
+app.config["EXPORT_WRITE_BYTES"] = int(os.getenv("EXPORT_WRITE_BYTES", 64 * 1024))
+# Write-behind saving of chat messages (off by default): messages are inserted by a writer
+# thread in batches of up to WRITE_BEHIND_BATCH_SIZE, at most WRITE_BEHIND_INTERVAL seconds late
+app.config["WRITE_BEHIND"] = os.getenv("WRITE_BEHIND", "0") == "1"
+app.config["WRITE_BEHIND_BATCH_SIZE"] = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+app.config["WRITE_BEHIND_INTERVAL"] = float(os.getenv("WRITE_BEHIND_INTERVAL", 0.2))
+# Background report jobs: worker pool size and how long finished jobs are kept (seconds)
+app.config["REPORT_WORKERS"] = int(os.getenv("REPORT_WORKERS", 2))
+app.config["REPORT_JOB_TTL"] = int(os.getenv("REPORT_JOB_TTL", 24 * 60 * 60))
+# A running job whose worker has not touched it for REPORT_JOB_STALE_SECONDS is taken to be
+# orphaned (its process died) and queued again; live workers touch their jobs well within that
+app.config["REPORT_JOB_STALE_SECONDS"] = int(os.getenv("REPORT_JOB_STALE_SECONDS", 120))
+# Reports on documents above REPORT_CHUNK_TOKENS are analysed in chunks, REPORT_FANOUT at a time
+app.config["REPORT_CHUNK_TOKENS"] = int(os.getenv("REPORT_CHUNK_TOKENS", 6000))
+app.config["REPORT_FANOUT"] = int(os.getenv("REPORT_FANOUT", 4))
+
+# Cache of extracted text, keyed by a hash of the uploaded bytes
+text_cache = TextCache(
+    app.config["TEXT_CACHE_DIR"],
+    memory_bytes=app.config["TEXT_CACHE_MEMORY_MB"] * 1024 * 1024,
+    disk_bytes=app.config["TEXT_CACHE_DISK_MB"] * 1024 * 1024,
+)
+
+# Cache of LLM responses, shared between worker processes
+response_cache = ResponseCache(
+    app.config["LLM_CACHE_PATH"],
+    ttl=app.config["LLM_CACHE_TTL"],
+    max_entries=app.config["LLM_CACHE_MAX_ENTRIES"],
+)
 
-# Database connection function
+# Embedding search over the ISO QA corpus, loaded on first use
+retriever = Retriever(
+    app.config["RAG_INDEX_DIR"],
+    quantization=None if app.config["RAG_QUANTIZATION"] == "none" else app.config["RAG_QUANTIZATION"],
+    rescore_factor=app.config["RAG_RESCORE_FACTOR"],
+)
+
+# Request and stage metrics, served on /metrics in the Prometheus text format
+metrics = Registry()
+request_duration = metrics.histogram(
+    "complyzense_request_duration_seconds", "Time to handle a request", ["endpoint", "method", "status"]
+)
+stage_duration = metrics.histogram(
+    "complyzense_stage_duration_seconds",
+    "Time spent in each stage of a request (extract, history, summary, retrieval, llm, save)",
+    ["stage"],
+)
+extract_duration = metrics.histogram(
+    "complyzense_extract_duration_seconds", "Time to parse an upload that was not cached", ["file_type"]
+)
+extracted_bytes = metrics.counter(
+    "complyzense_extracted_bytes_total", "Bytes of uploads parsed", ["file_type"]
+)
+extracted_characters = metrics.counter(
+    "complyzense_extracted_characters_total", "Characters of text extracted from uploads", ["file_type"]
+)
+llm_requests = metrics.counter(
+    "complyzense_llm_requests_total", "Completions by outcome (ok, error, cached, aborted)", ["outcome"]
+)
+llm_tokens = metrics.counter(
+    "complyzense_llm_tokens_total", "Tokens reported by the OpenAI API", ["kind"]
+)
+llm_in_flight = metrics.gauge("complyzense_llm_in_flight", "OpenAI calls waiting for a reply")
+errors = metrics.counter("complyzense_errors_total", "Errors handled by stage", ["stage"])
+
+# Connection handed out by get_db_connection. Callers still call close() when they
+# are done, which only rolls back uncommitted work; the connection itself is reused.
+class PooledConnection(sqlite3.Connection):
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    # Function to actually close the underlying connection
+    def close_for_good(self):
+        sqlite3.Connection.close(self)
+
+# Idle connections shared by requests, and the connection owned by each worker thread
+db_pool = queue.LifoQueue()
+db_thread_local = threading.local()
+db_wal_enabled = False
+
+# Function to open a new connection with the pragmas applied once
+def open_db_connection():
+    global db_wal_enabled
+    conn = sqlite3.connect(
+        app.config["DATABASE"],
+        timeout=app.config["DB_BUSY_TIMEOUT_MS"] / 1000,
+        factory=PooledConnection,
+        check_same_thread=False,  # Connections move between request threads via the pool
+        cached_statements=256,  # Prepared statements are reused across requests
+    )
+    conn.row_factory = sqlite3.Row
+    if not db_wal_enabled:
+        # WAL lets readers run while a message is being written; the mode is stored in the file
+        conn.execute("PRAGMA journal_mode = WAL")
+        db_wal_enabled = True
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {app.config['DB_BUSY_TIMEOUT_MS']}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")  # 16 MB page cache per connection
+    return conn
+
+# Database connection function. Returns the connection bound to the current request,
+# or to the current thread for background workers.
 def get_db_connection():
     try:
-        conn = sqlite3.connect("database.db")
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON") 
+        if has_app_context():
+            if "db" not in g:
+                try:
+                    g.db = db_pool.get_nowait()
+                except queue.Empty:
+                    g.db = open_db_connection()
+            return g.db
+
+        conn = getattr(db_thread_local, "conn", None)
+        if conn is None:
+            conn = open_db_connection()
+            db_thread_local.conn = conn
         return conn
     except sqlite3.Error as e:
         print(f"Database connection error: {e}")
         return None
-    
+
+# Return the request's connection to the pool once the request is finished
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+    try:
+        conn.close()
+        if db_pool.qsize() < app.config["DB_POOL_SIZE"]:
+            db_pool.put(conn)
+        else:
+            conn.close_for_good()
+    except sqlite3.Error as e:
+        print(f"Error releasing database connection: {e}")
+
 # Initialize the database
 def init_db():
     conn = get_db_connection()
@@ -110,31 +290,214 @@ def init_db():
         )"""
     )
 
+    # Create table for rolling summaries of older messages (with ON DELETE CASCADE)
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id) ON DELETE CASCADE
+        )"""
+    )
+
+    # Create table for background report jobs (with ON DELETE CASCADE)
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS report_jobs (
+            job_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress INTEGER NOT NULL DEFAULT 0,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            chunks_total INTEGER NOT NULL DEFAULT 0,
+            input_file BLOB,
+            result TEXT,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )"""
+    )
+
     conn.commit()
+
+    # Bring older databases up to the current schema
+    run_migrations(conn)
     conn.close()
     print("Database initialized successfully!")
-    
-# Function to get UTC+8 time
-def get_utc_plus_8_time():
-    utc_now = datetime.utcnow()
-    utc_plus_8 = utc_now + timedelta(hours=8)
+
+# Function to parse a chat_sessions timestamp from before migration 1 into epoch seconds
+def parse_legacy_session_timestamp(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    # Written by the app as UTC+8 on a 12-hour clock, or by CURRENT_TIMESTAMP in UTC
+    for fmt, offset in (("%Y-%m-%d %I:%M:%S %p", 8), ("%Y-%m-%d %H:%M:%S", 0)):
+        try:
+            parsed = datetime.strptime(str(value), fmt) - timedelta(hours=offset)
+            return int(parsed.replace(tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            continue
+    return int(time.time())
+
+# Migration 1: rebuild chat_sessions with an INTEGER session_name and an epoch created_at
+def migrate_session_timestamps(conn):
+    rows = conn.execute(
+        "SELECT session_id, user_id, session_name, timestamp FROM chat_sessions"
+    ).fetchall()
+    conn.execute(
+        """CREATE TABLE chat_sessions_new (
+            session_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            session_name INTEGER NOT NULL DEFAULT 1,
+            created_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )"""
+    )
+    conn.executemany(
+        "INSERT INTO chat_sessions_new (session_id, user_id, session_name, created_at) VALUES (?, ?, ?, ?)",
+        [
+            (row["session_id"], row["user_id"], int(row["session_name"] or 1), parse_legacy_session_timestamp(row["timestamp"]))
+            for row in rows
+        ],
+    )
+    conn.execute("DROP TABLE chat_sessions")
+    conn.execute("ALTER TABLE chat_sessions_new RENAME TO chat_sessions")
+    # Covers the session list and the MAX(session_name) lookup at login
+    conn.execute(
+        "CREATE INDEX idx_chat_sessions_user_name ON chat_sessions (user_id, session_name, created_at)"
+    )
+
+# Migration 2: add an epoch created_at to messages, filled in by migration 5
+def migrate_message_timestamps(conn):
+    conn.execute("ALTER TABLE messages ADD COLUMN created_at INTEGER")
+    # Serves history lookups by session in time order, and message counts per session
+    conn.execute(
+        "CREATE INDEX idx_messages_session_created ON messages (session_id, created_at)"
+    )
+
+# Migration 3: per-user session counter, and one session per (user_id, session_name)
+def migrate_session_counter(conn):
+    conn.execute("ALTER TABLE users ADD COLUMN last_session_name INTEGER NOT NULL DEFAULT 0")
+    # Concurrent logins could allocate the same session_name twice, renumber the later duplicates
+    duplicates = conn.execute(
+        """SELECT cs.rowid, cs.user_id FROM chat_sessions cs
+        WHERE EXISTS (
+            SELECT 1 FROM chat_sessions older
+            WHERE older.user_id = cs.user_id AND older.session_name = cs.session_name
+            AND (older.created_at, older.rowid) < (cs.created_at, cs.rowid)
+        )
+        ORDER BY cs.created_at, cs.rowid"""
+    ).fetchall()
+    for row in duplicates:
+        conn.execute(
+            """UPDATE chat_sessions
+            SET session_name = (SELECT MAX(session_name) + 1 FROM chat_sessions WHERE user_id = ?)
+            WHERE rowid = ?""",
+            (row["user_id"], row["rowid"]),
+        )
+    if duplicates:
+        print(f"Renumbered {len(duplicates)} duplicate chat sessions")
+    conn.execute(
+        """UPDATE users SET last_session_name = COALESCE(
+            (SELECT MAX(session_name) FROM chat_sessions WHERE user_id = users.id), 0
+        )"""
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_chat_sessions_user_name")
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_chat_sessions_user_name ON chat_sessions (user_id, session_name)"
+    )
+
+# Migration 4: record which worker process runs a report job
+def migrate_report_job_worker(conn):
+    conn.execute("ALTER TABLE report_jobs ADD COLUMN worker TEXT")
+
+# Migration 5: fill in created_at for messages written before migration 2.
+# History, export and the session list all order and filter on plain created_at, which the index serves.
+def migrate_message_created_at(conn):
+    cursor = conn.execute(
+        """UPDATE messages
+        SET created_at = COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+        WHERE created_at IS NULL"""
+    )
+    if cursor.rowcount:
+        print(f"Filled in created_at for {cursor.rowcount} messages")
+
+# Schema migrations, applied in order. PRAGMA user_version holds the last one applied.
+MIGRATIONS = [
+    migrate_session_timestamps,
+    migrate_message_timestamps,
+    migrate_session_counter,
+    migrate_report_job_worker,
+    migrate_message_created_at,
+]
+
+# Function to apply any migrations the database has not seen yet
+def run_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+
+        # Table rebuilds need foreign keys off, which can only change outside a transaction
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            migration(conn)
+            problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if problems:
+                print(f"Migration {number} left {len(problems)} rows with broken foreign keys")
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+            print(f"Applied migration {number}: {migration.__name__}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+# Function to format epoch seconds as UTC+8 time
+def format_utc_plus_8(epoch_seconds):
+    if epoch_seconds is None:
+        return None
+    utc_plus_8 = datetime.fromtimestamp(epoch_seconds, timezone.utc) + timedelta(hours=8)
     # Format with 12-hour clock and AM/PM
     return utc_plus_8.strftime('%Y-%m-%d %I:%M:%S %p')
 
-# Function to add a new chat session
-def add_chat_session(user_id, session_name):
+# Function to format epoch seconds as ISO 8601 in UTC+8, e.g. 2025-02-06T10:30:00+08:00
+def format_iso_utc_plus_8(epoch_seconds):
+    if epoch_seconds is None:
+        return None
+    return datetime.fromtimestamp(epoch_seconds, timezone(timedelta(hours=8))).isoformat()
+
+# Function to add a new chat session, returning its session_id and session_name.
+# The user's session counter is bumped in the same transaction, so concurrent logins never share a session_name.
+def add_chat_session(user_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
+    session_id = str(uuid.uuid4())
 
-    timestamp = get_utc_plus_8_time()
-    
-    cursor.execute(
-        """INSERT INTO chat_sessions (session_id, user_id, session_name, timestamp) 
-        VALUES (?, ?, ?, ?)""",
-        (str(uuid.uuid4()), user_id, session_name, timestamp)
-    )
-    conn.commit()
-    conn.close()
+    try:
+        # Take the write lock up front so the counter read and the insert see the same value
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE users SET last_session_name = last_session_name + 1 WHERE id = ?", (user_id,)
+        )
+        session_name = conn.execute(
+            "SELECT last_session_name FROM users WHERE id = ?", (user_id,)
+        ).fetchone()[0]
+        conn.execute(
+            """INSERT INTO chat_sessions (session_id, user_id, session_name, created_at) 
+            VALUES (?, ?, ?, ?)""",
+            (session_id, user_id, session_name, int(time.time()))
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return session_id, session_name
 
 # Route to check if user is logged in
 @app.route("/check_login", methods=["GET"])
@@ -195,30 +558,8 @@ def login_page():
                     "username": user["username"],
                 })
 
-                # Get the highest session_name
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT MAX(session_name) FROM chat_sessions WHERE user_id = ?",
-                    (user["id"],)
-                )
-                max_session_name = cursor.fetchone()[0]
-                conn.close()
-
-                # Determine next session_name
-                session_name = 1 if max_session_name is None else max_session_name + 1
-                session_id = str(uuid.uuid4())
-                timestamp = get_utc_plus_8_time()
-
-                # Store session in database
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO chat_sessions (session_id, user_id, session_name, timestamp) VALUES (?, ?, ?, ?)",
-                    (session_id, user["id"], session_name, timestamp),
-                )
-                conn.commit()
-                conn.close()
+                # Store a new session in the database with the next session_name
+                session_id, session_name = add_chat_session(user["id"])
 
                 # Update session with session details
                 session["session_id"] = session_id
@@ -307,21 +648,234 @@ def register_page():
 def chatbot():
     return render_template("chatbot.html")
 
-def get_conversation_history(session_id, limit=20):
+# Function to get the newest messages of a session that are not yet summarized.
+# Messages are clipped in SQL so stored file dumps are never loaded in full.
+def get_conversation_history(session_id, after_id=0, limit=20):
+    max_chars = app.config["HISTORY_MAX_TURN_TOKENS"] * 4
+    # Make sure the previous turn is written before reading
+    wait_for_messages(session_id)
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT message, response FROM messages WHERE session_id = ? ORDER BY timestamp DESC LIMIT ?",
-            (session_id, limit),
+            """SELECT id, substr(message, 1, ?) AS message, length(message) AS message_length,
+                substr(response, 1, ?) AS response, length(response) AS response_length
+            FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?""",
+            (max_chars, max_chars, session_id, after_id, limit),
         )
         rows = cursor.fetchall()
         conn.close()
-        return rows[::-1]  # Reverse the order to show the latest messages first
+        return rows[::-1]  # Reverse so the oldest message comes first
     except Exception as e:
         print(f"Error getting conversation history: {e}")
         return []
 
+# Function to get the oldest messages of a session that are not yet summarized, up to before_id
+def get_turns_to_summarize(session_id, after_id, before_id, limit):
+    max_chars = app.config["HISTORY_MAX_TURN_TOKENS"] * 4
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT id, substr(message, 1, ?) AS message, length(message) AS message_length,
+                substr(response, 1, ?) AS response, length(response) AS response_length
+            FROM messages WHERE session_id = ? AND id > ? AND id < ? ORDER BY id LIMIT ?""",
+            (max_chars, max_chars, session_id, after_id, before_id, limit),
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except Exception as e:
+        print(f"Error getting messages to summarize: {e}")
+        return []
+
+# Function to count the messages of a session after after_id
+def count_messages_after(session_id, after_id):
+    try:
+        conn = get_db_connection()
+        count = conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND id > ?", (session_id, after_id)
+        ).fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        print(f"Error counting messages: {e}")
+        return 0
+
+# Function to shorten a stored message to HISTORY_MAX_TURN_TOKENS
+def compact_turn_text(text, full_length):
+    text = text or ""
+    max_tokens = app.config["HISTORY_MAX_TURN_TOKENS"]
+    if full_length == len(text) and estimate_tokens(text) <= max_tokens:
+        return text
+    excerpt = clip_to_tokens(text, max_tokens)
+    omitted_tokens = max(1, ((full_length or 0) - len(excerpt)) // 4)
+    return f"{excerpt}\n[... about {omitted_tokens} more tokens omitted]"
+
+# Function to get the rolling summary of a session
+def get_session_summary(session_id):
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT summary, last_message_id FROM session_summaries WHERE session_id = ?",
+            (session_id,),
+        )
+        row = cursor.fetchone()
+        conn.close()
+        if row:
+            return row["summary"], row["last_message_id"]
+    except Exception as e:
+        print(f"Error getting session summary: {e}")
+    return "", 0
+
+# Function to store the rolling summary of a session
+def save_session_summary(session_id, summary, last_message_id):
+    try:
+        conn = get_db_connection()
+        conn.execute(
+            """INSERT INTO session_summaries (session_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_message_id = excluded.last_message_id,
+                updated_at = excluded.updated_at""",
+            (session_id, summary, last_message_id, int(time.time())),
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Error saving session summary: {e}")
+
+summary_instructions = """
+You maintain a running summary of a conversation between a user and an ISO 27001 / ISO 27002 compliance assistant.
+Update the existing summary with the new exchanges. Keep facts the user shared about their organisation, documents they uploaded (by topic, not content), questions asked, and conclusions reached.
+Write at most 200 words of plain prose.
+"""
+
+# Function to fold older turns into the rolling summary, returns None if the call fails
+def summarize_turns(summary, turns):
+    exchanges = "\n".join(f"user: {user_text}\nassistant: {reply}" for user_text, reply in turns)
+    try:
+        with llm_in_flight.track_in_progress(), stage_duration.time(stage="summary"):
+            chat_completion = openai.chat.completions.create(
+                model=MODEL_ID,
+                temperature=0,
+                max_tokens=400,
+                messages=[
+                    {"role": "system", "content": summary_instructions},
+                    {
+                        "role": "user",
+                        "content": f"Existing summary:\n{summary or '(none)'}\n\nNew exchanges:\n{exchanges}",
+                    },
+                ],
+            )
+        llm_requests.inc(outcome="ok")
+        record_usage(getattr(chat_completion, "usage", None))
+        return chat_completion.choices[0].message.content
+    except openai.OpenAIError as e:
+        llm_requests.inc(outcome="error")
+        errors.inc(stage="summary")
+        print("OpenAI API error while summarizing history:", e)
+        return None
+
+# Worker pool for summary updates, kept apart from report jobs so summaries never queue
+# behind long reports, and the pending update of each session, so it runs once at a time
+summary_executor = None
+summarizing_sessions = {}
+summarizing_sessions_lock = threading.Lock()
+
+# Function to fold every unsummarized message before before_id into the rolling summary,
+# oldest first and HISTORY_MAX_TURNS at a time, so none are skipped. Runs on a summary worker.
+def summarize_session(session_id, before_id):
+    try:
+        while True:
+            summary, last_message_id = get_session_summary(session_id)
+            rows = get_turns_to_summarize(
+                session_id, last_message_id, before_id, app.config["HISTORY_MAX_TURNS"]
+            )
+            if not rows:
+                break
+            turns = [
+                (
+                    compact_turn_text(row["message"], row["message_length"]),
+                    compact_turn_text(row["response"], row["response_length"]),
+                )
+                for row in rows
+            ]
+            new_summary = summarize_turns(summary, turns)
+            if not new_summary:
+                # Left for the next request to try again
+                break
+            save_session_summary(session_id, new_summary, rows[-1]["id"])
+    except Exception as e:
+        print(f"Error summarizing session history: {e}")
+    finally:
+        with summarizing_sessions_lock:
+            summarizing_sessions.pop(session_id, None)
+
+# Function to queue a summary update for a session, returns its future. A session with an
+# update already pending gets that one.
+def schedule_summary(session_id, before_id):
+    global summary_executor
+    with summarizing_sessions_lock:
+        if session_id in summarizing_sessions:
+            return summarizing_sessions[session_id]
+        if summary_executor is None:
+            summary_executor = ThreadPoolExecutor(
+                max_workers=app.config["SUMMARY_WORKERS"], thread_name_prefix="summary-worker"
+            )
+        future = summary_executor.submit(summarize_session, session_id, before_id)
+        summarizing_sessions[session_id] = future
+        return future
+
+# Function to assemble the history for a prompt within HISTORY_TOKEN_BUDGET.
+# Recent turns are kept verbatim; older ones are folded into the stored rolling summary
+# in the background, so the prompt may use the previous summary until that finishes.
+def build_history(session_id):
+    if not session_id:
+        return "", []
+
+    summary, last_message_id = get_session_summary(session_id)
+    rows = get_conversation_history(
+        session_id, after_id=last_message_id, limit=app.config["HISTORY_MAX_TURNS"]
+    )
+    turns = [
+        (
+            compact_turn_text(row["message"], row["message_length"]),
+            compact_turn_text(row["response"], row["response_length"]),
+        )
+        for row in rows
+    ]
+
+    # Walk back from the newest turn until the budget is used up
+    budget = app.config["HISTORY_TOKEN_BUDGET"] - estimate_tokens(summary)
+    used = 0
+    keep = 0
+    for user_text, reply in reversed(turns):
+        turn_tokens = estimate_tokens(user_text) + estimate_tokens(reply)
+        if used + turn_tokens > budget:
+            break
+        used += turn_tokens
+        keep += 1
+
+    # Summarize everything before the kept turns: the turns over budget, and any messages
+    # older than the newest HISTORY_MAX_TURNS that were not read here
+    if keep < len(turns) or len(rows) == app.config["HISTORY_MAX_TURNS"]:
+        before_id = rows[len(rows) - keep]["id"] if keep else rows[-1]["id"] + 1
+        future = schedule_summary(session_id, before_id)
+        # Turns in neither the summary nor the prompt; past the newest HISTORY_MAX_TURNS
+        # they have to be counted
+        missing = len(turns) - keep
+        if len(rows) == app.config["HISTORY_MAX_TURNS"]:
+            missing = count_messages_after(session_id, last_message_id) - keep
+        # A turn or two missing until the summary catches up is fine, more is lost context
+        if missing > app.config["HISTORY_SUMMARY_BACKLOG"]:
+            future.result()
+            summary, _ = get_session_summary(session_id)
+
+    return summary, turns[len(turns) - keep:]
+
 prompt_instructions = """
 You are an AI assistant specialized in providing detailed and accurate information on ISO 27001 and ISO 27002 standards, specifically the 2022 editions.
 Your goal is to help users understand the principles, requirements, and best practices for implementing and managing information security management systems (ISMS).
@@ -331,32 +885,194 @@ You can also offer practical guidance on risk management, controls, and audits b
 Be objective, neutral, and professional, and avoid providing personal opinions or legal advice.
 """
 
-# Function to get GPT response
-def get_response(message):
-    current_session_id = session.get("session_id")  
-    
+# Function to find ISO QA references for a message, formatted for the prompt
+def retrieve_references(message):
+    if not app.config["RAG_TOP_K"]:
+        return None
     try:
-        history = get_conversation_history(current_session_id)
-        
-        if history:
-            chat_history = "\n".join([f"user: {row[0]}\nassistant: {row[1]}" for row in history])
-            message = f"{chat_history}\nuser: {message}"
-        
-        chat_completion = openai.chat.completions.create(
-            model=MODEL_ID,
-            messages=[
-                {
-                    "role": "system",
-                    "content": prompt_instructions,
-                },
-                {"role": "user", "content": message},
-            ],
-        )
+        # The embedding model only reads the first few hundred tokens, so skip embedding the rest
+        matches = retriever.search(
+            [message[:2000]], app.config["RAG_TOP_K"], app.config["RAG_MIN_SCORE"]
+        )[0]
+    except Exception as e:
+        print(f"Error retrieving references: {e}")
+        return None
+
+    references = []
+    seen_contexts = set()
+    budget = app.config["RAG_CONTEXT_TOKENS"]
+    for _, payload in matches:
+        # Several questions share a context, use it once
+        if payload["context"] in seen_contexts:
+            continue
+        seen_contexts.add(payload["context"])
+        reference = f"{payload['context']}\nQ: {payload['question']}\nA: {payload['answer']}"
+        tokens = estimate_tokens(reference)
+        if tokens > budget:
+            reference = clip_to_tokens(reference, budget)
+            tokens = budget
+        if not reference:
+            break
+        references.append(reference)
+        budget -= tokens
+        if budget <= 0:
+            break
+
+    if not references:
+        return None
+    return "Relevant ISO 27001/27002 references:\n\n" + "\n\n".join(references)
+
+# Function to build the messages sent to GPT, including the session's chat history
+# and the ISO QA references that match the message
+def build_chat_messages(message):
+    current_session_id = session.get("session_id")
+    with stage_duration.time(stage="history"):
+        summary, turns = build_history(current_session_id)
+
+    messages = [
+        {
+            "role": "system",
+            "content": prompt_instructions,
+        },
+    ]
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{summary}",
+        })
+    for user_text, reply in turns:
+        messages.append({"role": "user", "content": user_text})
+        messages.append({"role": "assistant", "content": reply or ""})
+    with stage_duration.time(stage="retrieval"):
+        references = retrieve_references(message)
+    if references:
+        messages.append({"role": "system", "content": references})
+    messages.append({"role": "user", "content": message})
+    return messages
+
+# Function to count the prompt and completion tokens of an OpenAI response
+def record_usage(usage):
+    if usage is None:
+        return
+    llm_tokens.inc(usage.prompt_tokens or 0, kind="prompt")
+    llm_tokens.inc(usage.completion_tokens or 0, kind="completion")
+
+# Function to get a GPT completion, served from the response cache when possible
+def get_completion(messages, use_cache=True, **params):
+    cache_key = response_cache.make_key(MODEL_ID, messages, **params)
+    if use_cache:
+        cached_reply = response_cache.get(cache_key)
+        if cached_reply is not None:
+            llm_requests.inc(outcome="cached")
+            return cached_reply
+
+    try:
+        with llm_in_flight.track_in_progress(), stage_duration.time(stage="llm"):
+            chat_completion = openai.chat.completions.create(
+                model=MODEL_ID,
+                messages=messages,
+                **params,
+            )
+        llm_requests.inc(outcome="ok")
+        record_usage(getattr(chat_completion, "usage", None))
         reply = chat_completion.choices[0].message.content
+        response_cache.set(cache_key, reply)
         return reply
     except openai.OpenAIError as e:
+        llm_requests.inc(outcome="error")
+        errors.inc(stage="llm")
         print("OpenAI API error:", e)
 
+# Function to get GPT response, use_cache=False skips the cached reply
+def get_response(message, use_cache=True):
+    return get_completion(build_chat_messages(message), use_cache)
+
+# Function to stream GPT response tokens as they are generated
+def stream_response(message, use_cache=True):
+    messages = build_chat_messages(message)
+    cache_key = response_cache.make_key(MODEL_ID, messages)
+    if use_cache:
+        cached_reply = response_cache.get(cache_key)
+        if cached_reply is not None:
+            llm_requests.inc(outcome="cached")
+            yield cached_reply
+            return
+
+    # The call counts as in flight until the last token arrives or the client goes away
+    llm_in_flight.inc()
+    started = time.perf_counter()
+    stream = None
+    finished = False
+    try:
+        stream = openai.chat.completions.create(
+            model=MODEL_ID,
+            messages=messages,
+            stream=True,
+            # The final chunk then carries the token usage
+            stream_options={"include_usage": True},
+        )
+        reply = []
+        for chunk in stream:
+            record_usage(getattr(chunk, "usage", None))
+            if chunk.choices and chunk.choices[0].delta.content:
+                reply.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        finished = True
+    except openai.OpenAIError:
+        llm_requests.inc(outcome="error")
+        errors.inc(stage="llm")
+        raise
+    except GeneratorExit:
+        # The client went away mid-reply, the partial reply is not cached
+        llm_requests.inc(outcome="aborted")
+        raise
+    finally:
+        llm_in_flight.dec()
+        stage_duration.observe(time.perf_counter() - started, stage="llm")
+        # Stop the upstream generation instead of leaving it to run to the end
+        if not finished and stream is not None:
+            stream.close()
+    llm_requests.inc(outcome="ok")
+    response_cache.set(cache_key, "".join(reply))
+
+# Function to format a single Server-Sent Event
+def format_sse(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n{payload}"
+    return payload
+
+# Function to stream a chat reply to the browser, saving the full reply once it ends
+def stream_chat(message, use_cache=True):
+    def generate():
+        reply = []
+        saved = False
+        deltas = stream_response(message, use_cache)
+        try:
+            for delta in deltas:
+                reply.append(delta)
+                yield format_sse({"delta": delta})
+
+            gpt_response = "".join(reply)
+            save_chat_to_db(message, gpt_response)
+            saved = True
+            yield format_sse({"response": gpt_response}, event="done")
+        except openai.OpenAIError as e:
+            print("OpenAI API error:", e)
+            yield format_sse({"error": "Error generating response"}, event="error")
+        finally:
+            # Closes the upstream stream right away if the client disconnected mid-stream
+            deltas.close()
+            # Keep the partial reply if the client disconnected mid-stream
+            if reply and not saved:
+                save_chat_to_db(message, "".join(reply))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 report_instructions = """
 You are a compliance and audit reporting assistant. 
 Your task is to analyze the provided company policies and generate a structured, professional compliance report aligned with ISO 27001 and ISO 27002 (2022 editions).
@@ -395,24 +1111,70 @@ For each compliance issue, use this format:
 Deliver a concise, actionable compliance report that helps decision-makers understand strengths, identify weaknesses, and implement improvements for stronger compliance and policy effectiveness.
 """
 
-# Function to generate report
-def get_report(message):
-    try:
-        chat_completion = openai.chat.completions.create(
-            model=MODEL_ID,
-            temperature = 0.1, # Ensures no randomness for report generation
-            messages=[
-                {
-                    "role": "system",
-                    "content": report_instructions,
-                },
-                {"role": "user", "content": message},
-            ],
-        )
-        reply = chat_completion.choices[0].message.content
-        return reply
-    except openai.OpenAIError as e:
-        print("OpenAI API error:", e)
+# Function to generate report, use_cache=False skips the cached report
+def get_report(message, use_cache=True):
+    messages = [
+        {
+            "role": "system",
+            "content": report_instructions,
+        },
+        {"role": "user", "content": message},
+    ]
+    # Low temperature ensures no randomness for report generation
+    return get_completion(messages, use_cache, temperature=0.1)
+
+chunk_instructions = """
+You are a compliance and audit reporting assistant reviewing one part of a larger set of company policies against ISO 27001 and ISO 27002 (2022 editions).
+For this part only, list:
+- Strengths Identified: effective measures and compliance with best practices.
+- Issues Detected: each with Description, Severity Level (High / Medium / Low), Impact and 1-3 Solutions.
+- Policy Quality Notes: clearly defined terms, accountability, review cycles, outdated procedures.
+Reference sections by their identifiers (section numbers or headings). Be concise and do not write a title, introduction or overall assessment.
+"""
+
+# Function to analyse one chunk of a large document for the map step of a chunked report
+def analyze_report_chunk(chunk, index, total, use_cache=True):
+    messages = [
+        {"role": "system", "content": chunk_instructions},
+        {"role": "user", "content": f"Part {index} of {total}:\n{chunk}"},
+    ]
+    return get_completion(messages, use_cache, temperature=0.1)
+
+# Function to generate a report of any size: documents that fit in one chunk go to
+# get_report, larger ones are analysed chunk by chunk and merged in a final pass.
+# progress(done, total) is called as chunks finish.
+def get_report_chunked(message, use_cache=True, progress=None):
+    chunks = split_into_chunks(message, app.config["REPORT_CHUNK_TOKENS"])
+    if len(chunks) <= 1:
+        return get_report(message, use_cache)
+
+    total = len(chunks)
+    findings = [None] * total
+    done = 0
+    with ThreadPoolExecutor(max_workers=app.config["REPORT_FANOUT"]) as executor:
+        futures = {
+            executor.submit(analyze_report_chunk, chunk, index + 1, total, use_cache): index
+            for index, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            findings[futures[future]] = future.result()
+            done += 1
+            if progress:
+                progress(done, total)
+
+    if not any(findings):
+        return None
+
+    merged_findings = "\n\n".join(
+        f"### Part {index + 1} of {total}\n{result or '(analysis of this part failed)'}"
+        for index, result in enumerate(findings)
+    )
+    return get_report(
+        "The following are compliance findings for each part of the submitted policies. "
+        "Merge them into a single report that follows the report guidelines, combining duplicate issues "
+        "and giving one overall assessment.\n\n" + merged_findings,
+        use_cache,
+    )
 
 # Function to check if the file extension is allowed
 def allowed_file(filename):
@@ -423,226 +1185,44 @@ def allowed_file(filename):
     extension = filename.rsplit(".", 1)[1].lower()
     return extension in allowed_extensions
 
-# Extract text from PDF
-def extract_text_from_pdf(file_path):
-    text = ""
-    try:
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    lines = page_text.split("\n")
-                    temp_text = ""
-                    for line in lines:
-                        line = line.strip()
-                        if re.search(r"[.!?]$", line):  # Sentence-ending punctuation
-                            temp_text += line
-                            text += temp_text + "\n"
-                            temp_text = ""  # Reset
-                        else:
-                            temp_text += line + " "
-                    if temp_text:
-                        text += temp_text.strip() + "\n"
-    except Exception as e:
-        print(f"Error extracting PDF text: {e}")
-    return text
-
-# Function to extract text from DOCX
-def extract_text_from_docx(file_path):
-    text = ""
-    try:
-        doc = Document(file_path)
-        for para in doc.paragraphs:
-            sentences = para.text.split(".")
-            for sentence in sentences:
-                text += sentence.strip() + "\n"
-    except Exception as e:
-        print(f"Error extracting DOCX text: {e}")
-    return text
-
-def extract_text_from_image(file_path):
-    # Set a dynamic path to the Tesseract executable
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    tesseract_path = os.path.join(base_dir, "Tesseract-OCR", "tesseract.exe")
-    pytesseract.pytesseract.tesseract_cmd = tesseract_path
-    try:
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img)
-        if not text:
-            raise ValueError("No text could be extracted from the image.")
-        cleaned_text = " ".join(text.splitlines())
-        cleaned_text = cleaned_text.replace(" .", ".").replace(" ,", ",")
-        sentences = re.split(r"([.?!])\s*", cleaned_text)
-        formatted_text = ""
-        for i in range(0, len(sentences), 2):
-            sentence = sentences[i].strip()
-            if i + 1 < len(sentences):
-                sentence += sentences[i + 1]
-            if sentence:
-                formatted_text += sentence.strip() + "\n"
-        return formatted_text
-    except Exception as e:
-        print(f"Error in extract_text_from_image: {e}")
-        return None
-
-# Function to extract text from txt file
-def extract_text_from_txt(file):
-    try:
-        # Read the file directly from the request
-        text = file.read().decode("utf-8")
-
-        # Process text as sentences
-        processed_text = process_text(text)
-        return processed_text
-
-    except Exception as e:
-        print(f"Error extracting TXT text: {e}")
-    return ""
-
-# Function to process text into properly formatted sentences
-def process_text(text):
-    # Split text into sentences using punctuation
-    sentences = re.split(r"([.!?])(?=\s|$)", text)
-    # Reconstruct sentences with new lines
-    formatted_text = "".join(
-        [
-            sentence.strip() + punctuation + "\n"
-            for sentence, punctuation in zip(sentences[::2], sentences[1::2])
-        ]
-    )
-    # Handle trailing sentence without punctuation
-    if len(sentences) % 2 == 1 and sentences[-1].strip():
-        formatted_text += sentences[-1].strip()
-    return formatted_text
-
-# Function to extract text from xlsx file
-def extract_text_from_xlsx(file):
-    workbook = openpyxl.load_workbook(file)
-    extracted_text = ""
-    # Loop through each sheet in the workbook
-    for sheet in workbook.sheetnames:
-        worksheet = workbook[sheet]
-        for row in worksheet.iter_rows(values_only=True):
-            row_text = ""
-            # Loop through each cell in the row
-            for cell in row:
-                if cell == None:
-                    row_text += ""
-                else:
-                    row_text += str(cell)  # Convert cell value to string
-                row_text += "\t"  # Add tab between cells
-            extracted_text += row_text.strip() + "\n"  # Add row text to extracted text
-    return extracted_text
-
-# Function to extract text from CSV file
-def extract_text_from_csv(file):
-    extracted_text = ""
-    try:
-        # Ensure the file is in text mode
-        file_content = file.stream.read().decode(
-            "utf-8"
-        )  # Read file content and decode
-        file_io = io.StringIO(
-            file_content
-        )  # Wrap the content in a StringIO object for csv.reader
-
-        reader = csv.reader(file_io)
-        for row in reader:
-            row_text = ",".join(row)  # Join the row with commas
-            extracted_text += row_text + "\n"  # Add newline for each row
-
-    except csv.Error as e:
-        return f"Error processing CSV file: {e}"
-    except Exception as e:
-        return f"An unexpected error occurred: {e}"
-
+# Function to extract text from an upload, capped at MAX_EXTRACTED_CHARS
+def extract_upload(file, filename):
+    max_chars = app.config["MAX_EXTRACTED_CHARS"]
+    extractor = get_extractor(file, filename)
+    if extractor is None:
+        return ""
+
+    file_type = os.path.splitext(filename)[1].lower().lstrip(".") or "unknown"
+    with stage_duration.time(stage="extract"):
+        # Repeat uploads of the same bytes skip parsing entirely, unless the extractor settings changed
+        cache_key = f"{hash_upload(file)}:{extractor.__name__}:{EXTRACTOR_VERSION}:{settings_fingerprint()}:{max_chars}"
+        extracted_text = text_cache.get(cache_key)
+        if extracted_text is None:
+            with extract_duration.time(file_type=file_type):
+                extracted_text = extract_text(file, filename, max_chars)
+            extracted_bytes.inc(upload_size(file), file_type=file_type)
+            extracted_characters.inc(len(extracted_text), file_type=file_type)
+            if extracted_text.strip():
+                text_cache.set(cache_key, extracted_text)
     return extracted_text
 
-# Function to extract text from JSON file
-def extract_text_from_json(file):
-    try:
-        # Read the file content as bytes
-        file_content = file.read()
-        if not file_content:
-            print("File is empty")
-            return "No content found in the file."
-        json_data = json.loads(file_content.decode("utf-8"))
-        extracted_text = json.dumps(json_data, indent=4)
-        return extracted_text
-
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON in file: {e}")
-        return "Error decoding JSON in the file."
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return f"Unexpected error: {e}"
-    return all_data
-
-# Function to read a .MD file
-def extract_text_from_md(file):
-    try:
-        # Read the file and decode it into a string
-        data = file.read().decode("utf-8")
-        # Remove lines that start with a # (markdown headers)
-        data = re.sub(r"^\#.*$", "", data, flags=re.M)
-        # Remove images (anything starting with ![ and ending with ])
-        data = re.sub(r"!\[.*?\]\(.*?\)", "", data)
-        # Remove links (anything in the format [text](url))
-        data = re.sub(r"\[.*?\]\(.*?\)", "", data)
-        # Remove bold or italic text (anything between **, *, __, or _)
-        data = re.sub(r"(\*\*|\*|__|_)(.*?)\1", r"\2", data)
-        # Remove code blocks (text wrapped in triple backticks)
-        data = re.sub(r"```.*?```", "", data, flags=re.S)
-        # Remove indented code (with spaces at the beginning)
-        data = re.sub(r"    .+", "", data)
-        # Remove list items (lines that start with *, +, or -)
-        data = re.sub(r"^[\*\+-]\s.*$", "", data, flags=re.M)
-        # Remove blockquotes (lines starting with >)
-        data = re.sub(r"^\>.*$", "", data, flags=re.M)
-        # Strip extra spaces at the beginning and end
-        data = data.strip()
-        return data
-
-    except Exception as e:
-        return "Something went wrong: " + str(e)
-
-# Function to read a .reg file and extract key-value pairs
-def read_reg(file):
-    try:
-        # Read the contents of the .reg file (UTF-16 encoding is common for .reg files)
-        data = file.read().decode("utf-16")
-        # Remove non-section strings before the first section (if any)
-        data = re.sub(r"^[^\[]*\n", "", data, flags=re.S)
-        # Find sections and key-value pairs
-        sections = re.findall(r"\[([^\]]+)\](.*?)((?=\[)|$)", data, re.S)
-        # Prepare a list to store rows of data
-        rows = []
-
-        for section, content, _ in sections:
-            # Find key-value pairs within the section
-            key_value_pairs = re.findall(r"([^\=]+)=(.*)", content.strip())
-            for key, value in key_value_pairs:
-                rows.append([section.strip(), key.strip(), value.strip()])
-
-        # Convert the list into a DataFrame
-        df = pd.DataFrame(rows, columns=["Section", "Key", "Value"])
-        # Return the DataFrame
-        return df
-
-    except Exception as e:
-        print(f"Error reading .reg file: {e}")
-        return "Error reading .reg file"
-
 # Route for processing messages
 @app.route("/process", methods=["POST"])
 def process_message():
     response = ""
+    # Stream tokens as Server-Sent Events when requested (/process?stream=1)
+    stream = request.args.get("stream") == "1"
+    # Skip cached replies when requested (/process?nocache=1)
+    use_cache = request.args.get("nocache") != "1"
 
     # Case 1: message only 
     if "message" in request.form and not request.files:
         message = request.form["message"]
+        if stream:
+            return stream_chat(message, use_cache)
+
         # Get GPT response for the message
-        gpt_response = get_response(message)
+        gpt_response = get_response(message, use_cache)
         response += f"\n{gpt_response}"
 
         # Save the message and response to the database
@@ -654,32 +1234,16 @@ def process_message():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            extracted_text = ""
 
             # Extract text from the file
-            if filename.endswith(".pdf"):
-                extracted_text = extract_text_from_pdf(file)
-            elif filename.endswith(".txt"):
-                extracted_text = extract_text_from_txt(file)
-            elif filename.endswith(".json"):
-                extracted_text = extract_text_from_json(file)
-            elif filename.endswith(".docx"):
-                extracted_text = extract_text_from_docx(file)
-            elif filename.endswith(".xlsx"):
-                extracted_text = extract_text_from_xlsx(file)
-            elif filename.endswith(".csv"):
-                extracted_text = extract_text_from_csv(file)
-            elif filename.endswith((".jpg", ".jpeg", ".png")):
-                extracted_text = extract_text_from_image(file)
-            elif filename.endswith(".md"):
-                extracted_text = extract_text_from_md(file)
-            elif filename.endswith(".reg"):
-                df = read_reg(file)
-                extracted_text = df.to_html()
+            extracted_text = extract_upload(file, filename)
 
             if extracted_text.strip():
+                if stream:
+                    return stream_chat(extracted_text, use_cache)
+
                 # Get GPT response for the extracted text only
-                gpt_response = get_response(extracted_text)
+                gpt_response = get_response(extracted_text, use_cache)
                 response += f"\n{gpt_response}"
 
                 # Save the extracted text and GPT response to the database
@@ -696,35 +1260,18 @@ def process_message():
 
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            extracted_text = ""
 
             # Extract text from the file
-            if filename.endswith(".pdf"):
-                extracted_text = extract_text_from_pdf(file)
-            elif filename.endswith(".txt"):
-                extracted_text = extract_text_from_txt(file)
-            elif filename.endswith(".json"):
-                extracted_text = extract_text_from_json(file)
-            elif filename.endswith(".docx"):
-                extracted_text = extract_text_from_docx(file)
-            elif filename.endswith(".xlsx"):
-                extracted_text = extract_text_from_xlsx(file)
-            elif filename.endswith(".csv"):
-                extracted_text = extract_text_from_csv(file)
-            elif filename.endswith((".jpg", ".jpeg", ".png")):
-                extracted_text = extract_text_from_image(file)
-            elif filename.endswith(".md"):
-                extracted_text = extract_text_from_md(file)
-            elif filename.endswith(".reg"):
-                df = read_reg(file)
-                extracted_text = df.to_html()
+            extracted_text = extract_upload(file, filename)
 
             if extracted_text.strip():
                 # Combine the message and extracted text
                 final_input = message + "\n" + extracted_text
+                if stream:
+                    return stream_chat(final_input, use_cache)
 
                 # Get GPT response based on the combined input
-                gpt_response = get_response(final_input)
+                gpt_response = get_response(final_input, use_cache)
                 response += f"{gpt_response}"
 
                 # Save the final input and GPT response to the database
@@ -736,25 +1283,158 @@ def process_message():
 
     return jsonify({"response": response})
 
+# Write-behind queue for chat messages, drained by a writer thread started on the first save
+message_queue = queue.Queue()
+message_writer = None
+message_writer_lock = threading.Lock()
+# Number of queued but not yet written messages per session_id
+pending_messages = {}
+pending_messages_changed = threading.Condition()
+# Queue markers asking the writer to write its batch now, or to write it and stop
+FLUSH_MESSAGES = object()
+STOP_MESSAGES = object()
+
+# Function to start the message writer thread
+def ensure_message_writer():
+    global message_writer
+    if message_writer is not None:
+        return
+
+    with message_writer_lock:
+        if message_writer is not None:
+            return
+        message_writer = threading.Thread(
+            target=run_message_writer, name="message-writer", daemon=True
+        )
+        message_writer.start()
+        atexit.register(stop_message_writer)
+
+# Function run by the writer thread: collects messages until the batch is full or
+# WRITE_BEHIND_INTERVAL has passed, then inserts the batch in one transaction
+def run_message_writer():
+    batch_size = app.config["WRITE_BEHIND_BATCH_SIZE"]
+    interval = app.config["WRITE_BEHIND_INTERVAL"]
+    stopping = False
+    while not stopping:
+        item = message_queue.get()
+        batch = []
+        deadline = time.monotonic() + interval
+        while True:
+            if item is STOP_MESSAGES:
+                stopping = True
+                break
+            if item is FLUSH_MESSAGES:
+                break
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= batch_size or remaining <= 0:
+                break
+            try:
+                item = message_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+        if batch:
+            write_message_batch(batch)
+
+# Function to insert a batch of messages and mark them as written
+def write_message_batch(batch):
+    try:
+        conn = get_db_connection()
+        try:
+            conn.executemany(
+                "INSERT INTO messages (session_id, message, response, created_at) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            # Insert one by one so a single bad row (e.g. a deleted session) does not lose the batch
+            print(f"Error saving message batch, retrying one by one: {e}")
+            dropped = 0
+            for row in batch:
+                try:
+                    conn.execute(
+                        "INSERT INTO messages (session_id, message, response, created_at) VALUES (?, ?, ?, ?)",
+                        row,
+                    )
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    dropped += 1
+            if dropped:
+                errors.inc(dropped, stage="save")
+                print(f"Error saving chat to database: dropped {dropped} of {len(batch)} messages")
+    except Exception as e:
+        errors.inc(len(batch), stage="save")
+        print(f"Error saving chat to database: {e}")
+    finally:
+        with pending_messages_changed:
+            for row in batch:
+                session_id = row[0]
+                pending_messages[session_id] -= 1
+                if not pending_messages[session_id]:
+                    del pending_messages[session_id]
+            pending_messages_changed.notify_all()
+
+# Function to queue a message for the writer thread
+def queue_message(session_id, message, gpt_response):
+    ensure_message_writer()
+    with pending_messages_changed:
+        pending_messages[session_id] = pending_messages.get(session_id, 0) + 1
+    message_queue.put((session_id, message, gpt_response, int(time.time())))
+
+# Function to wait until queued messages are written, for one session or for all of them.
+# Reads call this first so they always see the messages saved before them.
+def wait_for_messages(session_id=None, timeout=10):
+    with pending_messages_changed:
+        if not (pending_messages.get(session_id) if session_id else pending_messages):
+            return
+    # Ask the writer not to wait for the rest of its batch
+    message_queue.put(FLUSH_MESSAGES)
+    with pending_messages_changed:
+        pending_messages_changed.wait_for(
+            lambda: not (pending_messages.get(session_id) if session_id else pending_messages),
+            timeout=timeout,
+        )
+
+# Function to write the remaining queued messages and stop the writer, run at exit
+def stop_message_writer(timeout=10):
+    if message_writer is None or not message_writer.is_alive():
+        return
+    message_queue.put(STOP_MESSAGES)
+    message_writer.join(timeout)
+
 # Save chat to the database
 def save_chat_to_db(message, gpt_response):
+    with stage_duration.time(stage="save"):
+        insert_chat_message(message, gpt_response)
+
+# Function to insert a message and its response into the current session
+def insert_chat_message(message, gpt_response):
     user_id = session.get("user_id")
     session_id = session.get("session_id")
 
     if user_id and session_id:
+        # With write-behind on, the writer thread inserts the message shortly after
+        if app.config["WRITE_BEHIND"]:
+            queue_message(session_id, message, gpt_response)
+            return
+
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
 
             # Insert the message and response into the messages table
             cursor.execute(
-                "INSERT INTO messages (session_id, message, response) VALUES (?, ?, ?)",
-                (session_id, message, gpt_response),
+                "INSERT INTO messages (session_id, message, response, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, message, gpt_response, int(time.time())),
             )
             conn.commit()
             conn.close()
 
         except Exception as e:
+            errors.inc(stage="save")
             print(f"Error saving chat to database: {e}")
             conn.close()
 
@@ -762,38 +1442,21 @@ def save_chat_to_db(message, gpt_response):
 @app.route("/report", methods=["POST"])
 def process_report():
     report = ""
+    # Skip the cached report when requested (/report?nocache=1)
+    use_cache = request.args.get("nocache") != "1"
 
     if "file" in request.files and not "message" in request.form:
         file = request.files["file"]
 
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            extracted_text = ""
 
             # Extract text from the file
-            if filename.endswith(".pdf"):
-                extracted_text = extract_text_from_pdf(file)
-            elif filename.endswith(".txt"):
-                extracted_text = extract_text_from_txt(file)
-            elif filename.endswith(".json"):
-                extracted_text = extract_text_from_json(file)
-            elif filename.endswith(".docx"):
-                extracted_text = extract_text_from_docx(file)
-            elif filename.endswith(".xlsx"):
-                extracted_text = extract_text_from_xlsx(file)
-            elif filename.endswith(".csv"):
-                extracted_text = extract_text_from_csv(file)
-            elif filename.endswith((".jpg", ".jpeg", ".png")):
-                extracted_text = extract_text_from_image(file)
-            elif filename.endswith(".md"):
-                extracted_text = extract_text_from_md(file)
-            elif filename.endswith(".reg"):
-                df = read_reg(file)
-                extracted_text = df.to_html()
+            extracted_text = extract_upload(file, filename)
 
             if extracted_text.strip():
                 # Get GPT response for the extracted text only
-                gpt_response = get_report(extracted_text)
+                gpt_response = get_report_chunked(extracted_text, use_cache)
                 report += f"\n{gpt_response}"
             else:
                 report += "No text extracted from the file."
@@ -813,7 +1476,303 @@ def process_report():
             mimetype="text/plain"
         )
 
-# Route to get chat history
+# Worker pool for background report jobs, started on the first request
+report_executor = None
+report_executor_lock = threading.Lock()
+# Owner recorded on the jobs this process runs: the pid, plus a random boot id since pids are reused
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# Function to queue again the running jobs whose worker stopped updating them, on this
+# process's pool; with all_queued, every queued job too, for a pool that just started.
+# Jobs that a live worker is running are left alone.
+def resume_report_jobs(all_queued=False):
+    stale_before = int(time.time()) - app.config["REPORT_JOB_STALE_SECONDS"]
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT job_id FROM report_jobs WHERE status = 'running' AND updated_at < ?",
+            (stale_before,),
+        )
+        pending_jobs = []
+        for row in cursor.fetchall():
+            # Checked again, the worker may have touched the job since it was read
+            cursor.execute(
+                """UPDATE report_jobs SET status = 'queued', progress = 0, worker = NULL
+                WHERE job_id = ? AND status = 'running' AND updated_at < ?""",
+                (row["job_id"], stale_before),
+            )
+            if cursor.rowcount:
+                pending_jobs.append(row["job_id"])
+        conn.commit()
+        if pending_jobs:
+            print(f"Requeued {len(pending_jobs)} report jobs left by stopped workers")
+        if all_queued:
+            cursor.execute(
+                "SELECT job_id FROM report_jobs WHERE status = 'queued' ORDER BY created_at"
+            )
+            pending_jobs = [row["job_id"] for row in cursor.fetchall()]
+        conn.close()
+    except Exception as e:
+        print(f"Error resuming report jobs: {e}")
+        return
+
+    # Jobs already queued on another process are claimed by whichever worker gets there first
+    for job_id in pending_jobs:
+        report_executor.submit(run_report_job, job_id)
+
+# Function to start the report worker pool and resume jobs left over from a restart
+def ensure_report_workers():
+    global report_executor
+    if report_executor is not None:
+        return
+
+    with report_executor_lock:
+        if report_executor is not None:
+            return
+        report_executor = ThreadPoolExecutor(
+            max_workers=app.config["REPORT_WORKERS"],
+            thread_name_prefix="report-worker",
+        )
+        resume_report_jobs(all_queued=True)
+
+@app.before_request
+def start_report_workers():
+    ensure_report_workers()
+
+# Function to update the status fields of a report job
+def update_report_job(job_id, **fields):
+    fields["updated_at"] = int(time.time())
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    conn = get_db_connection()
+    conn.execute(
+        f"UPDATE report_jobs SET {assignments} WHERE job_id = ?",
+        (*fields.values(), job_id),
+    )
+    conn.commit()
+    conn.close()
+
+# Function to remove finished report jobs older than REPORT_JOB_TTL
+def purge_expired_report_jobs():
+    cutoff = int(time.time()) - app.config["REPORT_JOB_TTL"]
+    conn = get_db_connection()
+    conn.execute(
+        "DELETE FROM report_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+        (cutoff,),
+    )
+    conn.commit()
+    conn.close()
+
+# Function to touch a running job every quarter of REPORT_JOB_STALE_SECONDS until stopped,
+# so other processes can tell it from a job whose worker died
+def heartbeat_report_job(job_id, stopped):
+    interval = app.config["REPORT_JOB_STALE_SECONDS"] / 4
+    while not stopped.wait(interval):
+        try:
+            conn = get_db_connection()
+            conn.execute(
+                "UPDATE report_jobs SET updated_at = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (int(time.time()), job_id, WORKER_ID),
+            )
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"Error updating report job {job_id} heartbeat: {e}")
+
+# Function to run a single report job on a worker thread
+def run_report_job(job_id):
+    stopped = threading.Event()
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # Claim the job so it is never run twice
+        cursor.execute(
+            """UPDATE report_jobs SET status = 'running', progress = 10, worker = ?, updated_at = ?
+            WHERE job_id = ? AND status = 'queued'""",
+            (WORKER_ID, int(time.time()), job_id),
+        )
+        conn.commit()
+        if cursor.rowcount == 0:
+            conn.close()
+            return
+        threading.Thread(
+            target=heartbeat_report_job, args=(job_id, stopped), daemon=True
+        ).start()
+
+        cursor.execute(
+            "SELECT filename, input_file FROM report_jobs WHERE job_id = ?", (job_id,)
+        )
+        job = cursor.fetchone()
+        conn.close()
+
+        file = FileStorage(stream=BytesIO(job["input_file"]), filename=job["filename"])
+        extracted_text = extract_upload(file, job["filename"])
+        update_report_job(job_id, progress=40)
+
+        # Spread the remaining progress over the analysed chunks
+        def report_progress(done, total):
+            update_report_job(
+                job_id, progress=40 + int(50 * done / total), chunks_done=done, chunks_total=total
+            )
+
+        if extracted_text.strip():
+            gpt_response = get_report_chunked(extracted_text, progress=report_progress)
+            if gpt_response is None:
+                raise RuntimeError("Error generating report")
+            report = f"\n{gpt_response}"
+        else:
+            report = "No text extracted from the file."
+
+        update_report_job(job_id, status="done", progress=100, result=report, input_file=None)
+
+    except Exception as e:
+        print(f"Error running report job {job_id}: {e}")
+        update_report_job(job_id, status="failed", error=str(e), input_file=None)
+    finally:
+        stopped.set()
+
+# Route to submit a report job, returns the job id straight away
+@app.route("/report_jobs", methods=["POST"])
+def submit_report_job():
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "User not logged in"}), 400
+
+    file = request.files.get("file")
+    if not file or not allowed_file(file.filename):
+        return jsonify({"error": "Invalid file type"}), 400
+
+    try:
+        purge_expired_report_jobs()
+        # Pick up jobs orphaned by a worker that stopped since this process started
+        resume_report_jobs()
+
+        job_id = str(uuid.uuid4())
+        now = int(time.time())
+        conn = get_db_connection()
+        conn.execute(
+            """INSERT INTO report_jobs (job_id, user_id, filename, input_file, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (job_id, user_id, secure_filename(file.filename), file.read(), now, now),
+        )
+        conn.commit()
+        conn.close()
+
+        report_executor.submit(run_report_job, job_id)
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+    except Exception as e:
+        print(f"Error submitting report job: {e}")
+        return jsonify({"error": "Error submitting report job"}), 500
+
+# Function to fetch a report job owned by the logged in user
+def get_report_job(job_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT job_id, filename, status, progress, chunks_done, chunks_total, result, error,
+            created_at, updated_at
+        FROM report_jobs WHERE job_id = ? AND user_id = ?""",
+        (job_id, session.get("user_id")),
+    )
+    job = cursor.fetchone()
+    conn.close()
+    return job
+
+# Route to poll the status of a report job
+@app.route("/report_jobs/<job_id>", methods=["GET"])
+def report_job_status(job_id):
+    if not session.get("user_id"):
+        return jsonify({"error": "User not logged in"}), 400
+
+    job = get_report_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job["job_id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "chunks_done": job["chunks_done"],
+        "chunks_total": job["chunks_total"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    })
+
+# Route to download the finished report of a job
+@app.route("/report_jobs/<job_id>/result", methods=["GET"])
+def report_job_result(job_id):
+    if not session.get("user_id"):
+        return jsonify({"error": "User not logged in"}), 400
+
+    job = get_report_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "done":
+        return jsonify({"error": "Report is not ready", "status": job["status"]}), 409
+
+    return send_file(
+        BytesIO(job["result"].encode("utf-8")),
+        as_attachment=True,
+        download_name="report.txt",
+        mimetype="text/plain"
+    )
+
+# Route to list the user's sessions with message counts, without any message content
+@app.route("/sessions", methods=["GET"])
+def list_sessions():
+    user_id = session.get("user_id")
+
+    if not user_id:
+        return jsonify({"success": False, "message": "User not logged in"})
+
+    wait_for_messages(session.get("session_id"))
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT cs.session_id, cs.session_name, cs.created_at,
+                COUNT(m.id) AS message_count, MAX(m.created_at) AS last_message_at
+            FROM chat_sessions cs
+            LEFT JOIN messages m ON cs.session_id = m.session_id
+            WHERE cs.user_id = ?
+            GROUP BY cs.session_id
+            ORDER BY cs.session_name DESC
+            """, (user_id,)
+        )
+        sessions = [
+            {
+                "session_id": row["session_id"],
+                "session_name": row["session_name"],
+                "timestamp": format_utc_plus_8(row["created_at"]),
+                "message_count": row["message_count"],
+                "last_message_at": format_utc_plus_8(row["last_message_at"]),
+            }
+            for row in cursor.fetchall()
+        ]
+        conn.close()
+
+        return jsonify({
+            "success": True,
+            "sessions": sessions,
+            "current_session": session.get("session_name"),
+        })
+
+    except Exception as e:
+        print(f"Error listing sessions: {e}")
+        return jsonify({"success": False, "message": "Error listing sessions"})
+
+# Function to parse a chat history cursor of the form "<created_at>:<id>"
+def parse_history_cursor(cursor):
+    created_at, message_id = cursor.split(":")
+    return int(created_at), int(message_id)
+
+# Route to get chat history, newest first, one page at a time.
+# Pass next_cursor from the previous page as ?cursor= to get the following page.
 @app.route("/get_chat_history", methods=["GET"])
 def get_chat_history():
     user_id = session.get("user_id")
@@ -822,59 +1781,82 @@ def get_chat_history():
     if not user_id:
         return jsonify({"success": False, "message": "User not logged in"})
 
+    wait_for_messages(session.get("session_id"))
+
+    try:
+        limit = min(
+            max(int(request.args.get("limit", app.config["HISTORY_PAGE_SIZE"])), 1),
+            app.config["HISTORY_MAX_PAGE_SIZE"],
+        )
+        preview_chars = int(request.args.get("preview", app.config["HISTORY_PREVIEW_CHARS"]))
+        cursor_arg = request.args.get("cursor")
+        after = parse_history_cursor(cursor_arg) if cursor_arg else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid limit, preview or cursor"}), 400
+
+    # preview=0 returns messages in full
+    max_chars = preview_chars if preview_chars > 0 else app.config["MAX_CONTENT_LENGTH"]
+    conditions = ["cs.user_id = ?"]
+    params = [max_chars, max_chars, user_id]
+
+    # If session_name_filter is provided, filter by session name
+    if session_name_filter:
+        conditions.append("cs.session_name = ?")
+        params.append(session_name_filter)
+
+    # Keyset pagination: continue strictly after the last row of the previous page
+    if after:
+        conditions.append("(m.created_at, m.id) < (?, ?)")
+        params.extend(after)
+
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-
-        # If session_name_filter is provided, filter by session name
-        if session_name_filter:
-            cursor.execute(
-                """
-                SELECT cs.session_id, cs.session_name, m.message, m.response, m.timestamp
-                FROM chat_sessions cs
-                LEFT JOIN messages m ON cs.session_id = m.session_id
-                WHERE cs.user_id = ? AND cs.session_name = ?
-                ORDER BY cs.session_name DESC, m.timestamp DESC
-                """, (user_id, session_name_filter)
-            )
-        else:
-            cursor.execute(
-                """
-                SELECT cs.session_id, cs.session_name, m.message, m.response, m.timestamp
-                FROM chat_sessions cs
-                LEFT JOIN messages m ON cs.session_id = m.session_id
-                WHERE cs.user_id = ?
-                ORDER BY cs.session_name DESC, m.timestamp DESC
-                """, (user_id,)
-            )
-
+        cursor.execute(
+            f"""
+            SELECT m.id, cs.session_id, cs.session_name,
+                substr(m.message, 1, ?) AS message, substr(m.response, 1, ?) AS response,
+                length(m.message) AS message_length, length(m.response) AS response_length,
+                m.created_at
+            FROM messages m
+            JOIN chat_sessions cs ON cs.session_id = m.session_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT ?
+            """, (*params, limit + 1)
+        )
         rows = cursor.fetchall()
+        conn.close()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
 
         chat_history = []
         for row in rows:
             chat_history.append({
-                "session_id": row[0],
-                "session_name": row[1],
-                "message": row[2],
-                "response": row[3],
-                "timestamp": row[4]
+                "id": row["id"],
+                "session_id": row["session_id"],
+                "session_name": row["session_name"],
+                "message": row["message"],
+                "response": row["response"],
+                "truncated": (row["message_length"] or 0) > len(row["message"] or "")
+                    or (row["response_length"] or 0) > len(row["response"] or ""),
+                # Same time the cursor pages by, in the format of the timestamp column (UTC)
+                "timestamp": datetime.fromtimestamp(row["created_at"], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
             })
 
-        cursor.close()
-        conn.close()
+        next_cursor = None
+        if has_more:
+            next_cursor = f"{rows[-1]['created_at']}:{rows[-1]['id']}"
 
         return jsonify({
             "success": True,
-            "chat_history": chat_history
+            "chat_history": chat_history,
+            "next_cursor": next_cursor
         })
 
     except Exception as e:
         print(f"Error getting chat history: {e}")
-        
-        if conn:
-            cursor.close()
-            conn.close()
-
         return jsonify({"success": False, "message": "Error getting chat history"})
 
 # route to clear chat history 
@@ -890,6 +1872,9 @@ def clear_chat_history():
     if not session_name_filter:
         return jsonify({"success": False, "message": "Session name must be provided"})
 
+    # Queued messages must be written first, or they would reappear after the delete
+    wait_for_messages()
+
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -926,6 +1911,14 @@ def clear_chat_history():
             """, (session_id,)
         )
 
+        # Delete the rolling summary of the session
+        cursor.execute(
+            """
+            DELETE FROM session_summaries
+            WHERE session_id = ?
+            """, (session_id,)
+        )
+
         # Step 3: Delete the session record itself
         cursor.execute(
             """
@@ -954,75 +1947,224 @@ def clear_chat_history():
 
         return jsonify({"success": False, "message": f"Error deleting session: {str(e)}"})
 
-# Route to export chat history
+# Function to turn a YYYY-MM-DD date (in UTC+8, like the exported timestamps) into epoch seconds
+def parse_export_date(value):
+    day = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone(timedelta(hours=8)))
+    return int(day.timestamp())
+
+# Function to walk every exported message with a server-side cursor, a batch of rows at a time.
+# Sessions come in order, each followed by its messages; a session without messages gives one row with id NULL.
+def iter_export_rows(user_id, session_name=None, start=None, end=None):
+    message_conditions = ["m.session_id = cs.session_id"]
+    message_params = []
+    if start is not None:
+        message_conditions.append("m.created_at >= ?")
+        message_params.append(start)
+    if end is not None:
+        message_conditions.append("m.created_at < ?")
+        message_params.append(end)
+    # With a date range only sessions that have messages in the range are exported
+    join = "JOIN" if message_params else "LEFT JOIN"
+
+    conditions = ["cs.user_id = ?"]
+    params = [user_id]
+    if session_name:
+        conditions.append("cs.session_name = ?")
+        params.append(session_name)
+
+    conn = get_db_connection()
+    cursor = conn.execute(
+        f"""SELECT cs.session_id, cs.session_name, cs.created_at AS session_created_at,
+               m.id, m.message, m.response, m.created_at AS message_created_at
+        FROM chat_sessions cs
+        {join} messages m ON {" AND ".join(message_conditions)}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY cs.session_name, cs.session_id, m.created_at, m.id""",
+        message_params + params,
+    )
+    try:
+        while True:
+            rows = cursor.fetchmany(app.config["EXPORT_FETCH_ROWS"])
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+# Function to build the exported form of a message
+def export_message(row):
+    return {
+        "id": row["id"],
+        "message": row["message"],
+        "response": row["response"],
+        "timestamp": format_iso_utc_plus_8(row["message_created_at"]),
+    }
+
+# Function to encode the export as NDJSON, one line per message
+def iter_export_ndjson(rows):
+    for row in rows:
+        if row["id"] is None:
+            continue
+        yield json.dumps({
+            "session_id": row["session_id"],
+            "session_name": row["session_name"],
+            "session_timestamp": format_iso_utc_plus_8(row["session_created_at"]),
+            **export_message(row),
+        }, default=str) + "\n"
+
+# Function to encode the export as a single JSON document, one piece at a time
+def iter_export_json(rows, user_id):
+    yield '{"user_id": %s, "exported_at": %s, "sessions": [' % (
+        json.dumps(user_id), json.dumps(format_iso_utc_plus_8(int(time.time())))
+    )
+    current_session = None
+    first_message = True
+    for row in rows:
+        if row["session_id"] != current_session:
+            header = json.dumps({
+                "session_id": row["session_id"],
+                "session_name": row["session_name"],
+                "user_id": user_id,
+                "timestamp": format_iso_utc_plus_8(row["session_created_at"]),
+            })
+            # Reopen the header object so the messages array can be written into it
+            yield ("\n]}," if current_session is not None else "") + "\n" + header[:-1] + ', "messages": ['
+            current_session = row["session_id"]
+            first_message = True
+        if row["id"] is None:
+            continue
+        yield ("" if first_message else ",") + "\n" + json.dumps(export_message(row), default=str)
+        first_message = False
+    if current_session is not None:
+        yield "\n]}"
+    yield "\n]}\n"
+
+# Function to join encoded pieces into blocks of about EXPORT_WRITE_BYTES, gzipping them if requested
+def iter_export_blocks(pieces, compress=False):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        data = piece.encode("utf-8")
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= app.config["EXPORT_WRITE_BYTES"]:
+            block = b"".join(buffer)
+            buffer = []
+            buffered = 0
+            block = compressor.compress(block) if compressor else block
+            if block:
+                yield block
+    block = b"".join(buffer)
+    if compressor:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+# Route to export chat history.
+# Streams every session of the user (or the one in ?session_name=) as JSON, or as NDJSON with ?format=ndjson.
+# ?start_date= and ?end_date= (YYYY-MM-DD, inclusive) limit the messages, ?gzip=1 compresses the download.
 @app.route("/export_chat_history", methods=["GET"])
 def export_chat_history():
     user_id = session.get("user_id")
     session_name_filter = request.args.get("session_name")
+    export_format = request.args.get("format", "json")
+    compress = request.args.get("gzip") == "1"
 
     if not user_id:
         return jsonify({"error": "User not logged in or no active session"}), 400
 
+    if export_format not in ("json", "ndjson"):
+        return jsonify({"error": "Unsupported export format"}), 400
+
+    wait_for_messages(session.get("session_id"))
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        start = parse_export_date(request.args["start_date"]) if request.args.get("start_date") else None
+        # The end date is inclusive, so stop at the start of the following day
+        end = parse_export_date(request.args["end_date"]) + 24 * 60 * 60 if request.args.get("end_date") else None
+    except ValueError:
+        return jsonify({"error": "Dates must be in YYYY-MM-DD format"}), 400
 
+    try:
+        conn = get_db_connection()
         if session_name_filter:
-            cursor.execute(
-                "SELECT * FROM chat_sessions WHERE user_id = ? AND session_name = ?", 
+            db_session = conn.execute(
+                "SELECT 1 FROM chat_sessions WHERE user_id = ? AND session_name = ? LIMIT 1",
                 (user_id, session_name_filter)
-            )
+            ).fetchone()
         else:
-            cursor.execute("SELECT * FROM chat_sessions WHERE user_id = ?", (user_id,))
-
-        db_session = cursor.fetchone()
+            db_session = conn.execute(
+                "SELECT 1 FROM chat_sessions WHERE user_id = ? LIMIT 1", (user_id,)
+            ).fetchone()
 
         if not db_session:
             return jsonify({"error": "Session not found for the current user"}), 404
 
-        session_id = db_session['session_id']
-
-        cursor.execute(
-            "SELECT id, message, response, datetime(timestamp, '+8 hours') AS timestamp_utc8 FROM messages WHERE session_id = ? ORDER BY timestamp", 
-            (session_id,)
-        )
-        messages = cursor.fetchall()
-
-        export_data = {
-            "session_id": session_id,
-            "session_name": db_session["session_name"],
-            "user_id": user_id,
-            "timestamp": db_session["timestamp"],
-            "messages": [
-                {
-                    "id": message["id"],
-                    "message": message["message"],
-                    "response": message["response"],
-                    "timestamp": message["timestamp_utc8"]
-                }
-                for message in messages
-            ]
-        }
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return jsonify({"error": f"Error generating the chat history file: {str(e)}"}), 500
 
-        json_data = json.dumps(export_data, default=str, indent=4)
+    def generate():
+        rows = iter_export_rows(user_id, session_name_filter, start, end)
+        if export_format == "ndjson":
+            pieces = iter_export_ndjson(rows)
+        else:
+            pieces = iter_export_json(rows, user_id)
+        try:
+            yield from iter_export_blocks(pieces, compress)
+        except Exception as e:
+            # Headers are already sent, so the download just ends early
+            print(f"Error streaming the chat history export: {e}")
+
+    filename = f"chat_history.{export_format}" + (".gz" if compress else "")
+    if compress:
+        mimetype = "application/gzip"
+    elif export_format == "ndjson":
+        mimetype = "application/x-ndjson"
+    else:
+        mimetype = "application/json"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-        byte_io = BytesIO(json_data.encode('utf-8'))
-        byte_io.seek(0)
+# Route to report cache hit/miss counters
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "text_cache": text_cache.stats(),
+        "response_cache": response_cache.stats(),
+    })
 
-        return send_file(
-            byte_io,
-            as_attachment=True,
-            download_name="chat_history.json",
-            mimetype='application/json'
+# Function to note when a request started, for the request duration histogram
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Function to record the duration of each request by route, method and status.
+# Streamed responses are measured until the stream starts.
+@app.after_request
+def record_request_duration(response):
+    started = g.get("request_started")
+    if started is not None:
+        # The route pattern, not the URL, so job ids do not create new series
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        request_duration.observe(
+            time.perf_counter() - started,
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
         )
+    return response
 
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return jsonify({"error": f"Error generating the chat history file: {str(e)}"}), 500
-
-    finally:
-        if conn:
-            conn.close()
+# Route to expose the metrics in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Route to logout
 @app.route("/logout")
@@ -1037,6 +2179,9 @@ def delete_account():
     if not user_id:
         return jsonify({"error": "User not logged in"}), 400
 
+    # Queued messages must be written first, or they would fail to insert after the delete
+    wait_for_messages()
+
     try:
         # Connect to the database
         conn = get_db_connection()
@@ -1052,8 +2197,12 @@ def delete_account():
 
         # Delete all associated chat messages
         cursor.execute("DELETE FROM messages WHERE session_id IN (SELECT session_id FROM chat_sessions WHERE user_id = ?)", (user_id,))
+        # Delete all associated session summaries
+        cursor.execute("DELETE FROM session_summaries WHERE session_id IN (SELECT session_id FROM chat_sessions WHERE user_id = ?)", (user_id,))
         # Delete all associated chat sessions
         cursor.execute("DELETE FROM chat_sessions WHERE user_id = ?", (user_id,))
+        # Delete all associated report jobs
+        cursor.execute("DELETE FROM report_jobs WHERE user_id = ?", (user_id,))
         # Delete the user from the users table
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
 
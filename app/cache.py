@@ -0,0 +1,276 @@
+# Caches shared by the request handlers.
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Function to hash a string key into a fixed length hex digest
+def hash_key(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+# Content-addressed cache for extracted document text.
+# Entries live in an in-memory LRU tier backed by an on-disk tier, both bounded by size.
+class TextCache:
+    def __init__(self, directory, memory_bytes, disk_bytes):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        # digest -> (text, size of the text in UTF-8 bytes)
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk_used = None
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    # Function to get cached text, or None on a miss
+    def get(self, key):
+        digest = hash_key(key)
+        with self.lock:
+            if digest in self.memory:
+                self.memory.move_to_end(digest)
+                self.counters["memory_hits"] += 1
+                return self.memory[digest][0]
+
+        text = self.read_disk(digest)
+        with self.lock:
+            if text is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self.store_memory(digest, text)
+        return text
+
+    # Function to store text in both tiers
+    def set(self, key, text):
+        digest = hash_key(key)
+        with self.lock:
+            self.store_memory(digest, text)
+        self.write_disk(digest, text)
+
+    # Function to add an entry to the memory tier, evicting least recently used entries
+    def store_memory(self, digest, text):
+        size = len(text.encode("utf-8"))
+        if size > self.memory_bytes:
+            return
+        if digest in self.memory:
+            self.memory_used -= self.memory.pop(digest)[1]
+        self.memory[digest] = (text, size)
+        self.memory_used += size
+        while self.memory_used > self.memory_bytes:
+            _, (_, evicted_size) = self.memory.popitem(last=False)
+            self.memory_used -= evicted_size
+            self.counters["evictions"] += 1
+
+    # Function to get the path of a disk entry
+    def disk_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + ".z")
+
+    # Function to read an entry from the disk tier
+    def read_disk(self, digest):
+        if not self.disk_bytes:
+            return None
+        path = self.disk_path(digest)
+        try:
+            with open(path, "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+            os.utime(path)  # Mark as recently used for eviction
+            return text
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading text cache entry: {e}")
+            return None
+
+    # Function to write an entry to the disk tier
+    def write_disk(self, digest, text):
+        if not self.disk_bytes:
+            return
+        path = self.disk_path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = zlib.compress(text.encode("utf-8"), 1)
+            # Write to a temporary file first so other processes never read a partial entry
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            # An overwritten entry no longer takes up its old size
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"Error writing text cache entry: {e}")
+            return
+
+        with self.lock:
+            if self.disk_used is None:
+                self.disk_used = self.scan_disk()[1]
+            else:
+                self.disk_used += len(data) - replaced
+            if self.disk_used > self.disk_bytes:
+                self.evict_disk()
+
+    # Function to list the disk entries as (mtime, size, path), plus their total size
+    def scan_disk(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".z"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    # Function to remove the least recently used disk entries until 90% of the limit
+    def evict_disk(self):
+        # Rescan, other processes may have added or removed entries
+        entries, total = self.scan_disk()
+        entries.sort()
+        target = self.disk_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.counters["evictions"] += 1
+            except FileNotFoundError:
+                continue
+        self.disk_used = total
+
+    # Function to report hit/miss counters and tier sizes
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_used,
+                "disk_bytes": self.disk_used,
+            }
+
+# Function to normalize text for cache keys, so whitespace and case differences still hit
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+# Cache of LLM responses keyed on model, prompt and normalized input.
+# Stored in SQLite so every worker process shares it, with TTL and LRU eviction.
+class ResponseCache:
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    # Function to get this thread's connection to the cache database
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    last_used_at INTEGER NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used_at)"
+            )
+            conn.commit()
+            self.local.conn = conn
+        return conn
+
+    # Function to build the cache key for a completion request
+    def make_key(self, model, messages, **params):
+        normalized = {
+            "model": model,
+            "messages": [
+                {"role": m["role"], "content": normalize_text(m["content"])} for m in messages
+            ],
+            "params": params,
+        }
+        return hash_key(json.dumps(normalized, sort_keys=True))
+
+    # Function to get a cached response, or None on a miss
+    def get(self, key):
+        if not self.ttl:
+            return None
+        try:
+            conn = self.connect()
+            now = int(time.time())
+            row = conn.execute(
+                "SELECT response FROM responses WHERE cache_key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE responses SET last_used_at = ? WHERE cache_key = ?", (now, key)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error reading response cache: {e}")
+            row = None
+
+        with self.lock:
+            self.counters["hits" if row else "misses"] += 1
+        return row[0] if row else None
+
+    # Function to store a response, dropping expired and least recently used entries
+    def set(self, key, response):
+        if not self.ttl or response is None:
+            return
+        try:
+            conn = self.connect()
+            now = int(time.time())
+            conn.execute(
+                """INSERT OR REPLACE INTO responses (cache_key, response, created_at, last_used_at)
+                VALUES (?, ?, ?, ?)""",
+                (key, response, now, now),
+            )
+            conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute(
+                """DELETE FROM responses WHERE cache_key IN (
+                    SELECT cache_key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing response cache: {e}")
+
+    # Function to report hit/miss counters and the number of stored entries
+    def stats(self):
+        try:
+            entries = self.connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+            }
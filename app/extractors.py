@@ -0,0 +1,860 @@
+# Text extraction for uploaded files.
+# Every extractor is a generator that yields text chunks, so later stages can
+# start before the whole file is parsed. Extractors are looked up in a registry
+# keyed by file extension and by MIME type sniffed from the file contents.
+import io
+import os
+import re
+import csv
+import json
+import random
+import time
+import datetime
+import atexit
+import codecs
+import shutil
+import hashlib
+import heapq
+import zipfile
+import tempfile
+import mimetypes
+import multiprocessing
+from collections import Counter, deque
+import pdfplumber
+from docx import Document
+import pandas as pd
+import openpyxl
+from openpyxl.utils import get_column_letter
+import ocr
+from pools import SharedPool
+
+# Bump whenever extractor output changes, so cached text from older versions is not reused
+EXTRACTOR_VERSION = "5"
+
+# Registry of extractors by file extension and by MIME type
+EXTRACTORS_BY_EXTENSION = {}
+EXTRACTORS_BY_MIME = {}
+
+# Size of the blocks read from text based uploads
+READ_BLOCK_SIZE = 64 * 1024
+# Text held back waiting for the end of a sentence; past this, it is handed over
+# at the last line break or space so unpunctuated text still streams
+MAX_PENDING_TEXT = 64 * 1024
+
+# End of a sentence in plain text
+SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+# Parallel PDF extraction: worker processes (0 or 1 disables it), minimum pages
+# handed to each worker, and the time allowed for a whole document (seconds)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", 0))
+PDF_MIN_PAGES_PER_TASK = int(os.getenv("PDF_MIN_PAGES_PER_TASK", 25))
+PDF_TIMEOUT = float(os.getenv("PDF_TIMEOUT", 120))
+
+# Spreadsheet limits: sheets read per workbook, rows kept per sheet (0 keeps every row)
+# and how many of the kept rows come from the end of the sheet
+XLSX_MAX_SHEETS = int(os.getenv("XLSX_MAX_SHEETS", 20))
+XLSX_MAX_ROWS = int(os.getenv("XLSX_MAX_ROWS", 500))
+XLSX_TAIL_ROWS = int(os.getenv("XLSX_TAIL_ROWS", 50))
+
+# CSV limits: files with up to CSV_MAX_ROWS rows are returned whole after their profile,
+# larger ones as a profile and CSV_SAMPLE_ROWS sample rows. Distinct values are counted
+# exactly up to CSV_MAX_DISTINCT per column and estimated past it, and top values are
+# tracked in at most twice as many counters.
+CSV_MAX_ROWS = int(os.getenv("CSV_MAX_ROWS", 500))
+CSV_SAMPLE_ROWS = int(os.getenv("CSV_SAMPLE_ROWS", 20))
+CSV_MAX_DISTINCT = int(os.getenv("CSV_MAX_DISTINCT", 1000))
+# Top values listed per column, and the longest value kept for counting
+CSV_TOP_VALUES = 5
+CSV_MAX_VALUE_LENGTH = 100
+# Rows profiled together, counting a block of values at once is much faster than one by one
+CSV_PROFILE_BLOCK_ROWS = 1024
+
+# Cell values treated as missing, and columns where a missing value is worth reporting
+NULL_VALUES = {"", "null", "none", "n/a", "na", "nan", "-"}
+BOOLEAN_VALUES = {"true", "false", "yes", "no"}
+DATE_VALUE = re.compile(r"\d{4}-\d{2}-\d{2}([T ][\d:.]+(Z|[+-]\d{2}:?\d{2})?)?|\d{1,2}/\d{1,2}/\d{2,4}( [\d:]+)?")
+LAST_ACTIVITY_COLUMN = re.compile(r"last[\s_-]*(login|logon|sign[\s_-]*in|seen|activity|used)", re.I)
+
+# Env-driven settings that change extractor output, here and in ocr
+OUTPUT_SETTINGS = (
+    "MAX_PENDING_TEXT",
+    "XLSX_MAX_SHEETS", "XLSX_MAX_ROWS", "XLSX_TAIL_ROWS",
+    "CSV_MAX_ROWS", "CSV_SAMPLE_ROWS", "CSV_MAX_DISTINCT",
+)
+OCR_OUTPUT_SETTINGS = ("OCR_MAX_PAGES", "OCR_DPI", "OCR_LANGUAGES", "OCR_MAX_SIDE", "OCR_TIMEOUT")
+
+# Function to fingerprint the current output settings, so cached text from other settings is not reused
+def settings_fingerprint():
+    values = [f"{name}={globals()[name]}" for name in OUTPUT_SETTINGS]
+    values += [f"{name}={getattr(ocr, name)}" for name in OCR_OUTPUT_SETTINGS]
+    return hashlib.sha256(";".join(values).encode("utf-8")).hexdigest()[:12]
+
+# Function to register an extractor for a set of extensions and MIME types
+def register_extractor(extensions, mime_types=()):
+    def decorator(func):
+        for extension in extensions:
+            EXTRACTORS_BY_EXTENSION[extension] = func
+        for mime_type in mime_types:
+            EXTRACTORS_BY_MIME[mime_type] = func
+        return func
+    return decorator
+
+# Function to get the underlying byte stream of an upload
+def get_stream(file):
+    return getattr(file, "stream", file)
+
+# Function to hash the bytes of an upload without loading it all at once
+def hash_upload(file):
+    stream = get_stream(file)
+    position = stream.tell()
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(READ_BLOCK_SIZE), b""):
+        digest.update(block)
+    stream.seek(position)
+    return digest.hexdigest()
+
+# Function to get the size of an upload in bytes
+def upload_size(file):
+    stream = get_stream(file)
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+# Function to sniff the MIME type of an upload from its leading bytes
+def sniff_mime_type(file):
+    stream = get_stream(file)
+    try:
+        position = stream.tell()
+        header = stream.read(8)
+        stream.seek(position)
+    except (AttributeError, OSError):
+        return None
+
+    if header.startswith(b"%PDF"):
+        return "application/pdf"
+    if header.startswith(b"\x89PNG"):
+        return "image/png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"PK\x03\x04"):
+        # DOCX and XLSX are both zip containers, tell them apart by their parts
+        try:
+            with zipfile.ZipFile(stream) as archive:
+                names = archive.namelist()
+        except zipfile.BadZipFile:
+            return None
+        finally:
+            stream.seek(position)
+        if any(name.startswith("word/") for name in names):
+            return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        if any(name.startswith("xl/") for name in names):
+            return "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return None
+
+# Function to find the extractor for an upload
+def get_extractor(file, filename):
+    # Binary signatures win over the extension, so a renamed file is still parsed correctly
+    mime_type = sniff_mime_type(file)
+    if mime_type in EXTRACTORS_BY_MIME:
+        return EXTRACTORS_BY_MIME[mime_type]
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in EXTRACTORS_BY_EXTENSION:
+        return EXTRACTORS_BY_EXTENSION[extension]
+
+    guessed_type, _ = mimetypes.guess_type(filename)
+    return EXTRACTORS_BY_MIME.get(guessed_type)
+
+# Function to lazily yield text chunks from an upload
+def iter_text(file, filename):
+    extractor = get_extractor(file, filename)
+    if extractor is None:
+        return iter(())
+    return extractor(file)
+
+# Function to extract text from an upload, stopping once max_chars is reached
+def extract_text(file, filename, max_chars=None):
+    chunks = []
+    total = 0
+    text_chunks = iter_text(file, filename)
+    try:
+        for chunk in text_chunks:
+            if not chunk:
+                continue
+            if max_chars is not None and total + len(chunk) > max_chars:
+                chunks.append(chunk[: max_chars - total])
+                print(f"Extracted text from {filename} truncated at {max_chars} characters")
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+    finally:
+        # Stop the extractor early instead of parsing the rest of the file
+        if hasattr(text_chunks, "close"):
+            text_chunks.close()
+    return "".join(chunks)
+
+# Function to join PDF lines into sentences
+def join_pdf_lines(page_text):
+    lines = []
+    temp_text = []
+    for line in page_text.split("\n"):
+        line = line.strip()
+        if re.search(r"[.!?]$", line):  # Sentence-ending punctuation
+            temp_text.append(line)
+            lines.append("".join(temp_text) + "\n")
+            temp_text = []  # Reset
+        else:
+            temp_text.append(line + " ")
+    if temp_text:
+        lines.append("".join(temp_text).strip() + "\n")
+    return "".join(lines)
+
+# Process pool for parallel PDF extraction, shared by concurrent uploads
+pdf_pool = SharedPool(PDF_WORKERS)
+
+atexit.register(pdf_pool.terminate)
+
+# Function to split a PDF into page ranges for the worker processes
+def split_page_ranges(page_count):
+    task_count = max(1, min(PDF_WORKERS * 4, page_count // PDF_MIN_PAGES_PER_TASK))
+    pages_per_task = -(-page_count // task_count)  # Round up
+    return [
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+
+# Function to check whether a page is a scan: no text layer, but images to read
+def is_scanned_page(page, page_text):
+    return not (page_text and page_text.strip()) and bool(page.images)
+
+# Function to extract the text of a range of PDF pages, runs in a worker process.
+# Scanned pages are OCRed here, a worker cannot hand work to the OCR pool.
+def extract_pdf_page_range(file_path, start, end):
+    texts = []
+    ocr_pages = 0
+    with pdfplumber.open(file_path, pages=list(range(start + 1, end + 1))) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if is_scanned_page(page, page_text) and ocr_pages < ocr.OCR_MAX_PAGES and ocr.ocr_available():
+                ocr_pages += 1
+                try:
+                    page_text = ocr.ocr_pdf_page(page)
+                except Exception as e:
+                    print(f"Error running OCR on PDF page {page.page_number}: {e}")
+            if page_text:
+                texts.append(join_pdf_lines(page_text))
+    return "".join(texts)
+
+# Function to extract PDF pages in order in this process, sending scanned pages to the OCR pool.
+# Text pages are handed over as soon as every page before them is done.
+def extract_pdf_pages(pdf, stream):
+    pending = deque()
+    scan_path = None
+    ocr_pages = 0
+    job = None
+    try:
+        for index, page in enumerate(pdf.pages):
+            page_text = page.extract_text()
+            if is_scanned_page(page, page_text) and ocr_pages < ocr.OCR_MAX_PAGES and ocr.ocr_available():
+                if scan_path is None:
+                    # OCR workers open the document from disk, pdfplumber keeps reading the stream
+                    position = stream.tell()
+                    stream.seek(0)
+                    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+                        shutil.copyfileobj(stream, temp_file)
+                    stream.seek(position)
+                    scan_path = temp_file.name
+                    job = ocr.OcrJob()
+                ocr_pages += 1
+                pending.append(job.submit(ocr.ocr_pdf_file_page, scan_path, index))
+            elif page_text:
+                pending.append(join_pdf_lines(page_text))
+
+            while pending and (isinstance(pending[0], str) or pending[0].ready()):
+                text = pending.popleft()
+                if not isinstance(text, str):
+                    text = join_pdf_lines(job.wait_for(text) or "")
+                yield text
+
+        # Wait for the remaining OCR pages in order
+        while pending:
+            text = pending.popleft()
+            if not isinstance(text, str):
+                text = join_pdf_lines(job.wait_for(text) or "")
+            yield text
+    finally:
+        if job:
+            job.close()
+        if scan_path:
+            os.remove(scan_path)
+
+# Function to extract PDF text across the process pool, merged back in page order
+def extract_text_from_pdf_parallel(stream, page_count):
+    # Workers open the document from disk rather than receiving a copy of the bytes
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+        shutil.copyfileobj(stream, temp_file)
+    pool = pdf_pool.acquire()
+    timed_out = False
+    try:
+        results = [
+            pool.apply_async(extract_pdf_page_range, (temp_file.name, start, end))
+            for start, end in split_page_ranges(page_count)
+        ]
+
+        deadline = time.monotonic() + PDF_TIMEOUT
+        for result in results:
+            if timed_out:
+                # Keep ranges that already finished, skip the ones still running
+                if result.ready() and result.successful():
+                    yield result.get()
+                continue
+            try:
+                yield result.get(timeout=max(0, deadline - time.monotonic()))
+            except multiprocessing.TimeoutError:
+                print(f"PDF extraction timed out after {PDF_TIMEOUT} seconds, returning partial text")
+                timed_out = True
+    finally:
+        # Stuck workers cannot be cancelled, so a timeout retires the pool; other uploads
+        # still waiting on it keep their workers until they are done
+        pdf_pool.release(pool, retire=timed_out)
+        os.remove(temp_file.name)
+
+# Extract text from PDF
+@register_extractor([".pdf"], ["application/pdf"])
+def extract_text_from_pdf(file):
+    try:
+        stream = get_stream(file)
+        with pdfplumber.open(stream) as pdf:
+            page_count = len(pdf.pages)
+            if PDF_WORKERS < 2 or page_count < 2 * PDF_MIN_PAGES_PER_TASK:
+                yield from extract_pdf_pages(pdf, stream)
+                return
+
+        stream.seek(0)
+        yield from extract_text_from_pdf_parallel(stream, page_count)
+    except Exception as e:
+        print(f"Error extracting PDF text: {e}")
+
+# Function to extract text from DOCX
+@register_extractor(
+    [".docx"],
+    ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"],
+)
+def extract_text_from_docx(file):
+    try:
+        doc = Document(get_stream(file))
+        for para in doc.paragraphs:
+            sentences = para.text.split(".")
+            yield "".join(sentence.strip() + "\n" for sentence in sentences)
+    except Exception as e:
+        print(f"Error extracting DOCX text: {e}")
+
+# Function to extract text from an image with Tesseract
+@register_extractor([".jpg", ".jpeg", ".png"], ["image/jpeg", "image/png"])
+def extract_text_from_image(file):
+    try:
+        # Recognised in the OCR pool, see ocr.py for how Tesseract is found
+        text = ocr.ocr_image(get_stream(file).read())
+        if not text:
+            raise ValueError("No text could be extracted from the image.")
+        cleaned_text = " ".join(text.splitlines())
+        cleaned_text = cleaned_text.replace(" .", ".").replace(" ,", ",")
+        sentences = re.split(r"([.?!])\s*", cleaned_text)
+        for i in range(0, len(sentences), 2):
+            sentence = sentences[i].strip()
+            if i + 1 < len(sentences):
+                sentence += sentences[i + 1]
+            if sentence:
+                yield sentence.strip() + "\n"
+    except Exception as e:
+        print(f"Error in extract_text_from_image: {e}")
+
+# Function to process text into properly formatted sentences
+def process_text(text):
+    # Split text into sentences using punctuation
+    sentences = re.split(r"([.!?])(?=\s|$)", text)
+    # Reconstruct sentences with new lines
+    formatted_text = "".join(
+        [
+            sentence.strip() + punctuation + "\n"
+            for sentence, punctuation in zip(sentences[::2], sentences[1::2])
+        ]
+    )
+    # Handle trailing sentence without punctuation
+    if len(sentences) % 2 == 1 and sentences[-1].strip():
+        formatted_text += sentences[-1].strip()
+    return formatted_text
+
+# Function to extract text from txt file
+@register_extractor([".txt"], ["text/plain"])
+def extract_text_from_txt(file):
+    try:
+        stream = get_stream(file)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        while True:
+            block = stream.read(READ_BLOCK_SIZE)
+            # Only the new text can end a sentence; start one character back, since
+            # punctuation at the end of the last block had nothing after it yet
+            start = max(len(buffer) - 1, 0)
+            buffer += decoder.decode(block, final=not block)
+            if not block:
+                break
+            # Only hand over complete sentences, the rest waits for the next block
+            cut = None
+            for match in SENTENCE_END.finditer(buffer, start):
+                cut = match.end()
+            if cut is not None:
+                yield process_text(buffer[:cut])
+                buffer = buffer[cut:]
+            elif len(buffer) > MAX_PENDING_TEXT:
+                # No sentence ends in sight (logs, tables, OCR output), break at a line or word
+                cut = max(buffer.rfind("\n"), buffer.rfind(" "), buffer.rfind("\t")) + 1
+                if cut:
+                    # process_text strips the break, keep the words apart
+                    separator = "\n" if buffer[cut - 1] == "\n" else " "
+                else:
+                    cut, separator = len(buffer), ""
+                yield process_text(buffer[:cut]) + separator
+                buffer = buffer[cut:]
+        yield process_text(buffer)
+
+    except Exception as e:
+        print(f"Error extracting TXT text: {e}")
+
+# Function to extract text from xlsx file
+@register_extractor(
+    [".xlsx"],
+    ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"],
+)
+def extract_text_from_xlsx(file):
+    try:
+        # Read-only mode streams rows from the sheet XML instead of building every cell in memory
+        workbook = openpyxl.load_workbook(get_stream(file), read_only=True, data_only=True)
+    except Exception as e:
+        # Corrupt or renamed files: not a zip, or a zip without a workbook
+        print(f"Error opening XLSX file: {e}")
+        yield "Error reading the XLSX file."
+        return
+    try:
+        sheetnames = workbook.sheetnames
+        for sheet in sheetnames[:XLSX_MAX_SHEETS]:
+            yield from extract_xlsx_sheet(sheet, workbook[sheet])
+        if len(sheetnames) > XLSX_MAX_SHEETS:
+            skipped = ", ".join(sheetnames[XLSX_MAX_SHEETS:])
+            yield f"{len(sheetnames) - XLSX_MAX_SHEETS} more sheets not read: {skipped}\n"
+    except Exception as e:
+        # A damaged sheet ends the extraction, the sheets read so far are kept
+        print(f"Error extracting XLSX text: {e}")
+        yield "Error reading the rest of the XLSX file."
+    finally:
+        # Read-only workbooks keep the archive open until closed
+        workbook.close()
+
+# Function to get the kind of a cell value for the column types of a sheet summary
+def cell_kind(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return "date"
+    return "text"
+
+# Function to format a spreadsheet row: tab between cells, empty cells become empty strings
+def format_xlsx_row(row):
+    return "\t".join("" if cell is None else str(cell) for cell in row).strip() + "\n"
+
+# Function to extract one sheet as a summary (header, row count, column types) followed by
+# a sample of its rows: the first rows and the last XLSX_TAIL_ROWS once XLSX_MAX_ROWS is passed
+def extract_xlsx_sheet(name, worksheet):
+    header = None
+    kinds = []
+    row_count = 0
+    tail_rows = XLSX_TAIL_ROWS if XLSX_MAX_ROWS else 0
+    head_limit = max(XLSX_MAX_ROWS - tail_rows, 0) if XLSX_MAX_ROWS else None
+    head = []
+    tail = deque(maxlen=tail_rows) if tail_rows else None
+
+    for row in worksheet.iter_rows(values_only=True):
+        # Formatted but empty rows are padding, not data
+        if all(cell is None or cell == "" for cell in row):
+            continue
+        if header is None:
+            header = row
+            continue
+        row_count += 1
+        if len(kinds) < len(row):
+            kinds.extend(set() for _ in range(len(row) - len(kinds)))
+        for index, cell in enumerate(row):
+            if cell is not None and cell != "":
+                kinds[index].add(cell_kind(cell))
+        if head_limit is None or len(head) < head_limit:
+            head.append(format_xlsx_row(row))
+        elif tail is not None:
+            tail.append(format_xlsx_row(row))
+        # Past the limit without a tail, rows are only counted
+
+    if header is None:
+        yield f"Sheet: {name} (empty)\n\n"
+        return
+
+    columns = ["" if cell is None else str(cell).strip() for cell in header]
+    columns += [""] * (len(kinds) - len(columns))
+    kinds += [set() for _ in range(len(columns) - len(kinds))]
+    # Trailing columns with neither a header nor values are formatting leftovers
+    while columns and not columns[-1] and not kinds[len(columns) - 1]:
+        columns.pop()
+    types = []
+    for index, column in enumerate(columns):
+        column_kinds = kinds[index]
+        if not column_kinds:
+            kind = "empty"
+        elif len(column_kinds) == 1:
+            kind = next(iter(column_kinds))
+        else:
+            kind = "mixed (" + ", ".join(sorted(column_kinds)) + ")"
+        types.append(f"{column or get_column_letter(index + 1)}: {kind}")
+
+    yield (
+        f"Sheet: {name} ({row_count} rows, {len(columns)} columns)\n"
+        f"Header: {format_xlsx_row(header)}"
+        f"Column types: {', '.join(types)}\n"
+    )
+    yield "".join(head)
+    omitted = row_count - len(head) - (len(tail) if tail is not None else 0)
+    if omitted:
+        yield f"... {omitted} rows omitted ...\n"
+    if tail:
+        yield "".join(tail)
+    yield "\n"
+
+# Function to guess the encoding of a text upload from its first bytes
+def sniff_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # Incremental, so a character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        # Windows exports; every byte decodes, unlike utf-8
+        return "cp1252"
+
+# Function to guess the CSV dialect from a decoded sample, comma separated if unsure
+def sniff_dialect(sample):
+    # The last line of the sample may be cut short
+    sample = sample[: sample.rfind("\n") + 1] or sample
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        return csv.excel
+
+# Function to get the kind of a stripped CSV value: empty, number, date, boolean or text
+def csv_value_kind(value):
+    lowered = value.lower()
+    if lowered in NULL_VALUES:
+        return "empty"
+    if lowered in BOOLEAN_VALUES:
+        return "boolean"
+    # Numbers and dates start with a digit or a sign, anything else is text
+    if value[0] in "0123456789+-.":
+        if DATE_VALUE.fullmatch(value):
+            return "date"
+        try:
+            float(value.replace(",", ""))
+            return "number"
+        except ValueError:
+            pass
+    return "text"
+
+# Function to hash a value to a 64-bit integer, the same in every process
+def value_hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "big")
+
+# Running profile of one CSV column, bounded by CSV_MAX_DISTINCT values.
+# Top values are counted with a Misra-Gries sketch: when the counters reach twice CSV_MAX_DISTINCT,
+# every count drops by the CSV_MAX_DISTINCT+1-th largest one and the counters left at zero go, so a
+# count is low by at most the total dropped. Distinct values are counted with a k minimum values
+# sketch: exact until CSV_MAX_DISTINCT hashes are seen, then estimated from the largest kept hash.
+class ColumnProfile:
+    def __init__(self, name):
+        self.name = name
+        self.kinds = Counter()
+        self.values = Counter()
+        # Kind of each counted value, so repeated values are classified once
+        self.value_kinds = {}
+        # Total taken off every count by the sketch
+        self.dropped = 0
+        # Smallest CSV_MAX_DISTINCT hashes seen, as a set and as a max-heap of negated hashes
+        self.hashes = set()
+        self.hash_heap = []
+
+    # Function to add a block of values from the column
+    def add_values(self, values):
+        for value, count in Counter(map(str.strip, values)).items():
+            self.add(value, count)
+
+    # Function to add a stripped value seen count times
+    def add(self, value, count=1):
+        value = value[:CSV_MAX_VALUE_LENGTH]
+        kind = self.value_kinds.get(value)
+        if kind is None:
+            kind = csv_value_kind(value)
+        self.kinds[kind] += count
+        if kind == "empty":
+            return
+        self.add_hash(value_hash(value))
+        if value not in self.values:
+            self.value_kinds[value] = kind
+        self.values[value] += count
+        if len(self.values) >= 2 * CSV_MAX_DISTINCT:
+            self.shrink()
+
+    # Function to keep the hash of a value if it is among the smallest CSV_MAX_DISTINCT seen
+    def add_hash(self, hashed):
+        if hashed in self.hashes:
+            return
+        if len(self.hashes) < CSV_MAX_DISTINCT:
+            self.hashes.add(hashed)
+            heapq.heappush(self.hash_heap, -hashed)
+        elif hashed < -self.hash_heap[0]:
+            self.hashes.discard(-heapq.heapreplace(self.hash_heap, -hashed))
+            self.hashes.add(hashed)
+
+    # Function to cut the top value counters back to at most CSV_MAX_DISTINCT
+    def shrink(self):
+        cut = heapq.nlargest(CSV_MAX_DISTINCT + 1, self.values.values())[-1]
+        self.dropped += cut
+        for value, count in list(self.values.items()):
+            if count > cut:
+                self.values[value] = count - cut
+            else:
+                del self.values[value]
+                del self.value_kinds[value]
+
+    # Function to get the number of distinct values, and whether it is an estimate
+    def distinct(self):
+        if len(self.hashes) < CSV_MAX_DISTINCT:
+            return len(self.hashes), False
+        # The k-th smallest of n uniform hashes sits near k/n of the hash range
+        return round((CSV_MAX_DISTINCT - 1) * 2**64 / (-self.hash_heap[0] + 1)), True
+
+    # Function to describe the column in one line
+    def describe(self, row_count):
+        empty = self.kinds["empty"]
+        filled = {kind: count for kind, count in self.kinds.most_common() if kind != "empty"}
+        if not filled:
+            kind = "empty"
+        else:
+            # Kinds by count, the most common one first
+            kind, *others = filled
+            if others:
+                kind += " (also " + ", ".join(f"{filled[other]} {other}" for other in others) + ")"
+        distinct, estimated = self.distinct()
+        distinct = f"about {distinct}" if estimated else str(distinct)
+        line = f"{self.name}: {kind}, {empty / max(row_count, 1):.1%} empty, {distinct} distinct"
+        # Top values only say something when values repeat
+        if self.values and self.values.most_common(1)[0][1] > 1:
+            # Counts cut by the sketch are lower bounds
+            prefix = "at least " if self.dropped else ""
+            top = ", ".join(
+                f"{value} ({prefix}{count})" for value, count in self.values.most_common(CSV_TOP_VALUES)
+            )
+            line += f", top values: {top}"
+        return line + "\n"
+
+    # Function to list data quality problems found in the column
+    def anomalies(self, row_count):
+        found = []
+        empty = self.kinds["empty"]
+        if empty and LAST_ACTIVITY_COLUMN.search(self.name):
+            found.append(f"{empty} rows have no {self.name}")
+        filled = sum(self.kinds.values()) - empty
+        if filled:
+            kind, count = max(((k, c) for k, c in self.kinds.items() if k != "empty"), key=lambda item: item[1])
+            # A few values of another kind in an otherwise consistent column are usually typos
+            if count < filled and count / filled >= 0.9:
+                found.append(f"{filled - count} values in {self.name} are not {kind}")
+            if filled == row_count and self.distinct() == (1, False) and row_count > 1:
+                found.append(f"{self.name} has the same value in every row")
+        return found
+
+# Function to format a CSV row for the output
+def format_csv_row(row):
+    return ",".join(row) + "\n"
+
+# Function to extract a CSV file as a profile (columns, types, empty values, distinct and
+# top values, anomalies) followed by its rows, or a sample of them for large files.
+# The file is decoded as it is read, so memory does not grow with the row count.
+@register_extractor([".csv"], ["text/csv"])
+def extract_text_from_csv(file):
+    stream = get_stream(file)
+    position = stream.tell()
+    sample = stream.read(READ_BLOCK_SIZE)
+    stream.seek(position)
+    encoding = sniff_encoding(sample)
+    dialect = sniff_dialect(sample.decode(encoding, errors="ignore"))
+
+    file_io = io.TextIOWrapper(stream, encoding=encoding, errors="replace", newline="")
+    try:
+        reader = csv.reader(file_io, dialect)
+        header = next(reader, None)
+        if header is None:
+            yield "CSV file is empty.\n"
+            return
+        columns = [ColumnProfile(name.strip() or f"Column {index + 1}") for index, name in enumerate(header)]
+        row_count = 0
+        ragged_rows = 0
+        head = []
+        # The sample is the first rows, then a reservoir sample of the rest
+        # where every row is equally likely to be kept
+        sample_head = CSV_SAMPLE_ROWS - CSV_SAMPLE_ROWS // 2
+        sample_size = CSV_SAMPLE_ROWS // 2
+        reservoir = []
+        rng = random.Random(0)
+        block = []
+        for row in reader:
+            if not row:
+                continue
+            row_count += 1
+            if len(row) == len(columns):
+                block.append(row)
+            else:
+                # Profiled as if padded or cut to the header, and reported
+                ragged_rows += 1
+                block.append((row + [""] * len(columns))[: len(columns)])
+            if len(block) == CSV_PROFILE_BLOCK_ROWS:
+                for profile, values in zip(columns, zip(*block)):
+                    profile.add_values(values)
+                block = []
+            if len(head) < CSV_MAX_ROWS:
+                head.append(row)
+            if row_count <= sample_head:
+                continue
+            if len(reservoir) < sample_size:
+                reservoir.append((row_count, row))
+            else:
+                slot = rng.randrange(row_count - sample_head)
+                if slot < sample_size:
+                    reservoir[slot] = (row_count, row)
+        for profile, values in zip(columns, zip(*block)):
+            profile.add_values(values)
+
+        delimiter = "tab" if dialect.delimiter == "\t" else f'"{dialect.delimiter}"'
+        yield (
+            f"CSV: {row_count} rows, {len(columns)} columns, delimiter {delimiter}, encoding {encoding}\n"
+            f"Columns:\n" + "".join(profile.describe(row_count) for profile in columns)
+        )
+        anomalies = [problem for profile in columns for problem in profile.anomalies(row_count)]
+        if ragged_rows:
+            anomalies.append(f"{ragged_rows} rows do not have {len(columns)} fields")
+        if anomalies:
+            yield "Anomalies:\n" + "".join(f"- {problem}\n" for problem in anomalies)
+
+        yield format_csv_row(header)
+        if row_count <= CSV_MAX_ROWS:
+            yield "".join(format_csv_row(row) for row in head)
+            return
+        first = head[:sample_head]
+        yield f"Sample of {len(first) + len(reservoir)} rows (the first {len(first)}, the rest at random):\n"
+        yield "".join(format_csv_row(row) for row in first)
+        yield "".join(format_csv_row(row) for _, row in sorted(reservoir))
+
+    except csv.Error as e:
+        yield f"Error processing CSV file: {e}"
+    except Exception as e:
+        yield f"An unexpected error occurred: {e}"
+    finally:
+        # Leave the upload stream open for the caller
+        file_io.detach()
+
+# Function to extract text from JSON file
+@register_extractor([".json"], ["application/json"])
+def extract_text_from_json(file):
+    try:
+        # Read the file content as bytes
+        file_content = get_stream(file).read()
+        if not file_content:
+            print("File is empty")
+            yield "No content found in the file."
+            return
+        json_data = json.loads(file_content.decode("utf-8"))
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON in file: {e}")
+        yield "Error decoding JSON in the file."
+        return
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        yield f"Unexpected error: {e}"
+        return
+
+    # Encode piece by piece instead of building one big string
+    yield from json.JSONEncoder(indent=4).iterencode(json_data)
+
+# Function to read a .MD file
+@register_extractor([".md"], ["text/markdown"])
+def extract_text_from_md(file):
+    try:
+        # Read the file and decode it into a string
+        data = get_stream(file).read().decode("utf-8")
+        # Remove lines that start with a # (markdown headers)
+        data = re.sub(r"^\#.*$", "", data, flags=re.M)
+        # Remove images (anything starting with ![ and ending with ])
+        data = re.sub(r"!\[.*?\]\(.*?\)", "", data)
+        # Remove links (anything in the format [text](url))
+        data = re.sub(r"\[.*?\]\(.*?\)", "", data)
+        # Remove bold or italic text (anything between **, *, __, or _)
+        data = re.sub(r"(\*\*|\*|__|_)(.*?)\1", r"\2", data)
+        # Remove code blocks (text wrapped in triple backticks)
+        data = re.sub(r"```.*?```", "", data, flags=re.S)
+        # Remove indented code (with spaces at the beginning)
+        data = re.sub(r"    .+", "", data)
+        # Remove list items (lines that start with *, +, or -)
+        data = re.sub(r"^[\*\+-]\s.*$", "", data, flags=re.M)
+        # Remove blockquotes (lines starting with >)
+        data = re.sub(r"^\>.*$", "", data, flags=re.M)
+        # Strip extra spaces at the beginning and end
+        yield data.strip()
+
+    except Exception as e:
+        yield "Something went wrong: " + str(e)
+
+# Function to read a .reg file and extract key-value pairs
+def read_reg(file):
+    try:
+        # Read the contents of the .reg file (UTF-16 encoding is common for .reg files)
+        data = get_stream(file).read().decode("utf-16")
+        # Remove non-section strings before the first section (if any)
+        data = re.sub(r"^[^\[]*\n", "", data, flags=re.S)
+        # Find sections and key-value pairs
+        sections = re.findall(r"\[([^\]]+)\](.*?)((?=\[)|$)", data, re.S)
+        # Prepare a list to store rows of data
+        rows = []
+
+        for section, content, _ in sections:
+            # Find key-value pairs within the section
+            key_value_pairs = re.findall(r"([^\=]+)=(.*)", content.strip())
+            for key, value in key_value_pairs:
+                rows.append([section.strip(), key.strip(), value.strip()])
+
+        # Convert the list into a DataFrame
+        df = pd.DataFrame(rows, columns=["Section", "Key", "Value"])
+        # Return the DataFrame
+        return df
+
+    except Exception as e:
+        print(f"Error reading .reg file: {e}")
+        return "Error reading .reg file"
+
+# Function to extract a .reg file as an HTML table
+@register_extractor([".reg"], ["application/x-regedit"])
+def extract_text_from_reg(file):
+    df = read_reg(file)
+    if isinstance(df, str):
+        yield df
+    else:
+        yield df.to_html()
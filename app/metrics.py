@@ -0,0 +1,173 @@
+# In-process metrics, rendered in the Prometheus text format for the /metrics route.
+# Each update is a dictionary lookup and an addition under a lock, cheap enough to leave on.
+# Values are per process; with several workers, Prometheus scrapes and sums each one.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency buckets in seconds, up to the slowest LLM reports
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Function to escape a label value for the text format
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# Function to format a label set, e.g. {stage="llm",le="0.5"}
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+# Function to format a sample value, whole numbers without a decimal point
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+# Base of every metric: a name, help text, label names and one value per label set
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        # Unlabelled counters and gauges show up as 0 before their first update
+        if not self.labelnames and self.kind in ("counter", "gauge"):
+            self.values[()] = 0
+
+    # Function to get the key of a label set, every label must be given
+    def key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    # Function to render the metric as lines of the text format
+    def render(self):
+        with self.lock:
+            values = {key: self.copy_value(value) for key, value in self.values.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key in sorted(values):
+            lines.extend(self.render_value(list(zip(self.labelnames, key)), values[key]))
+        return lines
+
+    def copy_value(self, value):
+        return value
+
+    def render_value(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+# Value that only goes up, e.g. bytes extracted
+class Counter(Metric):
+    kind = "counter"
+
+    # Function to add to the counter
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+# Value that goes up and down, e.g. calls in flight
+class Gauge(Metric):
+    kind = "gauge"
+
+    # Function to add to the gauge, negative amounts subtract
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    # Function to subtract from the gauge
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    # Function to replace the value of the gauge
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    # Function to count the block as in progress while it runs
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+# Distribution of observed values in cumulative buckets, e.g. latencies
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    # Function to record one value
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        # Index of the first bucket whose upper bound is >= value, the last slot is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    # Function to record how long the block takes, also when it raises
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def copy_value(self, value):
+        return [list(value[0]), value[1]]
+
+    def render_value(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(
+                f"{self.name}_bucket{format_labels(labels + [('le', format_value(bound))])} {cumulative}"
+            )
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+# Set of metrics rendered together
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    # Function to add a metric to the registry and return it
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    # Function to render every metric in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,191 @@
+# OCR for images and scanned PDF pages with Tesseract.
+# Pages are cleaned up (grayscale, downscaled, deskewed) and recognised in a bounded
+# pool of worker processes, so OCR never runs in the request thread.
+import io
+import os
+import sys
+import time
+import atexit
+import shutil
+import multiprocessing
+import numpy as np
+import pytesseract
+import pdfplumber
+from PIL import Image
+from pools import SharedPool
+
+# Path of the tesseract executable, found on PATH when not set
+TESSERACT_CMD = os.getenv("TESSERACT_CMD")
+# Worker processes (0 runs OCR in the calling thread), time allowed for a whole document
+# (seconds), and the most pages of one PDF sent to OCR
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 2))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 300))
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", 50))
+# Resolution pages are rasterized and downscaled to, and the Tesseract languages
+OCR_DPI = int(os.getenv("OCR_DPI", 300))
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "eng")
+# Longest side of images without DPI information, larger ones are downscaled
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", 4000))
+
+# Largest skew corrected, and the step between the angles tried (degrees)
+MAX_SKEW = 5.0
+SKEW_STEP = 0.5
+
+# Function to find the tesseract executable, or None when it is not installed
+def find_tesseract():
+    if TESSERACT_CMD:
+        return TESSERACT_CMD if os.path.exists(TESSERACT_CMD) else shutil.which(TESSERACT_CMD)
+    found = shutil.which("tesseract")
+    if found:
+        return found
+    if sys.platform == "win32":
+        # The copy shipped next to the app, then the default installer location
+        candidates = [
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "Tesseract-OCR", "tesseract.exe"),
+            os.path.join(os.getenv("ProgramFiles", r"C:\Program Files"), "Tesseract-OCR", "tesseract.exe"),
+        ]
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                return candidate
+    return None
+
+tesseract_path = find_tesseract()
+
+# Function to check whether OCR can run, printing why not the first time
+def ocr_available():
+    if tesseract_path is None and not getattr(ocr_available, "warned", False):
+        print("Tesseract not found, OCR is disabled. Install it or set TESSERACT_CMD.")
+        ocr_available.warned = True
+    return tesseract_path is not None
+
+# Function to estimate the skew of a grayscale page in degrees, from the angle
+# at which the rows of text line up best
+def estimate_skew(gray):
+    thumbnail = gray.copy()
+    thumbnail.thumbnail((800, 800))
+    # Text pixels become white on black, so rotating adds no ink at the borders
+    ink = Image.fromarray(np.where(np.asarray(thumbnail) < 128, 255, 0).astype(np.uint8))
+    best_angle = 0.0
+    best_score = -1.0
+    for angle in np.arange(-MAX_SKEW, MAX_SKEW + SKEW_STEP / 2, SKEW_STEP):
+        rows = np.asarray(ink.rotate(float(angle), resample=Image.NEAREST)).sum(axis=1, dtype=np.int64)
+        # Aligned lines give sharp jumps between text rows and the gaps between them
+        score = float(np.sum(np.diff(rows) ** 2))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+# Function to prepare an image for Tesseract: grayscale, at most OCR_DPI, and deskewed
+def preprocess_image(image, dpi=None):
+    gray = image.convert("L")
+
+    scale = 1.0
+    if dpi and dpi > OCR_DPI:
+        scale = OCR_DPI / dpi
+    elif not dpi and max(gray.size) > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / max(gray.size)
+    if scale < 1.0:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.LANCZOS)
+
+    angle = estimate_skew(gray)
+    if abs(angle) >= SKEW_STEP:
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return gray
+
+# Function to run Tesseract on an image
+def recognize(image, dpi=None):
+    pytesseract.pytesseract.tesseract_cmd = tesseract_path
+    prepared = preprocess_image(image, dpi)
+    # Tell Tesseract the resolution, it otherwise guesses from the image size
+    config = f"--dpi {min(dpi or OCR_DPI, OCR_DPI)}"
+    return pytesseract.image_to_string(prepared, lang=OCR_LANGUAGES, config=config)
+
+# Function to OCR an uploaded image from its bytes, runs in a worker process
+def ocr_image_bytes(data):
+    with Image.open(io.BytesIO(data)) as image:
+        dpi = image.info.get("dpi", (None,))[0]
+        return recognize(image, dpi)
+
+# Function to OCR a pdfplumber page by rasterizing it at OCR_DPI
+def ocr_pdf_page(page):
+    image = page.to_image(resolution=OCR_DPI).original
+    return recognize(image, OCR_DPI)
+
+# Function to OCR one page of a PDF file, runs in a worker process
+def ocr_pdf_file_page(file_path, page_index):
+    with pdfplumber.open(file_path, pages=[page_index + 1]) as pdf:
+        return ocr_pdf_page(pdf.pages[0])
+
+# Process pool for OCR, shared by concurrent uploads
+ocr_pool = SharedPool(OCR_WORKERS)
+
+atexit.register(ocr_pool.terminate)
+
+# Result of OCR run in the calling thread, shaped like a pool's AsyncResult
+class FinishedResult:
+    def __init__(self, function, args):
+        try:
+            self.value = function(*args)
+            self.error = None
+        except Exception as e:
+            self.value = None
+            self.error = e
+
+    def ready(self):
+        return True
+
+    def get(self, timeout=None):
+        if self.error:
+            raise self.error
+        return self.value
+
+# OCR work of one document: the pool it uses and the deadline for all of its pages.
+# Use it as a context manager so the pool is handed back when the document is done.
+class OcrJob:
+    def __init__(self):
+        self.deadline = time.monotonic() + OCR_TIMEOUT
+        self.pool = None
+        self.timed_out = False
+
+    # Function to queue OCR work, returns a result with ready() and get(timeout)
+    def submit(self, function, *args):
+        if OCR_WORKERS < 1:
+            return FinishedResult(function, args)
+        if self.pool is None:
+            self.pool = ocr_pool.acquire()
+        return self.pool.apply_async(function, args)
+
+    # Function to wait for a queued result until the deadline. Returns the text, or None if
+    # it failed or timed out; after a timeout, only results that are already done are used.
+    def wait_for(self, result):
+        if self.timed_out and not result.ready():
+            return None
+        try:
+            return result.get(timeout=max(0, self.deadline - time.monotonic()))
+        except multiprocessing.TimeoutError:
+            print(f"OCR timed out after {OCR_TIMEOUT} seconds, returning partial text")
+            self.timed_out = True
+        except Exception as e:
+            print(f"Error running OCR: {e}")
+        return None
+
+    # Function to hand the pool back. Stuck workers cannot be cancelled, so after a timeout
+    # the pool is retired; other documents waiting on it keep their workers until done.
+    def close(self):
+        if self.pool is not None:
+            ocr_pool.release(self.pool, retire=self.timed_out)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to OCR an uploaded image in the pool, returns the text or None
+def ocr_image(data):
+    if not ocr_available():
+        return None
+    with OcrJob() as job:
+        return job.wait_for(job.submit(ocr_image_bytes, data))
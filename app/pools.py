@@ -0,0 +1,46 @@
+# Process pools shared by concurrent requests.
+# A request that times out retires the pool instead of killing it: new work goes to a
+# fresh pool, and the old one is terminated once the last request using it lets go,
+# so the tasks of other requests on it still finish.
+import threading
+import multiprocessing
+
+class SharedPool:
+    def __init__(self, processes):
+        self.processes = processes
+        # Pool handed to new requests, created on first use
+        self.pool = None
+        # Requests holding each pool, current or retired
+        self.users = {}
+        self.lock = threading.Lock()
+
+    # Function to get the current pool for a request, release it when done
+    def acquire(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.processes)
+            self.users[self.pool] = self.users.get(self.pool, 0) + 1
+            return self.pool
+
+    # Function to hand a pool back. With retire, e.g. after a timeout, no new work goes to it;
+    # a retired pool is terminated, along with anything stuck in it, when its last user is done.
+    def release(self, pool, retire=False):
+        with self.lock:
+            if retire and pool is self.pool:
+                self.pool = None
+            self.users[pool] -= 1
+            if self.users[pool] or pool is self.pool:
+                return
+            del self.users[pool]
+        pool.terminate()
+
+    # Function to kill every pool, for shutdown
+    def terminate(self):
+        with self.lock:
+            pools = set(self.users)
+            if self.pool is not None:
+                pools.add(self.pool)
+            self.pool = None
+            self.users = {}
+        for pool in pools:
+            pool.terminate()
@@ -0,0 +1,251 @@
+# In-process retrieval over the ISO QA corpus exported by llm_training/LLM training.py.
+import os
+import json
+import threading
+import numpy as np
+
+# Files written by the export step of LLM training.py
+EMBEDDINGS_FILE = "embeddings.npy"
+PAYLOADS_FILE = "payloads.jsonl"
+META_FILE = "meta.json"
+# Quantized copies of the embeddings, built from EMBEDDINGS_FILE on first use.
+# int8 keeps a scale per dimension, binary keeps the corpus mean the signs are taken around.
+QUANTIZED_FILES = {"int8": "embeddings_int8.npy", "binary": "embeddings_binary.npy"}
+SCALES_FILE = "scales.npy"
+MEAN_FILE = "mean.npy"
+
+# Rows quantized or scored at a time, bounds the temporary copies made while building and searching
+SEARCH_BLOCK_ROWS = 8192
+
+# Number of set bits in each byte value, for numpy versions without bitwise_count
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Function to scale vectors to unit length, so a dot product is the cosine similarity
+def normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# Function to pick the k best columns of each row of a score matrix, best first
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    # argpartition finds the k best in linear time, only those k are sorted
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+# Function to count the set bits in each row of a uint64 matrix
+def popcount_rows(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+# Function to pack the signs of vectors around the corpus mean into bits.
+# Rows are padded to whole 64-bit words so they can be compared a word at a time.
+def pack_signs(vectors, mean):
+    bits = np.packbits(vectors > mean, axis=1)
+    padding = -bits.shape[1] % 8
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return bits.view(np.uint64)
+
+# Function to save an array under a temporary name and move it into place,
+# so other workers never load half a file
+def save_atomic(path, array):
+    temp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(temp_path, array)
+    os.replace(temp_path, path)
+
+# Function to build a quantized copy of an exported index
+def build_quantized_index(directory, quantization):
+    vectors = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+    if quantization == "int8":
+        # Each dimension is scaled by its largest absolute value, so it uses the full -127..127 range
+        scales = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in range(0, vectors.shape[0], SEARCH_BLOCK_ROWS):
+            block = np.abs(vectors[start:start + SEARCH_BLOCK_ROWS])
+            scales = np.maximum(scales, block.max(axis=0))
+        scales = np.maximum(scales, 1e-12)
+        dtype, width = np.int8, vectors.shape[1]
+        extra_path, extra = os.path.join(directory, SCALES_FILE), scales
+    elif quantization == "binary":
+        # Sentence embeddings share a common direction, signs around the mean carry more information
+        total = np.zeros(vectors.shape[1], dtype=np.float64)
+        for start in range(0, vectors.shape[0], SEARCH_BLOCK_ROWS):
+            total += vectors[start:start + SEARCH_BLOCK_ROWS].sum(axis=0, dtype=np.float64)
+        mean = (total / max(vectors.shape[0], 1)).astype(np.float32)
+        dtype, width = np.uint64, (vectors.shape[1] + 63) // 64
+        extra_path, extra = os.path.join(directory, MEAN_FILE), mean
+    else:
+        raise ValueError(f"Unknown quantization: {quantization}")
+
+    quantized_path = os.path.join(directory, QUANTIZED_FILES[quantization])
+    temp_path = f"{quantized_path}.{os.getpid()}.tmp.npy"
+    quantized = np.lib.format.open_memmap(
+        temp_path, mode="w+", dtype=dtype, shape=(vectors.shape[0], width)
+    )
+    for start in range(0, vectors.shape[0], SEARCH_BLOCK_ROWS):
+        block = vectors[start:start + SEARCH_BLOCK_ROWS]
+        if quantization == "int8":
+            block = np.clip(np.rint(block / scales * 127), -127, 127)
+        else:
+            block = pack_signs(block, mean)
+        quantized[start:start + len(block)] = block
+    quantized.flush()
+    del quantized
+    save_atomic(extra_path, extra)
+    os.replace(temp_path, quantized_path)
+
+# Function to check whether a quantized copy is missing or older than the embeddings
+def quantized_index_is_stale(directory, quantization):
+    try:
+        built = os.path.getmtime(os.path.join(directory, QUANTIZED_FILES[quantization]))
+        return built < os.path.getmtime(os.path.join(directory, EMBEDDINGS_FILE))
+    except FileNotFoundError:
+        return True
+
+# Exported embedding matrix and the payload of each row.
+# The matrices are memory-mapped, so worker processes share the pages of one file.
+# With a quantization ("int8" or "binary"), candidates are found on the quantized copy
+# (a quarter or a thirty-second of the size) and only the best rescore_factor * k of them
+# are rescored with the exact float32 vectors.
+class VectorIndex:
+    def __init__(self, directory, quantization=None, rescore_factor=10):
+        self.directory = directory
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # Rows are stored unit length by the export step
+        self.vectors = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, PAYLOADS_FILE), encoding="utf-8") as f:
+            self.payloads = [json.loads(line) for line in f]
+        if len(self.payloads) != self.vectors.shape[0]:
+            raise ValueError(
+                f"Index has {self.vectors.shape[0]} vectors but {len(self.payloads)} payloads"
+            )
+
+        self.quantized = None
+        if quantization:
+            if quantization not in QUANTIZED_FILES:
+                raise ValueError(f"Unknown quantization: {quantization}")
+            if quantized_index_is_stale(directory, quantization):
+                build_quantized_index(directory, quantization)
+            self.quantized = np.load(
+                os.path.join(directory, QUANTIZED_FILES[quantization]), mmap_mode="r"
+            )
+            if quantization == "int8":
+                self.scales = np.load(os.path.join(directory, SCALES_FILE))
+            else:
+                self.mean = np.load(os.path.join(directory, MEAN_FILE))
+
+    # Function to find the k rows most similar to each query.
+    # Returns one list of (score, payload) per query, best first.
+    def search(self, queries, k):
+        queries = normalize_rows(queries)
+        if self.quantized is None:
+            ids, scores = self.search_exact(queries, k)
+        else:
+            ids, scores = self.search_quantized(queries, k)
+        return [
+            [(float(score), self.payloads[i]) for i, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    # Function to score every float32 row, returns (ids, scores) of the k best per query
+    def search_exact(self, queries, k):
+        scores = queries @ self.vectors.T
+        ids = top_k(scores, k)
+        return ids, np.take_along_axis(scores, ids, axis=1)
+
+    # Function to find candidates on the quantized rows, then rescore them exactly
+    def search_quantized(self, queries, k):
+        count = max(k * self.rescore_factor, k)
+        if self.quantization == "int8":
+            candidates = self.int8_candidates(queries, count)
+        else:
+            candidates = self.binary_candidates(queries, count)
+        # Only the candidate rows of the float32 matrix are read
+        exact = np.einsum("qd,qcd->qc", queries, self.vectors[candidates])
+        order = top_k(exact, k)
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+    # Function to keep the count best of the previous best and a new block of scores
+    def merge_best(self, best_ids, best_scores, scores, start, count):
+        ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        ids = np.concatenate([best_ids, ids], axis=1)
+        keep = top_k(scores, count)
+        return np.take_along_axis(ids, keep, axis=1), np.take_along_axis(scores, keep, axis=1)
+
+    # Function to get the ids of the count best rows per query by approximate int8 scores
+    def int8_candidates(self, queries, count):
+        # Folding the scales into the query gives the dot product with the dequantized rows
+        scaled = queries * (self.scales / 127)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.quantized.shape[0], SEARCH_BLOCK_ROWS):
+            block = self.quantized[start:start + SEARCH_BLOCK_ROWS].astype(np.float32)
+            best_ids, best_scores = self.merge_best(best_ids, best_scores, scaled @ block.T, start, count)
+        return best_ids
+
+    # Function to get the ids of the count best rows per query by Hamming distance of the signs
+    def binary_candidates(self, queries, count):
+        packed = pack_signs(queries, self.mean)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.int32)
+        for start in range(0, self.quantized.shape[0], SEARCH_BLOCK_ROWS):
+            block = self.quantized[start:start + SEARCH_BLOCK_ROWS]
+            # Fewer differing bits is better, so the negated distance is the score
+            scores = np.stack([-popcount_rows(block ^ query) for query in packed])
+            best_ids, best_scores = self.merge_best(best_ids, best_scores, scores, start, count)
+        return best_ids
+
+# Embeds queries with the model the index was built with and searches the index.
+# Both are loaded on first use; without an index (or sentence_transformers) retrieval is off.
+class Retriever:
+    def __init__(self, directory, quantization=None, rescore_factor=10):
+        self.directory = directory
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.index = None
+        self.model = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    # Function to load the index and the embedding model, returns whether retrieval is available
+    def load(self):
+        if self.loaded:
+            return self.index is not None
+        with self.lock:
+            if self.loaded:
+                return self.index is not None
+            try:
+                index = VectorIndex(self.directory, self.quantization, self.rescore_factor)
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(index.meta["model"])
+                self.index = index
+                print(f"Loaded retrieval index with {len(index.payloads)} entries")
+            except FileNotFoundError:
+                print(f"No retrieval index in {self.directory}, retrieval is disabled")
+            except ImportError:
+                print("sentence_transformers is not installed, retrieval is disabled")
+            except Exception as e:
+                print(f"Error loading retrieval index: {e}")
+            self.loaded = True
+        return self.index is not None
+
+    # Function to embed a batch of texts into unit length vectors
+    def embed(self, texts):
+        return self.model.encode(
+            texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+        )
+
+    # Function to get the k best matches for each text scoring at least min_score
+    def search(self, texts, k, min_score=0.0):
+        if not self.load():
+            return [[] for _ in texts]
+        results = self.index.search(self.embed(texts), k)
+        return [[(score, payload) for score, payload in matches if score >= min_score] for matches in results]
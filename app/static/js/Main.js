@@ -160,6 +160,35 @@ document.addEventListener('DOMContentLoaded', async function () {
         messageElement.innerHTML = messageContent;
         chatbox.appendChild(messageElement);
         chatbox.scrollTop = chatbox.scrollHeight;
+        return messageElement;
+    }
+
+    // Function to read Server-Sent Events from a streamed fetch response
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                if (data) onEvent(eventName, JSON.parse(data));
+            }
+        }
     }
 
     // Function to send a message to the API
@@ -177,21 +206,36 @@ document.addEventListener('DOMContentLoaded', async function () {
         }
 
         try {
-            const response = await fetch('/process', {
+            // Ask for a streamed reply so tokens show up as soon as they are generated
+            const response = await fetch('/process?stream=1', {
                 method: 'POST',
                 body: formData
             });
-            const result = await response.json();
-            console.log('API result:', result); // Debugging line
 
-            // If the backend provides a response, show it
-            if (result.response) {
-                let responseMessage = result.response;
-                showMessage(responseMessage, 'incoming', {}, new Date().toLocaleString());
-            } else {
-                // If there's no response from GPT, handle gracefully
-                showMessage('No response from GPT', 'incoming', {}, new Date().toLocaleString());
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.startsWith('text/event-stream')) {
+                // Errors and empty extractions still come back as JSON
+                const result = await response.json();
+                console.log('API result:', result); // Debugging line
+                showMessage(result.response || result.error || 'No response from GPT', 'incoming', {}, new Date().toLocaleString());
+                return;
             }
+
+            const messageElement = showMessage('...', 'incoming', {}, new Date().toLocaleString());
+            const replyParagraph = messageElement.querySelector('p');
+            let reply = '';
+
+            await readEventStream(response, (eventName, data) => {
+                if (eventName === 'error') {
+                    replyParagraph.textContent = 'Sorry, there was an error processing your request.';
+                } else if (eventName === 'done') {
+                    replyParagraph.textContent = data.response || 'No response from GPT';
+                } else if (data.delta) {
+                    reply += data.delta;
+                    replyParagraph.textContent = reply;
+                }
+                chatbox.scrollTop = chatbox.scrollHeight;
+            });
         } catch (error) {
             console.error('API Error:', error);
             showMessage('Sorry, there was an error processing your request.', 'incoming', {}, new Date().toLocaleString());
@@ -248,29 +292,47 @@ document.addEventListener('DOMContentLoaded', async function () {
         // Add the file to FormData
         formData.append("file", file);
 
-        // Simulate a progress bar update (since fetch doesn't directly expose upload progress)
-        let progress = 0;
-        const interval = setInterval(() => {
-            progress = Math.min(progress + 10, 90);  // Increase progress in steps of 10%
-            progressBar.value = progress;
-            if (progress >= 90) {
-                clearInterval(interval);  // Stop simulating progress when near completion
-            }
-        }, 500);
-
         try {
-            const response = await fetch("/report", {
+            // Submit the report as a background job and get its id straight away
+            const submitResponse = await fetch("/report_jobs", {
                 method: "POST",
                 body: formData,
             });
+            const job = await submitResponse.json();
 
-            // Once the request completes, set the progress to 100%
-            progressBar.value = 100;
+            if (!submitResponse.ok) {
+                throw new Error(job.error || "Failed to submit report");
+            }
 
-            if (!response.ok) {
+            // Poll the job status and mirror its progress in the progress bar
+            let status = job.status;
+            while (status === "queued" || status === "running") {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const statusResponse = await fetch(`/report_jobs/${job.job_id}`);
+                const jobStatus = await statusResponse.json();
+                if (!statusResponse.ok) {
+                    throw new Error(jobStatus.error || "Failed to check report status");
+                }
+                status = jobStatus.status;
+                progressBar.value = jobStatus.progress;
+                if (status === "queued") {
+                    progressText.textContent = "Waiting for a free worker...";
+                } else if (jobStatus.chunks_total > 0) {
+                    progressText.textContent = `Analysed ${jobStatus.chunks_done} of ${jobStatus.chunks_total} parts...`;
+                } else {
+                    progressText.textContent = "Generating report...";
+                }
+            }
+
+            if (status !== "done") {
                 throw new Error("Failed to generate report");
             }
 
+            const response = await fetch(`/report_jobs/${job.job_id}/result`);
+            if (!response.ok) {
+                throw new Error("Failed to download report");
+            }
+
             // Get the blob response (the report file)
             const blob = await response.blob();
             
@@ -288,6 +350,8 @@ document.addEventListener('DOMContentLoaded', async function () {
         } finally {
             // Hide the progress bar and text after the process is complete
             document.getElementById("progress-container").style.display = "none";
+            progressBar.value = 0;
+            progressText.textContent = "Generating report...";
 
             // Reset the file input and file name display to default
             document.getElementById("report-file-input").value = "";  // Clear the file input
@@ -311,27 +375,48 @@ document.addEventListener('DOMContentLoaded', async function () {
     // ============================
     // 8. History Management
     // ============================
-    // Load chat history dynamically
-    async function loadChatHistory() {
+    // Load chat history dynamically, one page at a time
+    // Pass the next_cursor of the previous page to append the following page
+    async function loadChatHistory(sessionName = '', cursor = null) {
         if (!isLoggedIn) return;
 
+        const params = new URLSearchParams({ limit: 20 });
+        if (sessionName) params.append('session_name', sessionName);
+        if (cursor) params.append('cursor', cursor);
+
         try {
-            const response = await fetch('/get_chat_history');
+            const response = await fetch(`/get_chat_history?${params}`);
             const data = await response.json();
 
             if (data.success) {
-                historyList.innerHTML = ''; // Clear existing history
+                if (!cursor) {
+                    historyList.innerHTML = ''; // Clear existing history
+                }
                 data.chat_history.forEach(entry => {
                     const historyItem = document.createElement('li');
                     historyItem.innerHTML = `
                         <span class="material-symbols-outlined">history</span>
                         <p><strong>Session:</strong> ${entry.session_name || 'No session name available'}</p>
-                        <p><strong>Message:</strong> ${entry.message}</p>
+                        <p><strong>Message:</strong> ${entry.message}${entry.truncated ? '...' : ''}</p>
                         <p><strong>Response:</strong> ${entry.response}</p>
                         <span class="timestamp">${entry.timestamp}</span>
                     `;
                     historyList.appendChild(historyItem);
                 });
+
+                // Offer the next page if there is one
+                if (data.next_cursor) {
+                    const loadMoreItem = document.createElement('li');
+                    const loadMoreButton = document.createElement('button');
+                    loadMoreButton.textContent = 'Load more';
+                    loadMoreButton.addEventListener('click', (event) => {
+                        event.stopPropagation(); // Keep the history panel open
+                        loadMoreItem.remove();
+                        loadChatHistory(sessionName, data.next_cursor);
+                    });
+                    loadMoreItem.appendChild(loadMoreButton);
+                    historyList.appendChild(loadMoreItem);
+                }
             } else {
                 console.error("Failed to load chat history:", data.message);
             }
@@ -376,27 +461,22 @@ document.addEventListener('DOMContentLoaded', async function () {
     // Fetch session names and populate the session dropdown
     async function fetchSessions() {
         try {
-            const response = await fetch('/get_chat_history');
+            const response = await fetch('/sessions');
             const data = await response.json();
 
             if (data.success) {
                 const sessionSelect = document.getElementById('session_select');
                 sessionSelect.innerHTML = '';
 
-                const uniqueSessions = new Set();
-                data.chat_history.forEach(entry => {
-                    uniqueSessions.add(entry.session_name); // Add session_name to the Set (ensures uniqueness)
-                });
-
                 // Populate the dropdown with session names
-                uniqueSessions.forEach(session_name => {
+                data.sessions.forEach(chatSession => {
                     const option = document.createElement('option');
-                    option.value = session_name;
-                    option.textContent = `Session ${session_name}`;
+                    option.value = chatSession.session_name;
+                    option.textContent = `Session ${chatSession.session_name} (${chatSession.message_count} messages)`;
                     sessionSelect.appendChild(option);
                 });
             } else {
-                console.error('Failed to fetch chat history:', data.message);
+                console.error('Failed to fetch sessions:', data.message);
             }
         } catch (error) {
             console.error('Error fetching sessions:', error);
@@ -412,37 +492,7 @@ document.addEventListener('DOMContentLoaded', async function () {
             return;
         }
 
-        try {
-            const response = await fetch(`/get_chat_history?session_name=${selectedSessionName}`);
-            const data = await response.json();
-
-            if (data.success) {
-                const historyList = document.getElementById('history-list');
-                historyList.innerHTML = '';  // Clear existing history
-
-                // Display filtered chat history in the desired format
-                data.chat_history.forEach(chat => {
-                    // Create a new list item
-                    const listItem = document.createElement('li');
-                    
-                    // Construct the HTML content for each chat entry
-                    listItem.innerHTML = `
-                        <span class="material-symbols-outlined">history</span>
-                        <p><strong>Session:</strong> ${chat.session_name || 'No session name available'}</p>
-                        <p><strong>Message:</strong> ${chat.message}</p>
-                        <p><strong>Response:</strong> ${chat.response}</p>
-                        <span class="timestamp">${chat.timestamp}</span>
-                    `;
-                    
-                    // Append the formatted list item to the history list
-                    historyList.appendChild(listItem);
-                });
-            } else {
-                console.error('Failed to filter chat history:', data.message);
-            }
-        } catch (error) {
-            console.error('Error filtering chat history:', error);
-        }
+        await loadChatHistory(selectedSessionName);
     });
 
     // Function to delete chat history based on session name
@@ -0,0 +1,94 @@
+# Offline token estimation, used to budget prompts without calling a tokenizer service.
+import re
+
+# Words, numbers and single punctuation marks each count as at least one token
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Average number of characters per token for English text
+CHARS_PER_TOKEN = 4
+
+# Function to estimate the number of tokens in a piece of text
+def estimate_tokens(text):
+    if not text:
+        return 0
+    # Long words split into several tokens, so take whichever estimate is larger
+    return max(len(text) // CHARS_PER_TOKEN, len(TOKEN_PATTERN.findall(text)))
+
+# Function to cut text down to roughly max_tokens tokens
+def clip_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    clipped = text[: max_tokens * CHARS_PER_TOKEN]
+    # Trim until the estimate fits, punctuation-heavy text has more tokens per character
+    while clipped and estimate_tokens(clipped) > max_tokens:
+        clipped = clipped[: int(len(clipped) * 0.9)]
+    return clipped
+
+# Lines that look like section headings: markdown headings, numbered clauses,
+# "Section/Clause/Annex ..." labels and short all-caps titles
+HEADING_PATTERN = re.compile(
+    r"^(#{1,6}\s+\S.*"
+    r"|(?:\d+\.)*\d+\.?\s+[A-Z].{0,80}"
+    r"|(?:Section|Clause|Annex|Appendix|Chapter|Part)\s+\S.{0,80}"
+    r"|[A-Z][A-Z0-9 ,&/()-]{3,80})$"
+)
+
+# Function to split text into sections that each start at a heading
+def split_sections(text):
+    sections = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if current and HEADING_PATTERN.match(line.strip()):
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+# Function to break a section that is larger than max_tokens into line-aligned pieces
+def split_oversized(section, max_tokens):
+    if estimate_tokens(section) <= max_tokens:
+        return [section]
+
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in section.splitlines(keepends=True):
+        # A single huge line is cut into fixed-size slices
+        while estimate_tokens(line) > max_tokens:
+            if current:
+                pieces.append("".join(current))
+                current = []
+                current_tokens = 0
+            head = clip_to_tokens(line, max_tokens)
+            pieces.append(head)
+            line = line[len(head):]
+        line_tokens = estimate_tokens(line)
+        if current and current_tokens + line_tokens > max_tokens:
+            pieces.append("".join(current))
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+# Function to split text into chunks of at most max_tokens, keeping sections together where possible
+def split_into_chunks(text, max_tokens):
+    chunks = []
+    current = []
+    current_tokens = 0
+    for section in split_sections(text):
+        for piece in split_oversized(section, max_tokens):
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
@@ -0,0 +1,245 @@
+# Synthetic evidence files in every format the upload extractors accept.
+# Each writer takes a count of units (pages, paragraphs, rows, ...) and a seed, so the same
+# arguments always produce the same bytes.
+#
+#   python benchmarks/evidence_corpus.py out_dir --scale 10
+import os
+import csv
+import json
+import random
+import argparse
+
+# Vocabulary the sentences are drawn from, so the text looks like compliance evidence
+SUBJECTS = [
+    "The access control policy", "The information security team", "Each asset owner",
+    "The incident response procedure", "The backup schedule", "All privileged accounts",
+    "The risk register", "The supplier agreement", "The change advisory board",
+    "Encryption of data at rest", "The business continuity plan", "Security awareness training",
+]
+VERBS = [
+    "is reviewed", "is approved", "is documented", "is tested", "is monitored",
+    "is enforced", "is updated", "is audited", "is reported", "is restricted",
+]
+DETAILS = [
+    "at least annually", "by the information security manager", "in line with ISO 27001 Annex A",
+    "after every significant change", "and the results are retained for three years",
+    "using multi-factor authentication", "according to the documented procedure",
+    "and exceptions are logged in the risk register", "before production deployment",
+    "with evidence stored in the document management system",
+]
+CONTROLS = [f"A.{clause}.{item}" for clause in range(5, 9) for item in range(1, 38)]
+STATUSES = ["Implemented", "Partially implemented", "Planned", "Not applicable"]
+
+# Function to make one evidence-like sentence
+def sentence(rng):
+    return f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(DETAILS)}."
+
+# Function to make a paragraph of a few sentences
+def paragraph(rng, sentences=4):
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+# Function to make the fields of one control row
+def control_row(rng, number):
+    return [
+        number,
+        rng.choice(CONTROLS),
+        rng.choice(STATUSES),
+        sentence(rng),
+        f"owner{rng.randint(1, 40)}@example.com",
+        f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+    ]
+
+CONTROL_COLUMNS = ["id", "control", "status", "evidence", "owner", "last_reviewed"]
+
+# Function to escape text for a PDF string literal
+def pdf_string(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+# Function to write a PDF of text pages, using only the standard Helvetica font
+def write_pdf(path, pages, seed=0):
+    rng = random.Random(seed)
+    objects = []
+    page_ids = []
+    # Objects 1 and 2 are the catalog and page tree, 3 is the font
+    for _ in range(pages):
+        lines = []
+        for _ in range(12):
+            words = paragraph(rng, 3).split()
+            # Wrap to roughly 90 characters per line
+            line = []
+            for word in words:
+                if sum(len(w) + 1 for w in line) + len(word) > 90:
+                    lines.append(" ".join(line))
+                    line = []
+                line.append(word)
+            lines.append(" ".join(line))
+        content = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(
+            f"({pdf_string(line)}) ' " for line in lines[:70]
+        ) + "ET"
+        content_id = 4 + len(objects)
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        page_ids.append(4 + len(objects))
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ] + objects
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        f.write(
+            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+        )
+
+# Function to write a plain text policy export, wrapped paragraphs with an unpunctuated log excerpt every tenth
+def write_txt(path, paragraphs, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for number in range(paragraphs):
+            if number % 10 == 9:
+                # Log lines have no sentence endings, so the extractor has to split them elsewhere
+                for _ in range(20):
+                    f.write(f"2025-01-{rng.randint(1, 28):02d} GET /evidence/{rng.randint(1, 999)} 200 owner{rng.randint(1, 40)}\n")
+                f.write("\n")
+                continue
+            words = paragraph(rng).split()
+            line = []
+            for word in words:
+                if sum(len(w) + 1 for w in line) + len(word) > 80:
+                    f.write(" ".join(line) + "\n")
+                    line = []
+                line.append(word)
+            f.write(" ".join(line) + "\n\n")
+
+# Function to write a DOCX of headings and paragraphs
+def write_docx(path, paragraphs, seed=0):
+    from docx import Document
+
+    rng = random.Random(seed)
+    document = Document()
+    for number in range(paragraphs):
+        if number % 10 == 0:
+            document.add_heading(f"Control {rng.choice(CONTROLS)}", level=2)
+        document.add_paragraph(paragraph(rng))
+    document.save(path)
+
+# Function to write an XLSX control register, split across sheets of at most 10000 rows
+def write_xlsx(path, rows, seed=0):
+    import openpyxl
+
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    for start in range(0, max(rows, 1), 10000):
+        sheet = workbook.create_sheet(f"Controls {start // 10000 + 1}")
+        sheet.append(CONTROL_COLUMNS)
+        for number in range(start, min(start + 10000, rows)):
+            sheet.append(control_row(rng, number))
+    workbook.save(path)
+
+# Function to write a CSV control register
+def write_csv(path, rows, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CONTROL_COLUMNS)
+        for number in range(rows):
+            writer.writerow(control_row(rng, number))
+
+# Function to write a JSON export of control records
+def write_json(path, records, seed=0):
+    rng = random.Random(seed)
+    data = {
+        "framework": "ISO 27001:2022",
+        "controls": [dict(zip(CONTROL_COLUMNS, control_row(rng, number))) for number in range(records)],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+# Function to write a Markdown policy document with headings, lists, links and code
+def write_md(path, sections, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# Information Security Policy\n\n")
+        for number in range(sections):
+            f.write(f"## {number + 1}. Control {rng.choice(CONTROLS)}\n\n")
+            f.write(f"{paragraph(rng)} See [the procedure](https://example.com/{number}) for **details**.\n\n")
+            f.write(f"- {sentence(rng)}\n- {sentence(rng)}\n\n")
+            if number % 5 == 0:
+                f.write(f"```\nsetting_{number} = enabled\n```\n\n")
+            f.write(f"> {sentence(rng)}\n\n")
+
+# Function to write a UTF-16 registry export, a section of values per key
+def write_reg(path, keys, seed=0):
+    rng = random.Random(seed)
+    lines = ["Windows Registry Editor Version 5.00", ""]
+    for number in range(keys):
+        lines.append(f"[HKEY_LOCAL_MACHINE\\SOFTWARE\\Policies\\Evidence\\Key{number}]")
+        lines.append(f'"Enabled"=dword:{rng.randint(0, 1):08x}')
+        lines.append(f'"MinimumPasswordLength"=dword:{rng.randint(8, 16):08x}')
+        lines.append(f'"Description"="{sentence(rng)}"')
+        lines.append("")
+    with open(path, "w", encoding="utf-16", newline="") as f:
+        f.write("\r\n".join(lines))
+
+# Function to write a PNG screenshot of text lines, as OCR evidence
+def write_png(path, lines, seed=0):
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("L", (1000, 40 + 22 * lines), 255)
+    draw = ImageDraw.Draw(image)
+    for number in range(lines):
+        draw.text((20, 20 + 22 * number), sentence(rng), fill=0)
+    image.save(path)
+
+# Writers by file extension, with the unit the count is measured in and the count at scale 1
+WRITERS = {
+    ".pdf": (write_pdf, "pages", 5),
+    ".docx": (write_docx, "paragraphs", 100),
+    ".xlsx": (write_xlsx, "rows", 500),
+    ".csv": (write_csv, "rows", 1000),
+    ".json": (write_json, "records", 500),
+    ".txt": (write_txt, "paragraphs", 200),
+    ".md": (write_md, "sections", 50),
+    ".reg": (write_reg, "keys", 200),
+    ".png": (write_png, "lines", 20),
+}
+
+# Function to write one file of each format, returns {extension: (path, unit, count)}
+def write_corpus(directory, scale=1, seed=0, extensions=None):
+    os.makedirs(directory, exist_ok=True)
+    corpus = {}
+    for extension, (writer, unit, count) in WRITERS.items():
+        if extensions and extension not in extensions:
+            continue
+        count *= scale
+        path = os.path.join(directory, f"evidence_x{scale}{extension}")
+        writer(path, count, seed)
+        corpus[extension] = (path, unit, count)
+    return corpus
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic evidence files")
+    parser.add_argument("directory")
+    parser.add_argument("--scale", type=int, default=1, help="multiplier for the size of every file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for extension, (path, unit, count) in write_corpus(args.directory, args.scale, args.seed).items():
+        print(f"{path}: {count} {unit}, {os.path.getsize(path) / 2**20:.2f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# Throughput and memory of the upload extractors on synthetic evidence files.
+# Every measurement runs in a fresh process, so peak RSS belongs to one extractor only.
+#
+#   python benchmarks/extractor_benchmark.py                     run and compare with the baseline
+#   python benchmarks/extractor_benchmark.py --save-baseline     run and store the results as the baseline
+#   python benchmarks/extractor_benchmark.py --sizes small --extractors extract_text_from_csv
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import statistics
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "app"))
+from evidence_corpus import write_corpus
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baselines", "extractors.json")
+
+# Corpus scale of each size, the units per file are listed in evidence_corpus.WRITERS
+SIZES = {"small": 1, "medium": 10, "large": 50}
+
+# Extractors measured, with the extension of the file each one reads
+EXTRACTORS = {
+    "extract_text_from_pdf": ".pdf",
+    "extract_text_from_docx": ".docx",
+    "extract_text_from_xlsx": ".xlsx",
+    "extract_text_from_csv": ".csv",
+    "extract_text_from_json": ".json",
+    "extract_text_from_txt": ".txt",
+    "extract_text_from_md": ".md",
+    "read_reg": ".reg",
+    "extract_text_from_reg": ".reg",
+    "extract_text_from_image": ".png",
+}
+
+# Metrics where a higher value is better, the rest are better lower
+HIGHER_IS_BETTER = {"mb_per_s", "units_per_s"}
+COMPARED_METRICS = ["mb_per_s", "units_per_s", "peak_rss_mb", "alloc_peak_mb"]
+
+# Function to get the peak resident set size of this process in MB, or None if unknown
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+# Function to run an extractor over a file, returns the number of characters produced
+def run_extractor(function, path):
+    with open(path, "rb") as f:
+        result = function(f)
+        if hasattr(result, "to_html"):
+            # read_reg returns a DataFrame
+            return len(result)
+        if isinstance(result, str):
+            return len(result)
+        return sum(len(chunk) for chunk in result)
+
+# Function to measure one extractor on one file, runs in the child process
+def measure(name, path, units, repeat):
+    import extractors
+
+    function = getattr(extractors, name)
+    rss_before = peak_rss_mb()
+
+    # Fresh file handle each run, like a new upload
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output_chars = run_extractor(function, path)
+        timings.append(time.perf_counter() - started)
+    rss_after = peak_rss_mb()
+
+    # Separate run for allocations, tracing slows the extractor down
+    tracemalloc.start()
+    run_extractor(function, path)
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = statistics.median(timings)
+    size_mb = os.path.getsize(path) / 2**20
+    return {
+        "file_mb": round(size_mb, 3),
+        "units": units,
+        "output_chars": output_chars,
+        "seconds": round(seconds, 4),
+        "mb_per_s": round(size_mb / seconds, 3) if seconds else None,
+        "units_per_s": round(units / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(rss_after, 1) if rss_after is not None else None,
+        "rss_growth_mb": round(rss_after - rss_before, 1) if rss_after is not None else None,
+        "alloc_peak_mb": round(alloc_peak / 2**20, 2),
+    }
+
+# Function to measure in a fresh interpreter, returns the result or an error entry
+def measure_in_subprocess(name, path, units, repeat, timeout):
+    command = [sys.executable, os.path.abspath(__file__), "--measure", name, path, str(units), str(repeat)]
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {timeout} seconds"}
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {"error": (completed.stderr.strip().splitlines() or ["no output"])[-1]}
+    result = json.loads(lines[-1])
+    if not result["output_chars"]:
+        # Extractors log their own errors and yield nothing
+        messages = [line for line in lines[:-1] if line.strip()]
+        result["error"] = messages[-1] if messages else "no text extracted"
+        # Keep paths relative, so baselines from different checkouts compare cleanly
+        result["error"] = result["error"].replace(REPO_DIR + os.sep, "")
+    return result
+
+# Function to print the change of each metric against the baseline, returns the regressions
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\nChange against baseline (regression threshold {threshold:.0%})")
+    for key, result in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if not previous or "error" in result or "error" in previous:
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > threshold:
+                flag = " !"
+                regressions.append(f"{key} {metric}: {old} -> {new}")
+            changes.append(f"{metric} {change:+.0%}{flag}")
+        print(f"  {key:<36} {'  '.join(changes)}")
+    return regressions
+
+# Function to run every selected extractor at every selected size
+def run(args):
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        for size in args.sizes:
+            extensions = {EXTRACTORS[name] for name in args.extractors}
+            corpus = write_corpus(directory, SIZES[size], extensions=extensions)
+            for name in args.extractors:
+                path, unit, units = corpus[EXTRACTORS[name]]
+                key = f"{name}/{size}"
+                result = measure_in_subprocess(name, path, units, args.repeat, args.timeout)
+                result["unit"] = unit
+                results[key] = result
+                if "error" in result:
+                    print(f"{key:<36} error: {result['error']}")
+                    continue
+                print(
+                    f"{key:<36} {result['file_mb']:7.2f} MB  {result['mb_per_s']:8.2f} MB/s  "
+                    f"{result['units_per_s']:9.1f} {unit}/s  peak RSS {result['peak_rss_mb']} MB  "
+                    f"allocations {result['alloc_peak_mb']} MB"
+                )
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        name, path, units, repeat = sys.argv[2:6]
+        print(json.dumps(measure(name, path, int(units), int(repeat))))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the upload extractors")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--extractors", nargs="+", choices=list(EXTRACTORS), default=list(EXTRACTORS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per file, the median is kept")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds allowed per measurement")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": run(args),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report["results"], baseline, args.threshold)
+    if regressions:
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Recall and latency of the quantized retrieval indexes against the exact float32 search.
+#
+#   python benchmarks/retrieval_benchmark.py                      synthetic corpora
+#   python benchmarks/retrieval_benchmark.py --index app/rag_index   an exported index
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from retrieval import VectorIndex, normalize_rows, EMBEDDINGS_FILE, PAYLOADS_FILE, META_FILE, QUANTIZED_FILES
+
+# Function to write a synthetic index shaped like sentence embeddings: clustered, and
+# sharing a common direction like MiniLM vectors do
+def write_synthetic_index(directory, rows, dimension, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(rows // 20, 1), dimension)).astype(np.float32)
+    common = rng.standard_normal(dimension).astype(np.float32)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(directory, EMBEDDINGS_FILE), mode="w+", dtype=np.float32, shape=(rows, dimension)
+    )
+    for start in range(0, rows, 65536):
+        count = min(65536, rows - start)
+        block = centers[rng.integers(0, len(centers), count)]
+        block += 0.6 * rng.standard_normal((count, dimension)).astype(np.float32) + 0.8 * common
+        vectors[start:start + count] = normalize_rows(block)
+    vectors.flush()
+    with open(os.path.join(directory, PAYLOADS_FILE), "w", encoding="utf-8") as f:
+        for i in range(rows):
+            f.write(json.dumps({"id": i}) + "\n")
+    with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model": "synthetic", "dimension": dimension, "count": rows}, f)
+
+# Function to make queries near existing rows, like paraphrases of stored questions
+def make_queries(vectors, count, seed=1):
+    rng = np.random.default_rng(seed)
+    picked = np.asarray(vectors[np.sort(rng.choice(vectors.shape[0], count, replace=False))])
+    noise = rng.standard_normal(picked.shape).astype(np.float32) * 1.2 / np.sqrt(picked.shape[1])
+    return normalize_rows(picked + noise)
+
+# Function to time one search per query, returns the latencies in milliseconds
+def time_single_queries(search, queries, k):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.array(latencies)
+
+# Function to compare each quantization against the exact search on one index
+def benchmark(directory, k, queries_count, rescore_factors):
+    exact_index = VectorIndex(directory)
+    rows = exact_index.vectors.shape[0]
+    queries = make_queries(exact_index.vectors, min(queries_count, rows))
+    expected, _ = exact_index.search_exact(queries, k)
+
+    float_bytes = os.path.getsize(os.path.join(directory, EMBEDDINGS_FILE))
+    print(f"\n{rows} rows x {exact_index.vectors.shape[1]} dims, k={k}, {len(queries)} queries")
+    print(f"  float32 index {float_bytes / 2**20:.2f} MB")
+
+    # Warm the page cache so both searches read from memory
+    exact_index.search_exact(queries[:8], k)
+    exact_latency = time_single_queries(exact_index.search_exact, queries, k)
+    print(f"  float32 brute force        recall@{k} 1.000  "
+          f"p50 {np.percentile(exact_latency, 50):6.2f} ms  p95 {np.percentile(exact_latency, 95):6.2f} ms")
+
+    for quantization in QUANTIZED_FILES:
+        started = time.perf_counter()
+        quantized_index = VectorIndex(directory, quantization)
+        built = time.perf_counter() - started
+        quantized_bytes = os.path.getsize(os.path.join(directory, QUANTIZED_FILES[quantization]))
+        print(f"  {quantization} index {quantized_bytes / 2**20:.2f} MB, built in {built:.2f} s")
+        for factor in rescore_factors:
+            quantized_index.rescore_factor = factor
+            found, _ = quantized_index.search_quantized(queries, k)
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, expected)])
+            latency = time_single_queries(quantized_index.search_quantized, queries, k)
+            label = f"{quantization} + rescore top {factor * k}"
+            print(f"  {label:<26} recall@{k} {recall:.3f}  "
+                  f"p50 {np.percentile(latency, 50):6.2f} ms  p95 {np.percentile(latency, 95):6.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--index", help="directory of an exported index (default: synthetic corpora)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1073, 100000], help="synthetic corpus sizes")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[1, 4, 10])
+    args = parser.parse_args()
+
+    if args.index:
+        # Work on a copy, so the quantized files are not written next to the real index
+        directory = tempfile.mkdtemp()
+        for name in (EMBEDDINGS_FILE, PAYLOADS_FILE, META_FILE):
+            shutil.copy(os.path.join(args.index, name), directory)
+        try:
+            benchmark(directory, args.k, args.queries, args.rescore_factors)
+        finally:
+            shutil.rmtree(directory)
+        return
+
+    for rows in args.rows:
+        directory = tempfile.mkdtemp()
+        try:
+            write_synthetic_index(directory, rows, args.dimension)
+            benchmark(directory, args.k, args.queries, args.rescore_factors)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
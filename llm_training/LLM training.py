@@ -1,9 +1,23 @@
 import json
 import os
+import numpy as np
 import pandas as pd
 from sentence_transformers import SentenceTransformer
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import *
+from qa_pipeline import (
+    PAYLOAD_COLUMNS,
+    iter_qa_batches,
+    ensure_collection,
+    embed_and_upload,
+    point_ids,
+    content_hashes,
+    EmbeddingCache,
+    CachedEncoder,
+    fetch_content_hashes,
+    compute_delta,
+    delete_points,
+)
 from tqdm import tqdm
 import openai
 from openai import OpenAI
@@ -11,9 +25,6 @@ from pathlib import Path
 from dotenv import load_dotenv
 from sklearn.model_selection import train_test_split
 
-# Enable tqdm for pandas
-tqdm.pandas()
-
 # Load environment variables from .env file
 load_dotenv()
 
@@ -22,50 +33,28 @@ client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 qdrant_url = os.environ.get("QDRANT_URL")
 qdrant_api_key = os.environ.get("QDRANT_API_KEY")
 
-qdrant = QdrantClient(
-    url=qdrant_url,
-    api_key=qdrant_api_key,
-)
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# QDRANT_URL=":memory:" runs against a local in-memory Qdrant, e.g. for testing the pipeline
+if qdrant_url == ":memory:":
+    qdrant = QdrantClient(":memory:")
+else:
+    qdrant = QdrantClient(
+        url=qdrant_url,
+        api_key=qdrant_api_key,
+    )
+model_name = 'all-MiniLM-L6-v2'
+model = SentenceTransformer(model_name)
 
 # -------------------------
 # Step 1: Load Data
 # -------------------------
 
-def load_data(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    rows = []
-    for framework in data.get('dataset', []):  
-        framework_name = framework.get('framework', '')
-        for entry in framework.get('data', []):
-            title = entry.get('title', '')
-            context = entry.get('context', '')
-            if not context:
-                print(f"Missing context for title: {title}")
-            extended_context = f"[{framework_name} Section {title}] {context}"
-            paragraphs = entry.get('paragraphs', [])
-            if not paragraphs:
-                print(f"Missing paragraphs for title: {title}")
-            for paragraph in paragraphs:
-                qas = paragraph.get('qas', [])
-                if not qas:
-                    print(f"Missing QAs for title: {title} - Paragraph: {paragraph}")               
-                for qa in qas:
-                    question = qa.get('question', '')
-                    answers = qa.get('answers', [])
-                    answer_text = answers[0]['text'] if answers else ''
-                    rows.append({
-                        "framework": framework_name,
-                        "title": title,
-                        "question": question,
-                        "answer": answer_text,
-                        "context": extended_context
-                    })
-
-    print(f"Total QAs extracted: {len(rows)}")  
-    return pd.DataFrame(rows)
+def load_data(file_path, batch_size=1000):
+    """Loads the SQuAD-format QA file into a DataFrame, parsing it incrementally in columnar batches."""
+    frames = [pd.DataFrame(batch) for batch in iter_qa_batches(file_path, batch_size)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PAYLOAD_COLUMNS)
+
+    print(f"Total QAs extracted: {len(df)}")  
+    return df
 
 
 print("Loading data...")
@@ -81,66 +70,128 @@ else:
 # Step 2: Create Qdrant Collection and Upload Embeddings
 # -------------------------
 
-embeddings = model.encode(df['question'].tolist())
-if len(embeddings) != df.shape[0]:
-    print("Mismatch between number of embeddings and dataframe rows.")
-    raise ValueError("The number of embeddings does not match the dataset size.")
-else:
-    print("Embedding size:", embeddings.shape[1])
+# Batch size of the encoder, parallel upserts and retries, and encoded batches kept waiting for upload
+embed_batch_size = int(os.environ.get("EMBED_BATCH_SIZE", 256))
+# The local in-memory Qdrant is not thread-safe, so it is given one upload at a time
+upsert_workers = int(os.environ.get("UPSERT_WORKERS", 1 if qdrant_url == ":memory:" else 4))
+upsert_retries = int(os.environ.get("UPSERT_RETRIES", 3))
+pipeline_queue_size = int(os.environ.get("PIPELINE_QUEUE_SIZE", 4))
+# Only new and changed QAs are embedded and upserted, unless FULL_SYNC=1.
+# Embeddings are cached on disk by model and question text, so re-runs skip the encoder.
+full_sync = os.environ.get("FULL_SYNC") == "1"
+embedding_cache_path = os.environ.get("EMBEDDING_CACHE", "embedding_cache.db")
+
+dimension = model.get_sentence_embedding_dimension()
+print("Embedding size:", dimension)
 
 collection_name = "new_RAG"
 print("Checking if the collection exists...")
 try:
-    qdrant.get_collection(collection_name=collection_name)
-    print(f"Collection '{collection_name}' already exists. Skipping creation.")
+    ensure_collection(qdrant, collection_name, dimension)
 except Exception as e:
-    print(f"Collection '{collection_name}' does not exist. Creating the collection...")
-    try:
-        qdrant.create_collection(
-            collection_name=collection_name,
-            vectors_config=VectorParams(size=embeddings.shape[1], distance=Distance.COSINE)
-        )
-        print(f"Collection '{collection_name}' created successfully.")
-    except Exception as e:
-        print(f"Error creating collection: {e}")
-
-print("Creating a list of PointStruct objects:")
-points = []
-for i, row in tqdm(df.iterrows(), total=df.shape[0], desc="Uploading to Qdrant"):
-    points.append(
-        PointStruct(
-            id=i,
-            vector=embeddings[i].tolist(),
-            payload=row.to_dict()
-        )
-    )
+    print(f"Error creating collection: {e}")
+
+# Points are keyed by a hash of framework, title and question, so one QA is stored once
+corpus = df[PAYLOAD_COLUMNS].copy()
+corpus.index = point_ids(corpus)
+duplicates = corpus.index.duplicated()
+if duplicates.any():
+    print(f"Skipping {duplicates.sum()} duplicate QAs")
+    corpus = corpus[~duplicates]
+corpus["content_hash"] = content_hashes(corpus, model_name)
+
+encoder = CachedEncoder(model, EmbeddingCache(embedding_cache_path, model_name))
 
-print(f"Uploading {len(points)} points to Qdrant collection '{collection_name}'...")
 try:
-    qdrant.upsert(collection_name=collection_name, points=points)
+    changed, stale_ids = compute_delta(corpus, fetch_content_hashes(qdrant, collection_name))
+    if full_sync:
+        changed = corpus
+    print(f"{len(changed)} new or changed QAs, {len(stale_ids)} removed, {len(corpus) - len(changed)} unchanged")
+
+    if len(changed):
+        print(f"Uploading {len(changed)} points to Qdrant collection '{collection_name}'...")
+        embed_and_upload(
+            changed,
+            encoder,
+            qdrant,
+            collection_name,
+            batch_size=embed_batch_size,
+            upload_workers=upsert_workers,
+            queue_size=pipeline_queue_size,
+            retries=upsert_retries,
+            payload_columns=PAYLOAD_COLUMNS + ["content_hash"],
+        )
+    if stale_ids:
+        print(f"Deleting {len(stale_ids)} points from Qdrant collection '{collection_name}'...")
+        delete_points(qdrant, collection_name, stale_ids, retries=upsert_retries)
 except Exception as e:
-    print(f"Error uploading points to Qdrant: {e}")
+    print(f"Error syncing points to Qdrant: {e}")
 
 # -------------------------
-# Step 3: Retrieve Questions from Qdrant
+# Step 2b: Export Embeddings for In-Process Retrieval
 # -------------------------
 
-def get_question(row):
-    query, row_context = row["question"], row["context"]
+def start_index_export(output_dir, df, dimension):
+    """Writes the payloads that app/retrieval.py loads for local RAG, and returns the
+    memory-mapped embedding matrix to be filled in batch by batch."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    # One payload per line, in the same order as the embedding rows
+    with open(os.path.join(output_dir, "payloads.jsonl"), "w", encoding="utf-8") as f:
+        for row in df[PAYLOAD_COLUMNS].to_dict("records"):
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "dimension": dimension, "count": len(df)}, f)
+
+    # Filled batch by batch, so the whole matrix never has to be in memory
+    return np.lib.format.open_memmap(
+        os.path.join(output_dir, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(len(df), dimension)
+    )
+
+def write_index_batch(index_vectors, start, embeddings):
+    """Writes a batch of embeddings into the exported matrix, scaled to unit length
+    so the app can score with a plain dot product."""
+    batch = np.array(embeddings, dtype=np.float32)
+    batch /= np.maximum(np.linalg.norm(batch, axis=1, keepdims=True), 1e-12)
+    index_vectors[start:start + len(batch)] = batch
+
+# The app reads the index from app/rag_index unless RAG_INDEX_DIR says otherwise
+index_dir = os.environ.get("RAG_INDEX_DIR", os.path.join("..", "app", "rag_index"))
 
+# The whole corpus is exported, unchanged QAs come from the embedding cache
+index_vectors = start_index_export(index_dir, corpus, dimension)
+for start in range(0, len(corpus), embed_batch_size):
+    questions = corpus["question"].iloc[start:start + embed_batch_size].tolist()
+    write_index_batch(index_vectors, start, encoder.encode(
+        questions, batch_size=embed_batch_size, convert_to_numpy=True, show_progress_bar=False
+    ))
+index_vectors.flush()
+print(f"Exported {len(corpus)} embeddings to '{index_dir}'")
+print(f"Embedding cache: {encoder.hits} hits, {encoder.misses} questions encoded")
+
+# -------------------------
+# Step 3: Retrieve Questions from Qdrant
+# -------------------------
+
+def build_questions(df):
+    """Builds the chat-format fine-tuning messages for every row of df at once."""
     instruction = "You are an AI compliance specialist on ISO 27001 and ISO 27002 standards, specifically the 2022 editions.'.\n\n"
-    
-    qn = [
-        {"role": "system", "content": instruction},
-        {"role": "user", "content": f"Question: {query}\n\nContext: {row_context}\n\nAnswer:"},
-        {"role": "assistant", "content": row["answer"]}
-    ]
 
-    return qn
+    # Vectorized string building over the whole column instead of one row at a time
+    prompts = "Question: " + df["question"] + "\n\nContext: " + df["context"] + "\n\nAnswer:"
+    return [
+        [
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": answer}
+        ]
+        for prompt, answer in zip(prompts.tolist(), df["answer"].tolist())
+    ]
 
 # Generate question
 print("Generating question for fine-tuning...")
-df["qn"] = df.progress_apply(get_question, axis=1)
+df["qn"] = build_questions(df)
 
 # -------------------------
 # Step 4: Prepare JSONL File for Fine-Tuning
@@ -148,11 +199,14 @@ df["qn"] = df.progress_apply(get_question, axis=1)
 
 train_df, val_df = train_test_split(df, test_size=0.2, random_state=42)
 
-def dataframe_to_jsonl(df, output_path):
+def dataframe_to_jsonl(df, output_path, batch_size=1000):
+    """Writes the messages in df["qn"] to a JSONL file, encoding and writing a batch of rows at a time."""
+    messages = df["qn"].tolist()
     with open(output_path, "w") as f:
-        for _, row in tqdm(df.iterrows(), total=df.shape[0], desc="Preparing JSONL file"):
-            jsonl_entry = {"messages": row["qn"]}
-            f.write(json.dumps(jsonl_entry) + "\n")
+        for start in tqdm(range(0, len(messages), batch_size), desc="Preparing JSONL file", unit="batch"):
+            f.write("".join(
+                json.dumps({"messages": qn}) + "\n" for qn in messages[start:start + batch_size]
+            ))
 
 # Save training and validation datasets
 dataframe_to_jsonl(train_df, "finetune_training.jsonl")
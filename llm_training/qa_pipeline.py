@@ -0,0 +1,441 @@
+# Streaming loading, embedding and upload of the QA corpus, used by LLM training.py.
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from qdrant_client.http.models import PointStruct, PointIdsList, VectorParams, Distance
+from tqdm import tqdm
+
+# Columns stored as the payload of each point
+PAYLOAD_COLUMNS = ["framework", "title", "question", "answer", "context"]
+
+
+class JsonStream:
+    """Reads a JSON document from a file a block at a time.
+
+    Objects and arrays can be walked key by key and item by item with iter_object and
+    iter_array, and any value can be decoded whole with value(), so only the value
+    being decoded has to fit in memory.
+    """
+
+    def __init__(self, f, block_size=64 * 1024):
+        self.f = f
+        self.block_size = block_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size=None):
+        """Reads the next block (or size characters), dropping what has been consumed.
+        Returns False at the end of the file."""
+        if self.eof:
+            return False
+        block = self.f.read(size or self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next character that is not whitespace, without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON data")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of the current block")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete value."""
+        self.peek()
+        while True:
+            # Read at least as much again as is buffered, so a large value is decoded a few times, not once per block
+            more = max(self.block_size, len(self.buffer) - self.pos)
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the block may continue in the next one
+                if end < len(self.buffer) or not self.fill(more):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self.fill(more):
+                    raise
+
+    def iter_object(self):
+        """Yields the keys of the next object. The caller must consume each value before the next key."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def iter_array(self):
+        """Yields once per item of the next array. The caller must consume each item."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def iter_squad_entries(file_path):
+    """Yields (framework, entry) for every entry of a SQuAD-format file with a "dataset"
+    list of frameworks, reading one entry into memory at a time."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key != "dataset":
+                stream.value()
+                continue
+            for _ in stream.iter_array():
+                framework_name = None
+                # Entries seen before the framework name are held until it turns up
+                waiting = []
+                for framework_key in stream.iter_object():
+                    if framework_key == "framework":
+                        framework_name = stream.value()
+                        for entry in waiting:
+                            yield framework_name, entry
+                        waiting = []
+                    elif framework_key == "data":
+                        for _ in stream.iter_array():
+                            if framework_name is None:
+                                waiting.append(stream.value())
+                            else:
+                                yield framework_name, stream.value()
+                    else:
+                        stream.value()
+                for entry in waiting:
+                    yield "", entry
+
+
+def iter_qa_batches(file_path, batch_size=1000):
+    """Yields the QAs of a SQuAD-format file as columnar batches: dicts of equal-length
+    lists keyed by PAYLOAD_COLUMNS, with at most batch_size QAs each."""
+    batch = {column: [] for column in PAYLOAD_COLUMNS}
+    for framework_name, entry in iter_squad_entries(file_path):
+        title = entry.get("title", "")
+        context = entry.get("context", "")
+        if not context:
+            print(f"Missing context for title: {title}")
+        extended_context = f"[{framework_name} Section {title}] {context}"
+        paragraphs = entry.get("paragraphs", [])
+        if not paragraphs:
+            print(f"Missing paragraphs for title: {title}")
+        for paragraph in paragraphs:
+            qas = paragraph.get("qas", [])
+            if not qas:
+                print(f"Missing QAs for title: {title} - Paragraph: {paragraph}")
+            for qa in qas:
+                answers = qa.get("answers", [])
+                batch["framework"].append(framework_name)
+                batch["title"].append(title)
+                batch["question"].append(qa.get("question", ""))
+                batch["answer"].append(answers[0]["text"] if answers else "")
+                batch["context"].append(extended_context)
+                if len(batch["question"]) >= batch_size:
+                    yield batch
+                    batch = {column: [] for column in PAYLOAD_COLUMNS}
+    if batch["question"]:
+        yield batch
+
+
+def ensure_collection(qdrant, collection_name, dimension):
+    """Creates a cosine-distance collection unless it already exists."""
+    try:
+        qdrant.get_collection(collection_name=collection_name)
+        print(f"Collection '{collection_name}' already exists. Skipping creation.")
+    except Exception:
+        print(f"Collection '{collection_name}' does not exist. Creating the collection...")
+        qdrant.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=dimension, distance=Distance.COSINE)
+        )
+        print(f"Collection '{collection_name}' created successfully.")
+
+
+def with_retries(action, description, retries=3, backoff=1.0):
+    """Runs action(), retrying failed attempts with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return action()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"{description} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def upsert_with_retries(qdrant, collection_name, points, retries=3, backoff=1.0):
+    """Upserts one batch of points, retrying failed attempts with exponential backoff."""
+    with_retries(
+        lambda: qdrant.upsert(collection_name=collection_name, points=points, wait=True),
+        f"Upserting {len(points)} points",
+        retries,
+        backoff,
+    )
+    return len(points)
+
+
+def encode_batches(df, model, batch_size, batches, stop):
+    """Encodes df["question"] batch by batch and puts (start, rows, vectors) on the batches queue.
+
+    Puts None when done, or the exception if encoding fails. Stops early once stop is set.
+    """
+    def put(item):
+        # The queue is bounded, so wait for room unless the consumer has given up
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for start in range(0, len(df), batch_size):
+            rows = df.iloc[start:start + batch_size]
+            vectors = model.encode(
+                rows["question"].tolist(),
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            if not put((start, rows, vectors)):
+                return
+        put(None)
+    except Exception as e:
+        put(e)
+
+
+def embed_and_upload(df, model, qdrant, collection_name, batch_size=256, upload_workers=4,
+                     queue_size=4, retries=3, on_batch=None, payload_columns=PAYLOAD_COLUMNS):
+    """Embeds df["question"] and upserts the points into the collection, returning the number uploaded.
+
+    The index of df gives the point ids, payload_columns the payload of each point.
+
+    Encoding runs in its own thread while earlier batches are uploaded. At most queue_size
+    encoded batches wait for upload and upload_workers batches are in flight, so memory
+    stays bounded whatever the size of the corpus. on_batch(start, rows, vectors) is called
+    for every encoded batch, e.g. to export the vectors as well.
+    """
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    encoder = threading.Thread(
+        target=encode_batches, args=(df, model, batch_size, batches, stop), daemon=True
+    )
+    encoder.start()
+
+    started = time.perf_counter()
+    uploaded = 0
+    in_flight = set()
+    progress = tqdm(total=len(df), desc="Embedding and uploading", unit="QA")
+    try:
+        with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                start, rows, vectors = item
+                if on_batch:
+                    on_batch(start, rows, vectors)
+                points = [
+                    PointStruct(
+                        id=point_id if isinstance(point_id, str) else int(point_id),
+                        vector=vector.tolist(),
+                        payload=payload,
+                    )
+                    for point_id, vector, payload in zip(
+                        rows.index, vectors, rows[payload_columns].to_dict("records")
+                    )
+                ]
+
+                # Wait for a free upload slot, so encoded batches do not pile up in memory
+                if len(in_flight) >= upload_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        count = future.result()
+                        uploaded += count
+                        progress.update(count)
+                in_flight.add(
+                    executor.submit(upsert_with_retries, qdrant, collection_name, points, retries)
+                )
+
+            for future in wait(in_flight).done:
+                count = future.result()
+                uploaded += count
+                progress.update(count)
+    finally:
+        stop.set()
+        progress.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Uploaded {uploaded} points in {elapsed:.1f}s ({uploaded / max(elapsed, 1e-9):.0f} points/s)")
+    return uploaded
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def point_ids(df):
+    """Stable point ids, a hash of framework, title and question, so reordering or inserting
+    QAs never changes the id of an existing one."""
+    return [
+        str(uuid.UUID(hash_text("\x1f".join(key))[:32]))
+        for key in zip(df["framework"], df["title"], df["question"])
+    ]
+
+
+def content_hashes(df, model_name):
+    """Hashes of everything stored with each point, including the embedding model.
+    A point whose hash changed has to be upserted again."""
+    columns = [df[column].tolist() for column in PAYLOAD_COLUMNS]
+    return [hash_text("\x1f".join([model_name, *values])) for values in zip(*columns)]
+
+
+class EmbeddingCache:
+    """On-disk cache of embeddings keyed by model name and a hash of the embedded text."""
+
+    def __init__(self, path, model_name):
+        self.model_name = model_name
+        # Used from the encoder thread of embed_and_upload, never from two threads at once
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self.conn.commit()
+
+    def get_many(self, text_hashes):
+        """Returns {text hash: vector} for the hashes that are cached."""
+        found = {}
+        unique = list(set(text_hashes))
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({', '.join('?' * len(chunk))})",
+                [self.model_name, *chunk],
+            )
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def set_many(self, text_hashes, vectors):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [
+                (self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                for text_hash, vector in zip(text_hashes, vectors)
+            ],
+        )
+        self.conn.commit()
+
+
+class CachedEncoder:
+    """Wraps a SentenceTransformer so texts that are in the embedding cache are not encoded again."""
+
+    def __init__(self, model, cache):
+        self.model = model
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, texts, **kwargs):
+        text_hashes = [hash_text(text) for text in texts]
+        found = self.cache.get_many(text_hashes)
+        missing = [i for i, text_hash in enumerate(text_hashes) if text_hash not in found]
+        if missing:
+            vectors = self.model.encode([texts[i] for i in missing], **kwargs)
+            self.cache.set_many([text_hashes[i] for i in missing], vectors)
+            for i, vector in zip(missing, vectors):
+                found[text_hashes[i]] = np.asarray(vector, dtype=np.float32)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return np.stack([found[text_hash] for text_hash in text_hashes])
+
+
+def fetch_content_hashes(qdrant, collection_name, batch_size=1000):
+    """Returns {point id: content_hash} for every point in the collection, without the vectors."""
+    hashes = {}
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=["content_hash"],
+            with_vectors=False,
+        )
+        for point in points:
+            hashes[point.id] = (point.payload or {}).get("content_hash")
+        if offset is None:
+            return hashes
+
+
+def compute_delta(df, existing_hashes):
+    """Compares the corpus (indexed by point id, with a content_hash column) with the collection.
+
+    Returns the rows that are new or changed, and the ids of points no longer in the corpus.
+    """
+    changed = [
+        existing_hashes.get(point_id) != content_hash
+        for point_id, content_hash in zip(df.index, df["content_hash"])
+    ]
+    current_ids = set(df.index)
+    stale_ids = [point_id for point_id in existing_hashes if point_id not in current_ids]
+    return df[changed], stale_ids
+
+
+def delete_points(qdrant, collection_name, ids, batch_size=1000, retries=3):
+    """Deletes points by id in batches, retrying failed batches."""
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        with_retries(
+            lambda: qdrant.delete(
+                collection_name=collection_name,
+                points_selector=PointIdsList(points=chunk),
+                wait=True,
+            ),
+            f"Deleting {len(chunk)} points",
+            retries,
+        )
+    return len(ids)
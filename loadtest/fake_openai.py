@@ -0,0 +1,199 @@
+# Local stand-in for the OpenAI chat completions endpoint, for load tests.
+# Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+#
+#   python loadtest/fake_openai.py --latency 0.5 --tokens-per-second 50 --error-rate 0.01
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Words the replies are made of, so clients see realistic text
+REPLY_WORDS = (
+    "Annex A 5.15 requires access control rules based on business and information security "
+    "requirements. The policy should define owners, review intervals and evidence of approval, "
+    "and exceptions must be recorded in the risk register."
+).split()
+
+# Behaviour of the fake server, set from the command line
+settings = {
+    "latency": 0.5,
+    "jitter": 0.0,
+    "tokens_per_second": 0.0,
+    "reply_tokens": 60,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+}
+
+# Requests served, by outcome
+counters = {"requests": 0, "streamed": 0, "errors": 0, "rate_limited": 0}
+counters_lock = threading.Lock()
+
+# Function to count a request outcome
+def count(name):
+    with counters_lock:
+        counters[name] += 1
+
+# Function to make the reply text and its tokens
+def make_reply(reply_tokens):
+    words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(reply_tokens)]
+    return [word + " " for word in words]
+
+# Function to estimate prompt tokens like the app does, about four characters per token
+def prompt_tokens(messages):
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    # Function to handle POST /v1/chat/completions (any path ending in chat/completions)
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_json(400, {"error": {"message": "Invalid JSON", "type": "invalid_request_error"}})
+            return
+        count("requests")
+
+        # Injected failures come back before any work, like a rejected request
+        draw = random.random()
+        if draw < settings["rate_limit_rate"]:
+            count("rate_limited")
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+            return
+        if draw < settings["rate_limit_rate"] + settings["error_rate"]:
+            count("errors")
+            self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        # Time to first token
+        time.sleep(max(0.0, settings["latency"] + random.uniform(-1, 1) * settings["jitter"]))
+        tokens = make_reply(settings["reply_tokens"])
+        delay = 1 / settings["tokens_per_second"] if settings["tokens_per_second"] else 0.0
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model") or "fake-model"
+        prompt = prompt_tokens(body.get("messages", []))
+        usage = {"prompt_tokens": prompt, "completion_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+
+        if body.get("stream"):
+            count("streamed")
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            self.stream_reply(completion_id, model, tokens, delay, usage if include_usage else None)
+            return
+
+        time.sleep(delay * len(tokens))
+        self.send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    # Function to send the reply as Server-Sent Events, one token per chunk.
+    # With usage, a last chunk without choices carries it, like stream_options.include_usage.
+    def stream_reply(self, completion_id, model, tokens, delay, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # No Content-Length, the stream ends when the connection closes
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        try:
+            self.send_event(chunk({"role": "assistant", "content": ""}))
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                self.send_event(chunk({"content": token}))
+            self.send_event(chunk({}, "stop"))
+            if usage:
+                self.send_event({**chunk({}), "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away mid-stream
+
+    # Function to write one Server-Sent Event
+    def send_event(self, data):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    # Function to handle GET /stats, the counters of served requests
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with counters_lock:
+                self.send_json(200, dict(counters))
+            return
+        self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    # Function to send a JSON response
+    def send_json(self, status, data):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Request logging is off, it would dominate the output under load
+    def log_message(self, format, *args):
+        pass
+
+# Function to start the server, returns it once it is listening
+def start_server(host="127.0.0.1", port=8001, **overrides):
+    settings.update(overrides)
+    server = ThreadingHTTPServer((host, port), ChatCompletionsHandler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="latency varies by up to this many seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=settings["tokens_per_second"], help="0 sends the reply at once")
+    parser.add_argument("--reply-tokens", type=int, default=settings["reply_tokens"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"], help="fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=settings["rate_limit_rate"], help="fraction of requests failing with 429")
+    args = parser.parse_args()
+
+    server = start_server(
+        args.host,
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    print(f"Fake OpenAI server on http://{args.host}:{args.port}/v1 with {settings}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# End-to-end load test of App.py: each virtual user logs in, chats, uploads evidence,
+# requests a report, reads its history and exports it, over and over.
+# Reports p50/p95/p99 latency, throughput and error rate per step at each concurrency level.
+#
+#   python loadtest/run_load_test.py --start                       start the fake OpenAI server and the app
+#   python loadtest/run_load_test.py --base-url http://127.0.0.1:5000 --concurrency 1 10 50
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import shutil
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(LOADTEST_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+from evidence_corpus import write_csv, write_md
+
+# Steps of one scenario, in the order they run
+STEPS = ["login", "chat", "upload", "report", "history", "export"]
+
+# Raised by urllib instead of following the redirect after a successful login
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+# Function to encode form fields and files as multipart/form-data
+def encode_multipart(fields, files=()):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    for name, filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode("utf-8") + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+# One simulated browser: its own cookies, so its own Flask session
+class VirtualUser:
+    def __init__(self, base_url, username, password, options):
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.options = options
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    # Function to send a request, returns (status, body bytes)
+    def request(self, method, path, fields=None, files=(), timeout=300):
+        data = None
+        headers = {}
+        if files:
+            data, headers["Content-Type"] = encode_multipart(fields or {}, files)
+        elif fields is not None:
+            data = urllib.parse.urlencode(fields).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    # Function to create the account, not measured
+    def register(self):
+        status, _ = self.request(
+            "POST", "/register", {"username": self.username, "password": self.password, "name": "Load Test"}
+        )
+        return status in (200, 302)
+
+    # Function to log in, the app redirects to the chat page on success
+    def login(self):
+        status, _ = self.request("POST", "/login", {"username": self.username, "password": self.password})
+        return status == 302
+
+    # Function to send one chat message, unique so the response cache does not answer it
+    def chat(self):
+        message = f"How do we evidence ISO 27001 control A.5.15 for team {uuid.uuid4().hex[:8]}?"
+        if self.options["stream"]:
+            status, body = self.request("POST", "/process?stream=1", {"message": message})
+            return status == 200 and b"event: done" in body
+        status, body = self.request("POST", "/process", {"message": message})
+        return status == 200 and json.loads(body).get("response", "").strip() not in ("", "None")
+
+    # Function to upload an evidence file with a question
+    def upload(self):
+        content = self.options["upload"] + f"\n{uuid.uuid4().hex},A.5.15,Implemented,Unique row,,\n".encode("utf-8")
+        status, body = self.request(
+            "POST", "/process", {"message": "Summarise this control register."}, [("file", "controls.csv", content)]
+        )
+        return status == 200 and json.loads(body).get("response", "").strip() not in ("", "None")
+
+    # Function to generate a report from a policy document
+    def report(self):
+        content = self.options["policy"] + f"\n\nRevision {uuid.uuid4().hex}\n".encode("utf-8")
+        status, body = self.request("POST", "/report", {}, [("file", "policy.md", content)])
+        # A failed completion comes back as the text "None"
+        return status == 200 and body.strip() not in (b"", b"None")
+
+    # Function to read the first page of chat history
+    def history(self):
+        status, body = self.request("GET", "/get_chat_history")
+        return status == 200 and json.loads(body).get("success") is not False
+
+    # Function to export the whole chat history
+    def export(self):
+        status, body = self.request("GET", "/export_chat_history?format=ndjson")
+        return status == 200
+
+# Function to run scenarios for one user, appending (step, seconds, ok) to samples
+def run_user(user, iterations, deadline, samples, lock):
+    iteration = 0
+    while (iterations and iteration < iterations) or (not iterations and time.monotonic() < deadline):
+        iteration += 1
+        for step in STEPS:
+            started = time.perf_counter()
+            try:
+                ok = getattr(user, step)()
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append((step, elapsed, ok))
+            if step == "login" and not ok:
+                break  # The rest of the scenario needs a session
+
+# Function to get a percentile of sorted values with the nearest-rank method
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+# Function to summarize the samples of one concurrency level
+def summarize(samples, wall_seconds):
+    summary = {"steps": {}}
+    for step in STEPS:
+        latencies = sorted(seconds for name, seconds, _ in samples if name == step)
+        errors = sum(1 for name, _, ok in samples if name == step and not ok)
+        if not latencies:
+            continue
+        summary["steps"][step] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": round(errors / len(latencies), 4),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        }
+    total_errors = sum(1 for _, _, ok in samples if not ok)
+    summary.update({
+        "requests": len(samples),
+        "errors": total_errors,
+        "error_rate": round(total_errors / len(samples), 4) if samples else 0.0,
+        "wall_seconds": round(wall_seconds, 2),
+        "requests_per_second": round(len(samples) / wall_seconds, 2) if wall_seconds else None,
+        "scenarios_per_second": round(
+            sum(1 for name, _, _ in samples if name == STEPS[-1]) / wall_seconds, 2
+        ) if wall_seconds else None,
+    })
+    return summary
+
+# Function to print the summary of one concurrency level
+def print_summary(concurrency, summary):
+    print(
+        f"\nConcurrency {concurrency}: {summary['requests']} requests in {summary['wall_seconds']} s, "
+        f"{summary['requests_per_second']} req/s, {summary['scenarios_per_second']} scenarios/s, "
+        f"error rate {summary['error_rate']:.2%}"
+    )
+    print(f"  {'step':<8} {'requests':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for step, stats in summary["steps"].items():
+        print(
+            f"  {step:<8} {stats['requests']:>8} {stats['errors']:>7} "
+            f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}"
+        )
+
+# Function to run one concurrency level, returns its summary
+def run_level(args, options, concurrency, run_id):
+    users = [
+        VirtualUser(args.base_url, f"load_{run_id}_{concurrency}_{i}", "load-test-password", options)
+        for i in range(concurrency)
+    ]
+    # Account creation hashes passwords, so it is done before the clock starts
+    with ThreadPoolExecutor(max_workers=min(concurrency, 16)) as executor:
+        registered = list(executor.map(lambda user: user.register(), users))
+    if not all(registered):
+        print(f"Warning: {registered.count(False)} of {concurrency} users could not register")
+
+    samples = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for user in users:
+            executor.submit(run_user, user, args.iterations, deadline, samples, lock)
+    return summarize(samples, time.perf_counter() - started)
+
+# Function to wait until a server accepts connections
+def wait_for_port(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).close()
+            return
+        except urllib.error.HTTPError:
+            return  # Any HTTP response means it is up
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout} seconds")
+
+# Function to start the fake OpenAI server and the app on a copy of the database
+def start_servers(args, work_dir, log):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake_server = subprocess.Popen([
+        sys.executable, os.path.join(LOADTEST_DIR, "fake_openai.py"),
+        "--port", str(args.fake_port),
+        "--latency", str(args.fake_latency),
+        "--jitter", str(args.fake_jitter),
+        "--tokens-per-second", str(args.fake_tokens_per_second),
+        "--error-rate", str(args.fake_error_rate),
+    ], stdout=log, stderr=log)
+
+    database = os.path.join(work_dir, "database.db")
+    shutil.copy(os.path.join(REPO_DIR, "app", "database.db"), database)
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "load-test"),
+        OPENAI_MODEL_ID=os.getenv("OPENAI_MODEL_ID", "fake-model"),
+        OPENAI_BASE_URL=f"{fake_url}/v1",
+        DATABASE_PATH=database,
+        TEXT_CACHE_DIR=os.path.join(work_dir, "text_cache"),
+        LLM_CACHE_PATH=os.path.join(work_dir, "llm_cache.db"),
+    )
+    port = urllib.parse.urlparse(args.base_url).port or 5000
+    app_server = subprocess.Popen(
+        [sys.executable, os.path.join(LOADTEST_DIR, "serve_app.py"), "--port", str(port)], env=env, stdout=log, stderr=log
+    )
+    wait_for_port(f"{fake_url}/stats")
+    wait_for_port(f"{args.base_url}/check_login")
+    return [app_server, fake_server]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test App.py end to end")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--iterations", type=int, default=3, help="scenarios per user, 0 runs for --duration")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per level when --iterations is 0")
+    parser.add_argument("--stream", action="store_true", help="chat through /process?stream=1")
+    parser.add_argument("--upload-rows", type=int, default=200, help="rows in the uploaded control register")
+    parser.add_argument("--policy-sections", type=int, default=20, help="sections in the report policy")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--start", action="store_true", help="start the fake OpenAI server and the app")
+    parser.add_argument("--server-log", help="with --start, write the output of both servers to this file")
+    parser.add_argument("--fake-port", type=int, default=8001)
+    parser.add_argument("--fake-latency", type=float, default=0.5)
+    parser.add_argument("--fake-jitter", type=float, default=0.1)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=0)
+    parser.add_argument("--fake-error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    processes = []
+    log = open(args.server_log, "w", encoding="utf-8") if args.server_log else subprocess.DEVNULL
+    try:
+        # Evidence files shared by every user, each upload appends a unique line
+        write_csv(os.path.join(work_dir, "controls.csv"), args.upload_rows)
+        write_md(os.path.join(work_dir, "policy.md"), args.policy_sections)
+        with open(os.path.join(work_dir, "controls.csv"), "rb") as f:
+            upload = f.read()
+        with open(os.path.join(work_dir, "policy.md"), "rb") as f:
+            policy = f.read()
+        options = {"stream": args.stream, "upload": upload, "policy": policy}
+
+        if args.start:
+            processes = start_servers(args, work_dir, log)
+
+        run_id = uuid.uuid4().hex[:6]
+        results = {}
+        for concurrency in args.concurrency:
+            summary = run_level(args, options, concurrency, run_id)
+            print_summary(concurrency, summary)
+            results[str(concurrency)] = summary
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"base_url": args.base_url, "stream": args.stream, "levels": results}, f, indent=2)
+    finally:
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if args.server_log:
+            log.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
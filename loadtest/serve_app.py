@@ -0,0 +1,27 @@
+# Runs App.py for load tests: threaded, without the debugger and reloader.
+# Settings come from the environment as usual (OPENAI_BASE_URL, DATABASE_PATH, ...).
+#
+#   python loadtest/serve_app.py --port 5000
+import os
+import sys
+import argparse
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve App.py for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    # App.py resolves rag_index and the default paths from the working directory
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    import App
+
+    os.makedirs(App.UPLOAD_FOLDER, exist_ok=True)
+    App.init_db()
+    App.app.run(host=args.host, port=args.port, debug=False, threaded=True)
+
+if __name__ == "__main__":
+    main()
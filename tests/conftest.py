@@ -0,0 +1,9 @@
+# The app modules import each other by name, as when App.py runs from app/
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_DIR, "app")
+sys.path.insert(0, APP_DIR)
+# qa_pipeline is imported by name from LLM training.py
+sys.path.insert(0, os.path.join(REPO_DIR, "llm_training"))
@@ -0,0 +1,61 @@
+import io
+
+import extractors
+
+# Byte stream that records how much of the upload was read
+class CountingStream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+def test_txt_without_punctuation_stops_at_the_cap():
+    # 8 MB of log-like text with no sentence endings
+    data = ("GET /index.html 200 user42 " * 3 + "\n").encode() * 100000
+    stream = CountingStream(data)
+
+    text = extractors.extract_text(stream, "access.txt", max_chars=500000)
+
+    assert len(text) == 500000
+    assert stream.bytes_read < len(data) // 4
+
+def test_txt_without_punctuation_keeps_every_word():
+    data = ("word " * 15 + "\n").encode() * 30000
+
+    text = "".join(extractors.extract_text_from_txt(io.BytesIO(data)))
+
+    assert text.split() == data.decode().split()
+
+def test_txt_splits_sentences_across_blocks(monkeypatch):
+    # Blocks end right after the punctuation, before the space that confirms it
+    monkeypatch.setattr(extractors, "READ_BLOCK_SIZE", 15)
+    data = b"First sentence. Second one!\nThird"
+
+    text = "".join(extractors.extract_text_from_txt(io.BytesIO(data)))
+
+    assert text == "First sentence.\nSecond one!\nThird"
+
+def test_xlsx_that_is_not_a_workbook_returns_an_error_message():
+    for data in (b"not a zip file", b"PK\x05\x06" + b"\x00" * 18):
+        text = "".join(extractors.extract_text_from_xlsx(io.BytesIO(data)))
+
+        assert text == "Error reading the XLSX file."
+
+def test_csv_profile_finds_top_values_and_estimates_distinct_past_the_cap(monkeypatch):
+    monkeypatch.setattr(extractors, "CSV_MAX_DISTINCT", 100)
+    profile = extractors.ColumnProfile("code")
+    # The repeated value only shows up after far more distinct values than are kept
+    profile.add_values([f"u{i}" for i in range(20000)])
+    profile.add_values(["HOT"] * 500)
+    profile.add_values([f"v{i}" for i in range(5000)])
+
+    distinct, estimated = profile.distinct()
+
+    assert estimated and 20000 < distinct < 30000
+    assert profile.values.most_common(1)[0][0] == "HOT"
+    assert len(profile.values) < 200
+    assert "about" in profile.describe(25500)
@@ -0,0 +1,37 @@
+import time
+import threading
+
+import ocr
+from pools import SharedPool
+
+def slow_text(text, seconds):
+    time.sleep(seconds)
+    return text
+
+def test_one_document_timing_out_leaves_others_running(monkeypatch):
+    shared = SharedPool(2)
+    monkeypatch.setattr(ocr, "ocr_pool", shared)
+    monkeypatch.setattr(ocr, "OCR_WORKERS", 2)
+    texts = {}
+
+    # A scan that hangs past its deadline, and a document recognised meanwhile
+    def run(name, seconds, timeout):
+        with ocr.OcrJob() as job:
+            job.deadline = time.monotonic() + timeout
+            texts[name] = job.wait_for(job.submit(slow_text, name, seconds))
+
+    try:
+        stuck = threading.Thread(target=run, args=("stuck", 30, 0.2))
+        other = threading.Thread(target=run, args=("other", 1, 10))
+        stuck.start()
+        other.start()
+        stuck.join(10)
+        other.join(10)
+
+        assert texts == {"stuck": None, "other": "other"}
+        # The retired pool was terminated once both were done, new documents get a fresh one
+        assert shared.pool is None and not shared.users
+        with ocr.OcrJob() as job:
+            assert job.wait_for(job.submit(slow_text, "next", 0)) == "next"
+    finally:
+        shared.terminate()
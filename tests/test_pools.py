@@ -0,0 +1,46 @@
+import time
+import multiprocessing
+
+from pools import SharedPool
+
+def slow_square(value, seconds):
+    time.sleep(seconds)
+    return value * value
+
+def test_timeout_does_not_cancel_other_requests():
+    shared = SharedPool(2)
+    try:
+        # Two uploads share the pool; the first one's task hangs past its deadline
+        stuck_pool = shared.acquire()
+        stuck = stuck_pool.apply_async(slow_square, (2, 30))
+        other_pool = shared.acquire()
+        other = other_pool.apply_async(slow_square, (3, 0.5))
+
+        try:
+            stuck.get(timeout=0.1)
+        except multiprocessing.TimeoutError:
+            shared.release(stuck_pool, retire=True)
+
+        # The other upload still gets its result from the retired pool
+        assert other.get(timeout=10) == 9
+        # New uploads get a fresh pool
+        fresh_pool = shared.acquire()
+        assert fresh_pool is not other_pool
+        assert fresh_pool.apply_async(slow_square, (4, 0)).get(timeout=10) == 16
+        shared.release(fresh_pool)
+
+        # The retired pool goes away with its last user, stuck task included
+        shared.release(other_pool)
+        assert other_pool not in shared.users
+    finally:
+        shared.terminate()
+
+def test_release_keeps_the_current_pool():
+    shared = SharedPool(1)
+    try:
+        pool = shared.acquire()
+        shared.release(pool)
+        assert shared.acquire() is pool
+        shared.release(pool)
+    finally:
+        shared.terminate()
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+qdrant_client = pytest.importorskip("qdrant_client")
+pytest.importorskip("tqdm")
+
+from qa_pipeline import (
+    PAYLOAD_COLUMNS,
+    iter_qa_batches,
+    ensure_collection,
+    embed_and_upload,
+    point_ids,
+    content_hashes,
+    fetch_content_hashes,
+    compute_delta,
+    delete_points,
+)
+
+DIMENSION = 4
+
+# Embedder that derives a vector from the text and records every batch it encodes
+class StubEmbedder:
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        return np.array(
+            [[len(text), text.count(" "), sum(map(ord, text)) % 97, 1.0] for text in texts],
+            dtype=np.float32,
+        )
+
+# Function to write a SQuAD-format file with one entry per title
+def write_squad(path, frameworks):
+    dataset = [
+        {
+            "framework": framework,
+            "data": [
+                {
+                    "title": title,
+                    "context": f"Context of {title}",
+                    "paragraphs": [
+                        {"qas": [{"question": q, "answers": [{"text": f"Answer to {q}"}]} for q in questions]}
+                    ],
+                }
+                for title, questions in entries.items()
+            ],
+        }
+        for framework, entries in frameworks.items()
+    ]
+    path.write_text(json.dumps({"version": "1", "dataset": dataset}), encoding="utf-8")
+
+# Function to build the corpus the way LLM training.py does: indexed by point id, with content hashes
+def build_corpus(rows, model_name="stub"):
+    corpus = pd.DataFrame(rows, columns=PAYLOAD_COLUMNS)
+    corpus.index = point_ids(corpus)
+    corpus["content_hash"] = content_hashes(corpus, model_name)
+    return corpus
+
+# Function to sync the corpus into the collection, returns the number of points uploaded
+def sync(qdrant, corpus, embedder, batch_size=2):
+    changed, stale_ids = compute_delta(corpus, fetch_content_hashes(qdrant, "qa"))
+    uploaded = 0
+    if len(changed):
+        uploaded = embed_and_upload(
+            changed, embedder, qdrant, "qa", batch_size=batch_size, upload_workers=2, queue_size=1,
+            payload_columns=PAYLOAD_COLUMNS + ["content_hash"],
+        )
+    if stale_ids:
+        delete_points(qdrant, "qa", stale_ids)
+    return uploaded
+
+def qa_row(framework, title, question, answer=None):
+    return [framework, title, question, answer or f"Answer to {question}", f"Context of {title}"]
+
+def test_qa_batches_are_bounded(tmp_path):
+    path = tmp_path / "qas.json"
+    write_squad(path, {
+        "ISO 27001": {"A.5.1": ["q1", "q2", "q3"], "A.5.2": ["q4"]},
+        "SOC 2": {"CC6.1": ["q5", "q6", "q7"]},
+    })
+
+    batches = list(iter_qa_batches(str(path), batch_size=3))
+
+    assert [len(batch["question"]) for batch in batches] == [3, 3, 1]
+    for batch in batches:
+        assert {len(values) for values in batch.values()} == {len(batch["question"])}
+    assert [q for batch in batches for q in batch["question"]] == [f"q{i}" for i in range(1, 8)]
+    assert batches[-1]["framework"] == ["SOC 2"]
+
+def test_point_ids_do_not_depend_on_row_order():
+    rows = [qa_row("ISO 27001", "A.5.1", f"q{i}") for i in range(5)]
+    ids = dict(zip((row[2] for row in rows), point_ids(pd.DataFrame(rows, columns=PAYLOAD_COLUMNS))))
+
+    # Reordered, with a new QA inserted in the middle
+    reordered = rows[::-1]
+    reordered.insert(2, qa_row("ISO 27001", "A.5.1", "new"))
+    again = dict(zip((row[2] for row in reordered), point_ids(pd.DataFrame(reordered, columns=PAYLOAD_COLUMNS))))
+
+    assert all(again[question] == point_id for question, point_id in ids.items())
+    assert len(set(again.values())) == len(reordered)
+
+def test_resync_uploads_only_changed_qas():
+    qdrant = qdrant_client.QdrantClient(":memory:")
+    ensure_collection(qdrant, "qa", DIMENSION)
+    rows = [qa_row("ISO 27001", "A.5.1", f"q{i}") for i in range(7)]
+    embedder = StubEmbedder()
+
+    assert sync(qdrant, build_corpus(rows), embedder) == 7
+    assert max(len(batch) for batch in embedder.batches) <= 2
+    assert qdrant.count("qa").count == 7
+
+    # One answer changes, one QA is added and one removed
+    rows[3] = qa_row("ISO 27001", "A.5.1", "q3", "A revised answer")
+    rows.append(qa_row("ISO 27001", "A.5.2", "q7"))
+    del rows[0]
+    embedder = StubEmbedder()
+
+    assert sync(qdrant, build_corpus(rows), embedder) == 2
+    assert sorted(q for batch in embedder.batches for q in batch) == ["q3", "q7"]
+    assert qdrant.count("qa").count == 7
+
+    # Nothing changed, nothing is uploaded
+    embedder = StubEmbedder()
+    assert sync(qdrant, build_corpus(rows), embedder) == 0
+    assert embedder.batches == []